@@ -5,38 +5,22 @@ import plotly.graph_objects as go
 from datetime import datetime
 import numpy as np
 
-import sqlite3
 import pandas as pd
 
+from utils.population_cube import obter_cubo_populacao, populacao_por_ano
+from utils.population_db import fonte_populacao_paineis
+from utils.data_cache import cache_versionado, versao_arquivos, impressao_digital
+from utils.diagnosis_tree import (montar_arvore_diagnosticos, opcoes_diagnostico, formatar_opcao_diagnostico,
+                                  NIVEIS_CAUSA_BASICA_SIM)
+from utils.municipality_dim import load_municipality_dim, municipios_da_uf, formatar_municipio
+from utils.result_store import assinatura_filtros, obter_resultado
+
 #  alterar preto e pardo para negro 
 # gerar banco de dados de taxas de mortalidade por transtornos mentais
 def get_population_data(codigo_municipio=None, estado=None, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False):
-    if raca:
-        raca = raca.replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-    
-    query = "SELECT ano, SUM(populacao) as tam_pop FROM populacao WHERE 1=1"
-    
-    if codigo_municipio:
-        query += f" AND codigo_municipio = '{codigo_municipio}'"
-    if estado:
-        query += f" AND SUBSTR(codigo_municipio, 1, 2) = '{estado}'"
-    if raca:
-        if usar_raca_cor2 and raca == "Negra":
-            query += f" AND (raca = 'Preta' OR raca = 'Parda')"
-        else:
-            query += f" AND raca = '{raca}'"
-    if sexo:
-        query += f" AND sexo = '{sexo}'"
-    if faixa_etaria:
-        query += f" AND faixa_etaria = '{faixa_etaria}'"
-    
-    query += " and ano < 2024 GROUP BY ano"
-    
-    conn = sqlite3.connect('populacao.db')
-    df_populacao = pd.read_sql_query(query, conn)
-    conn.close()
-    
-    return df_populacao
+    # Fatia do cubo de população (montado uma vez a partir do populacao.db)
+    return populacao_por_ano(obter_cubo_populacao(), codigo_municipio=codigo_municipio, estado=estado,
+                             raca=raca, sexo=sexo, faixa_etaria=faixa_etaria, usar_raca_cor2=usar_raca_cor2)
 
 
 
@@ -135,11 +119,25 @@ st.title("Análise de Mortalidade por Transtornos Mentais (CID-10 Capítulo V)")
 st.sidebar.header("Filtros")
 
 # Carregar dados para os filtros
-@st.cache_data
+@cache_versionado(versao_arquivos('sim_limpo_e_alterado.csv'))
 def load_data():
     return pd.read_csv('sim_limpo_e_alterado.csv')
 
+# Árvore da causa básica (grupo → categoria → subcategoria, com o número de óbitos de cada nó),
+# montada uma vez por versão do arquivo para preencher os selectbox
+@cache_versionado(versao_arquivos('sim_limpo_e_alterado.csv'), recurso=True)
+def load_causabas_tree():
+    return montar_arvore_diagnosticos(load_data(), NIVEIS_CAUSA_BASICA_SIM)
+
+# Códigos dos municípios de residência presentes no SIM, em ordem crescente, listados uma vez
+# por versão do arquivo para o filtro de município
+@cache_versionado(versao_arquivos('sim_limpo_e_alterado.csv'), recurso=True)
+def load_municipios_sim():
+    return np.sort(load_data()['CODMUNRES'].dropna().unique().astype(np.int64))
+
 df = load_data()
+arvore_causabas = load_causabas_tree()
+dimensao_municipios = load_municipality_dim()
 
 # Opção para escolher entre Raça/Cor tradicional ou Raça/Cor 2
 usar_raca_cor2 = st.sidebar.radio(
@@ -215,18 +213,13 @@ raca = st.sidebar.selectbox(
 raca = None if raca == "Todas" else raca
 
 # Filtros
-codigo_municipio_options = ["Todos"]
-if estado:
-    # Filtra municípios pelo estado selecionado
-    codigos_filtrados = [str(cod) for cod in sorted(df['CODMUNRES'].unique()) if str(cod).startswith(estado)]
-    codigo_municipio_options += codigos_filtrados
-else:
-    codigo_municipio_options += [str(cod) for cod in sorted(df['CODMUNRES'].unique())]
+codigo_municipio_options = ["Todos"] + [str(codigo) for codigo in municipios_da_uf(dimensao_municipios, estado, load_municipios_sim())]
 
 codigo_municipio_option = st.sidebar.selectbox(
     "Código do Município",
     options=codigo_municipio_options,
-    index=0
+    index=0,
+    format_func=formatar_municipio(dimensao_municipios, "{codigo} - {nome}")
 )
 
 codigo_municipio = None if codigo_municipio_option == "Todos" else int(codigo_municipio_option)
@@ -253,11 +246,12 @@ sexo = st.sidebar.selectbox(
 sexo = None if sexo == "Todos" else sexo
 
 # Novos filtros para causabas - implementação hierárquica
-causabas_grupo_options = ["Todos"] + sorted([str(x) for x in df['causabas_grupo'].dropna().unique().tolist() if x is not None])
+causabas_grupo_options = ["Todos"] + opcoes_diagnostico(arvore_causabas)
 causabas_grupo = st.sidebar.selectbox(
     "Grupo da Causa Base",
     options=causabas_grupo_options,
-    index=0
+    index=0,
+    format_func=formatar_opcao_diagnostico(arvore_causabas)
 )
 causabas_grupo = None if causabas_grupo == "Todos" else causabas_grupo
 
@@ -269,12 +263,13 @@ if causabas_grupo is None:
     causabas_categoria_disabled = True
 else:
     # Se um grupo for selecionado, mostra as categorias correspondentes
-    categorias_filtradas = sorted([str(x) for x in df[df['causabas_grupo'] == causabas_grupo]['causabas_categoria'].dropna().unique().tolist() if x is not None])
+    categorias_filtradas = opcoes_diagnostico(arvore_causabas, causabas_grupo)
     causabas_categoria_options = ["Todas"] + categorias_filtradas
     causabas_categoria = st.sidebar.selectbox(
         "Categoria da Causa Base",
         options=causabas_categoria_options,
-        index=0
+        index=0,
+        format_func=formatar_opcao_diagnostico(arvore_causabas, causabas_grupo)
     )
     causabas_categoria = None if causabas_categoria == "Todas" else causabas_categoria
     causabas_categoria_disabled = False
@@ -290,18 +285,29 @@ if causabas_categoria is None:
     causabas_subcategoria_disabled = True
 else:
     # Se uma categoria for selecionada, mostra as subcategorias correspondentes
-    subcategorias_filtradas = sorted([str(x) for x in df[df['causabas_categoria'] == causabas_categoria]['causabas_subcategoria'].dropna().unique().tolist() if x is not None])
+    subcategorias_filtradas = opcoes_diagnostico(arvore_causabas, causabas_grupo, causabas_categoria)
     causabas_subcategoria_options = ["Todas"] + subcategorias_filtradas
     causabas_subcategoria = st.sidebar.selectbox(
         "Subcategoria da Causa Base",
         options=causabas_subcategoria_options,
-        index=0
+        index=0,
+        format_func=formatar_opcao_diagnostico(arvore_causabas, causabas_grupo, causabas_categoria)
     )
     causabas_subcategoria = None if causabas_subcategoria == "Todas" else causabas_subcategoria
     causabas_subcategoria_disabled = False
 
-# Calcular taxa de mortalidade
-taxa_mortalidade = calcular_taxa_mortalidade(
+# Calcular taxa de mortalidade (guardada pela assinatura dos filtros e pela versão do SIM e da população)
+assinatura = assinatura_filtros(
+    'app_taxa_mortalidade',
+    {'uf': estado, 'municipio': codigo_municipio, 'sexo': sexo, 'faixa_etaria': faixa_etaria, 'raca': raca,
+     'diag_grupo': causabas_grupo, 'diag_categoria': causabas_categoria, 'diag_subcategoria': causabas_subcategoria},
+    usar_raca_cor2,
+    versao_dados=impressao_digital('sim_limpo_e_alterado.csv', fonte_populacao_paineis()[0])
+)
+taxa_mortalidade = obter_resultado(
+    assinatura,
+    'taxa_mortalidade',
+    calcular_taxa_mortalidade,
     codigo_municipio=codigo_municipio,
     estado=estado,
     raca=raca,
@@ -9,9 +9,14 @@ from datetime import datetime
 
 # Importar funções auxiliares dos módulos utils
 from utils.helpers import mostrar_filtros_aplicados, ajustar_dados_raca, load_municipalities, get_estados_dict
-from utils.data_loaders import (load_health_data, load_idsc_data, load_cir_data, 
+from utils.diagnosis_tree import opcoes_diagnostico, formatar_opcao_diagnostico
+from utils.municipality_dim import load_municipality_dim, municipios_da_uf, formatar_municipio
+from utils.filter_index import filtros_painel, filtrar_dataframe, contar_linhas
+from utils.data_loaders import (load_health_data, load_filter_index, load_diagnosis_tree, load_sih_years, load_idsc_data, load_cir_data, 
                                calcular_taxa_mortalidade_municipio, calcular_tempo_permanencia_municipio,
-                               load_population_data, calcular_taxa_internacao_por_100k)
+                               load_population_data, calcular_taxa_internacao_por_100k,
+                               versao_recorte, versao_populacao_municipios)
+from utils.result_store import assinatura_filtros, obter_resultado, sob_demanda
 
 # Set page configuration
 st.set_page_config(
@@ -131,9 +136,6 @@ def ajustar_dados_raca(df, coluna_raca, usar_raca_cor2=False):
 
 # Load data
 try:
-    # Load main health data 
-    df = load_health_data()
-    
     # Load CIR classification data
     cir_result = load_cir_data()
     if cir_result:
@@ -144,9 +146,7 @@ try:
     
     # Load municipalities dictionary
     municipios_dict = load_municipalities()
-    
-    # Load CIR group data from base_magda.xlsx
-    cir_numeric_df = pd.read_excel('data/base_magda.xlsx')
+    dimensao_municipios = load_municipality_dim()
     
     # Display loading message
     with st.spinner('Carregando dados...'):
@@ -156,7 +156,7 @@ try:
     st.sidebar.header("Filtros")
     
     # Filter by year range
-    years = sorted(df['ANO_CMPT'].unique())
+    years = load_sih_years()
     year_range = st.sidebar.slider(
         "Período de análise:",
         min_value=int(min(years)),
@@ -176,20 +176,22 @@ try:
     estado_nome = st.sidebar.selectbox("Estado:", list(estados.keys()))
     estado_codigo = estados[estado_nome]
     
+    # Carregar apenas as partições do período e do estado selecionados
+    df = load_health_data(year_range, estado_codigo, painel='grupo_cir_with_taxa')
+    
     # Filtro por Município (se um estado estiver selecionado)
     codigo_municipio = None
     if estado_nome != "Todos":
-        # Filtrar municípios pelo estado selecionado
-        municipios_estado = {k: v for k, v in municipios_dict.items() if k.startswith(estado_codigo)}
-        
-        # Criar lista para o selectbox com o formato: "Nome do Município (Código)"
-        municipios_lista = ["Todos"] + [f"{v} ({k})" for k, v in municipios_estado.items()]
+        # Municípios do estado selecionado, da dimensão de municípios, exibidos no formato
+        # "Nome do Município (Código)"
+        municipios_lista = ["Todos"] + [str(codigo) for codigo in municipios_da_uf(dimensao_municipios, estado_codigo)]
         
-        municipio_selecionado = st.sidebar.selectbox("Município:", municipios_lista)
+        municipio_selecionado = st.sidebar.selectbox("Município:", municipios_lista,
+                                                     format_func=formatar_municipio(dimensao_municipios))
         
-        # Extrair o código do município, se selecionado
+        # Código do município, se selecionado
         if municipio_selecionado != "Todos":
-            codigo_municipio = municipio_selecionado.split("(")[1].replace(")", "").strip()
+            codigo_municipio = municipio_selecionado
     
     # Filtro por sexo
     sexo = st.sidebar.selectbox("Sexo:", ["Todos", "Masculino", "Feminino"])
@@ -213,9 +215,11 @@ try:
     grupo_cir_selecionado = st.sidebar.selectbox("Grupo CIR:", grupos_cir)
     
     # Diagnostic Group Filter using tree structure
-    # Get unique diagnostic groups
-    grupos_diagnosticos = ["Todos"] + sorted(df['def_diag_princ_grupo'].unique().tolist())
-    diag_grupo = st.sidebar.selectbox("Grupo Diagnóstico:", grupos_diagnosticos)
+    # Opções lidas da árvore diagnóstica do recorte (montada no carregamento), com a contagem de internações
+    arvore_diagnosticos = load_diagnosis_tree(year_range, estado_codigo, painel='grupo_cir_with_taxa')
+    grupos_diagnosticos = ["Todos"] + opcoes_diagnostico(arvore_diagnosticos)
+    diag_grupo = st.sidebar.selectbox("Grupo Diagnóstico:", grupos_diagnosticos,
+                                      format_func=formatar_opcao_diagnostico(arvore_diagnosticos))
     
     # Initialize category and subcategory filters
     diag_categoria = None
@@ -223,101 +227,40 @@ try:
     
     # If a diagnostic group is selected, show categories
     if diag_grupo != "Todos":
-        df_filtered_grupo = df[df['def_diag_princ_grupo'] == diag_grupo]
-        categorias = ["Todas"] + sorted(df_filtered_grupo['def_diag_princ_cat'].unique().tolist())
-        diag_categoria = st.sidebar.selectbox("Categoria Diagnóstica:", categorias)
+        categorias = ["Todas"] + opcoes_diagnostico(arvore_diagnosticos, diag_grupo)
+        diag_categoria = st.sidebar.selectbox("Categoria Diagnóstica:", categorias,
+                                              format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo))
         
         # If a category is selected, show subcategories
         if diag_categoria != "Todas":
-            df_filtered_cat = df_filtered_grupo[df_filtered_grupo['def_diag_princ_cat'] == diag_categoria]
-            subcategorias = ["Todas"] + sorted(df_filtered_cat['def_diag_princ_subcategoria'].unique().tolist())
-            diag_subcategoria = st.sidebar.selectbox("Subcategoria Diagnóstica:", subcategorias)
+            subcategorias = ["Todas"] + opcoes_diagnostico(arvore_diagnosticos, diag_grupo, diag_categoria)
+            diag_subcategoria = st.sidebar.selectbox("Subcategoria Diagnóstica:", subcategorias,
+                                                     format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo,
+                                                                                            diag_categoria))
 
     # Tab 1: Overview
     with st.expander("Visão Geral"):
         st.header("Visão Geral dos Indicadores por Grupo CIR")
         
-        # Filtrar dados conforme os filtros aplicados
-        filtered_df = df.copy()
-        
-        # Filtrar por ano
-        filtered_df = filtered_df[
-            (filtered_df['ANO_CMPT'] >= year_range[0]) & 
-            (filtered_df['ANO_CMPT'] <= year_range[1])
-        ]
-        
-        # Filtrar por estado
-        if estado_codigo:
-            filtered_df = filtered_df[filtered_df['res_CODIGO_UF'].astype(str) == estado_codigo]
-        
-        # Filtrar por município
-        if codigo_municipio:
-            filtered_df = filtered_df[filtered_df['MUNIC_RES'].astype(str) == codigo_municipio]
+        # Filtrar dados conforme os filtros aplicados, cruzando os bitmaps do índice de filtros
+        indice_filtros = load_filter_index(year_range, estado_codigo, painel='grupo_cir_with_taxa')
+        filtros = filtros_painel(year_range, estado_codigo, codigo_municipio, sexo, faixa_etaria, raca,
+                                 usar_raca_cor2, grupo_cir_selecionado, diag_grupo, diag_categoria, diag_subcategoria)
         
-        # Filtrar por sexo
-        if sexo != "Todos":
-            if sexo == "Masculino":
-                filtered_df = filtered_df[filtered_df['SEXO'] == 1]
-            elif sexo == "Feminino":
-                filtered_df = filtered_df[filtered_df['SEXO'] == 3]
-        
-        # Filtrar por faixa etária
-        if faixa_etaria != "Todas":
-            age_ranges = {
-                '0-4': (0, 4),
-                '5-9': (5, 9),
-                '10-14': (10, 14),
-                '15-19': (15, 19),
-                '20-24': (20, 24),
-                '25-29': (25, 29),
-                '30-34': (30, 34),
-                '35-39': (35, 39),
-                '40-44': (40, 44),
-                '45-49': (45, 49),
-                '50-54': (50, 54),
-                '55-59': (55, 59),
-                '60-64': (60, 64),
-                '65-69': (65, 69),
-                '70-74': (70, 74),
-                '75-79': (75, 79),
-                '80-84': (80, 84),
-                '85-89': (85, 89),
-                '90+': (90, float('inf'))
-            }
-            age_min, age_max = age_ranges[faixa_etaria]
-            filtered_df = filtered_df[(filtered_df['IDADE'] >= age_min) & (filtered_df['IDADE'] <= age_max)]
-        
-        # Filtrar por raça/cor
-        if raca != "Todas":
-            if usar_raca_cor2 and raca == "Negra":
-                filtered_df = filtered_df[filtered_df['RACA_COR_DESC'].isin(["Preta", "Parda"])]
-            else:
-                filtered_df = filtered_df[filtered_df['RACA_COR_DESC'] == raca]
-        
-        # Filtrar por grupo CIR
-        if grupo_cir_selecionado != "Todos":
-            filtered_df = filtered_df[filtered_df['MUNIC_RES'].map(cir_dict) == grupo_cir_selecionado]
-        
-        # Filtrar por grupo diagnóstico
-        if diag_grupo != "Todos":
-            filtered_df = filtered_df[filtered_df['def_diag_princ_grupo'] == diag_grupo]
-            
-            # Filtrar por categoria diagnóstica
-            if diag_categoria != "Todas":
-                filtered_df = filtered_df[filtered_df['def_diag_princ_cat'] == diag_categoria]
-                
-                # Filtrar por subcategoria diagnóstica
-                if diag_subcategoria != "Todas":
-                    filtered_df = filtered_df[filtered_df['def_diag_princ_subcategoria'] == diag_subcategoria]
+        # Os agregados por grupo ficam guardados pela assinatura da visão (filtros e versão do SIH, da
+        # CIR e da população); o recorte só é filtrado quando algum deles ainda não foi calculado
+        assinatura = assinatura_filtros('grupo_cir_with_taxa', filtros, usar_raca_cor2,
+                                        versao_dados=(versao_recorte(year_range, estado_codigo, painel='grupo_cir_with_taxa'),
+                                                      versao_populacao_municipios()))
+        filtered_df = sob_demanda(filtrar_dataframe, df, indice_filtros, filtros)
         
         # Mostrar resumo dos filtros aplicados
         mostrar_filtros_aplicados(year_range, estado_nome, codigo_municipio, sexo, faixa_etaria, raca, municipios_dict, usar_raca_cor2, diag_grupo, diag_categoria, diag_subcategoria, grupo_cir_selecionado)
         
-        # Merge this data with the main dataframe to use numeric CIR groups
-        filtered_df = filtered_df.merge(cir_numeric_df[['IBGE', 'Grupo_CIR']], left_on='MUNIC_RES', right_on='IBGE', how='left')
+        # O grupo CIR numérico (Grupo_CIR) já vem no DataFrame, atribuído no carregamento
         
         # Verificar se existem dados após a filtragem
-        if filtered_df.empty:
+        if contar_linhas(indice_filtros, filtros) == 0:
             st.warning("Não há dados disponíveis para os critérios selecionados. Por favor, altere os filtros.")
         else:
             # Update visualizations to use numeric CIR groups
@@ -325,16 +268,17 @@ try:
             st.subheader("Taxa de Mortalidade por Grupo CIR (Numérico)")
             
             # Verificar se a coluna Grupo_CIR existe no DataFrame
-            if 'Grupo_CIR' not in filtered_df.columns:
+            if 'Grupo_CIR' not in df.columns:
                 st.warning("A coluna 'Grupo_CIR' não está disponível no conjunto de dados. Verifique se o arquivo base_magda.xlsx está corretamente configurado.")
             else:
-                mortalidade_por_grupo = calcular_taxa_mortalidade_municipio(filtered_df)
+                mortalidade_por_grupo = obter_resultado(assinatura, 'mortalidade_municipio',
+                                                        lambda: calcular_taxa_mortalidade_municipio(filtered_df()))
                 
                 # Verificar se Grupo_CIR existe no DataFrame resultante
                 if 'Grupo_CIR' not in mortalidade_por_grupo.columns:
                     # Tentar fazer merge novamente
                     mortalidade_por_grupo = mortalidade_por_grupo.merge(
-                        filtered_df[['MUNIC_RES', 'Grupo_CIR']].drop_duplicates(), 
+                        filtered_df()[['MUNIC_RES', 'Grupo_CIR']].drop_duplicates(), 
                         on='MUNIC_RES', 
                         how='left'
                     )
@@ -354,10 +298,11 @@ try:
             st.subheader("Número de Internações por Grupo CIR (Numérico)")
             
             # Verificar se a coluna Grupo_CIR existe no DataFrame
-            if 'Grupo_CIR' not in filtered_df.columns:
+            if 'Grupo_CIR' not in df.columns:
                 st.warning("A coluna 'Grupo_CIR' não está disponível para a visualização de número de internações.")
             else:
-                internacoes_por_grupo = filtered_df.groupby('Grupo_CIR').size().reset_index(name='Contagem')
+                internacoes_por_grupo = obter_resultado(assinatura, 'internacoes_grupo', lambda: (
+                    filtered_df().groupby('Grupo_CIR').size().reset_index(name='Contagem')))
                 internacoes_por_grupo.columns = ['Grupo CIR (Numérico)', 'Número de Internações']
                 
                 fig = px.bar(
@@ -373,16 +318,17 @@ try:
             st.subheader("Tempo Médio de Permanência por Grupo CIR (Numérico)")
             
             # Verificar se a coluna Grupo_CIR existe no DataFrame
-            if 'Grupo_CIR' not in filtered_df.columns:
+            if 'Grupo_CIR' not in df.columns:
                 st.warning("A coluna 'Grupo_CIR' não está disponível para a visualização de tempo médio de permanência.")
             else:
-                permanencia_por_grupo = calcular_tempo_permanencia_municipio(filtered_df)
+                permanencia_por_grupo = obter_resultado(assinatura, 'permanencia_municipio',
+                                                        lambda: calcular_tempo_permanencia_municipio(filtered_df()))
                 
                 # Verificar se Grupo_CIR existe no DataFrame resultante
                 if 'Grupo_CIR' not in permanencia_por_grupo.columns:
                     # Tentar fazer merge novamente
                     permanencia_por_grupo = permanencia_por_grupo.merge(
-                        filtered_df[['MUNIC_RES', 'Grupo_CIR']].drop_duplicates(), 
+                        filtered_df()[['MUNIC_RES', 'Grupo_CIR']].drop_duplicates(), 
                         on='MUNIC_RES', 
                         how='left'
                     )
@@ -402,7 +348,7 @@ try:
             st.subheader("Taxa de Internações por 100k Habitantes por Grupo CIR (Numérico)")
             
             # Verificar se a coluna Grupo_CIR existe no DataFrame
-            if 'Grupo_CIR' not in filtered_df.columns:
+            if 'Grupo_CIR' not in df.columns:
                 st.warning("A coluna 'Grupo_CIR' não está disponível para a visualização de taxa de internações por 100k habitantes.")
             else:
                 # Obter dados de população com base nos filtros aplicados
@@ -424,13 +370,14 @@ try:
                     st.warning("Não há dados de população disponíveis para calcular a taxa por 100k habitantes.")
                 else:
                     # Calcular taxa de internações por 100k habitantes
-                    taxa_internacao = calcular_taxa_internacao_por_100k(filtered_df, df_pop)
+                    taxa_internacao = obter_resultado(assinatura, 'taxa_internacao',
+                                                      lambda: calcular_taxa_internacao_por_100k(filtered_df(), df_pop))
                     
                     # Verificar se Grupo_CIR existe no DataFrame resultante
                     if 'Grupo_CIR' not in taxa_internacao.columns:
                         # Tentar fazer merge novamente
                         taxa_internacao = taxa_internacao.merge(
-                            filtered_df[['MUNIC_RES', 'Grupo_CIR']].drop_duplicates(), 
+                            filtered_df()[['MUNIC_RES', 'Grupo_CIR']].drop_duplicates(), 
                             on='MUNIC_RES', 
                             how='left'
                         )
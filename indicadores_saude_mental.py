@@ -9,8 +9,16 @@ from datetime import datetime
 
 # Importar funções auxiliares dos módulos utils
 from utils.helpers import mostrar_filtros_aplicados, ajustar_dados_raca, load_municipalities, get_estados_dict
-from utils.data_loaders import (load_health_data, load_idsc_data, load_cir_data, 
-                               calcular_taxa_mortalidade_municipio, calcular_tempo_permanencia_municipio)
+from utils.diagnosis_tree import opcoes_diagnostico, formatar_opcao_diagnostico
+from utils.municipality_dim import load_municipality_dim, municipios_da_uf, formatar_municipio
+from utils.filter_index import filtros_painel, filtrar_dataframe
+from utils.data_loaders import (load_health_data, load_filter_index, load_diagnosis_tree, load_sih_years, load_idsc_data, load_cir_data, 
+                               calcular_taxa_mortalidade_municipio, calcular_tempo_permanencia_municipio,
+                               BASE_MAGDA_PATH, versao_recorte)
+from utils.data_cache import cache_versionado, versao_arquivos
+from utils.excel_store import ler_planilha
+from utils.result_store import assinatura_filtros, obter_resultado, sob_demanda
+from utils.regression_engine import matriz_correlacao
 
 # Set page configuration
 st.set_page_config(
@@ -27,10 +35,10 @@ e outros indicadores de saúde, utilizando dados do Sistema de Informações Hos
 """)
 
 # Função para carregar dados do base_magda.xlsx
-@st.cache_data
+@cache_versionado(versao_arquivos(BASE_MAGDA_PATH))
 def load_magda_data():
     try:
-        magda_df = pd.read_excel('data/base_magda.xlsx')
+        magda_df = ler_planilha(BASE_MAGDA_PATH)
         return magda_df
     except Exception as e:
         st.error(f"Erro ao carregar dados da base magda: {e}")
@@ -38,9 +46,6 @@ def load_magda_data():
 
 # Load data
 try:
-    # Load main health data
-    df = load_health_data()
-    
     # Load base magda data
     magda_df = load_magda_data()
     
@@ -52,6 +57,7 @@ try:
     
     # Load municipalities dictionary
     municipios_dict = load_municipalities()
+    dimensao_municipios = load_municipality_dim()
     
     # Display loading message
     with st.spinner('Carregando dados...'):
@@ -61,7 +67,7 @@ try:
     st.sidebar.header("Filtros")
     
     # Filter by year range
-    years = sorted(df['ANO_CMPT'].unique())
+    years = load_sih_years()
     year_range = st.sidebar.slider(
         "Período de análise:",
         min_value=int(min(years)),
@@ -81,20 +87,22 @@ try:
     estado_nome = st.sidebar.selectbox("Estado:", list(estados.keys()))
     estado_codigo = estados[estado_nome]
     
+    # Carregar apenas as partições do período e do estado selecionados
+    df = load_health_data(year_range, estado_codigo, painel='indicadores_saude_mental')
+    
     # Filtro por Município (se um estado estiver selecionado)
     codigo_municipio = None
     if estado_nome != "Todos":
-        # Filtrar municípios pelo estado selecionado
-        municipios_estado = {k: v for k, v in municipios_dict.items() if k.startswith(estado_codigo)}
+        # Municípios do estado selecionado, da dimensão de municípios, exibidos no formato
+        # "Nome do Município (Código)"
+        municipios_lista = ["Todos"] + [str(codigo) for codigo in municipios_da_uf(dimensao_municipios, estado_codigo)]
         
-        # Criar lista para o selectbox com o formato: "Nome do Município (Código)"
-        municipios_lista = ["Todos"] + [f"{v} ({k})" for k, v in municipios_estado.items()]
+        municipio_selecionado = st.sidebar.selectbox("Município:", municipios_lista,
+                                                     format_func=formatar_municipio(dimensao_municipios))
         
-        municipio_selecionado = st.sidebar.selectbox("Município:", municipios_lista)
-        
-        # Extrair o código do município, se selecionado
+        # Código do município, se selecionado
         if municipio_selecionado != "Todos":
-            codigo_municipio = municipio_selecionado.split("(")[1].replace(")", "").strip()
+            codigo_municipio = municipio_selecionado
     
     # Filtro por sexo
     sexo = st.sidebar.selectbox("Sexo:", ["Todos", "Masculino", "Feminino"])
@@ -118,9 +126,11 @@ try:
     grupo_cir_selecionado = st.sidebar.selectbox("Grupo CIR:", grupos_cir)
     
     # Diagnostic Group Filter using tree structure
-    # Get unique diagnostic groups
-    grupos_diagnosticos = ["Todos"] + sorted(df['def_diag_princ_grupo'].unique().tolist())
-    diag_grupo = st.sidebar.selectbox("Grupo Diagnóstico:", grupos_diagnosticos)
+    # Opções lidas da árvore diagnóstica do recorte (montada no carregamento), com a contagem de internações
+    arvore_diagnosticos = load_diagnosis_tree(year_range, estado_codigo, painel='indicadores_saude_mental')
+    grupos_diagnosticos = ["Todos"] + opcoes_diagnostico(arvore_diagnosticos)
+    diag_grupo = st.sidebar.selectbox("Grupo Diagnóstico:", grupos_diagnosticos,
+                                      format_func=formatar_opcao_diagnostico(arvore_diagnosticos))
     
     # Initialize category and subcategory filters
     diag_categoria = None
@@ -128,98 +138,39 @@ try:
     
     # If a diagnostic group is selected, show categories
     if diag_grupo != "Todos":
-        df_filtered_grupo = df[df['def_diag_princ_grupo'] == diag_grupo]
-        categorias = ["Todas"] + sorted(df_filtered_grupo['def_diag_princ_cat'].unique().tolist())
-        diag_categoria = st.sidebar.selectbox("Categoria Diagnóstica:", categorias)
+        categorias = ["Todas"] + opcoes_diagnostico(arvore_diagnosticos, diag_grupo)
+        diag_categoria = st.sidebar.selectbox("Categoria Diagnóstica:", categorias,
+                                              format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo))
         
         # If a category is selected, show subcategories
         if diag_categoria != "Todas":
-            df_filtered_cat = df_filtered_grupo[df_filtered_grupo['def_diag_princ_cat'] == diag_categoria]
-            subcategorias = ["Todas"] + sorted(df_filtered_cat['def_diag_princ_subcategoria'].unique().tolist())
-            diag_subcategoria = st.sidebar.selectbox("Subcategoria Diagnóstica:", subcategorias)
-    
-    # Filtrar dados conforme os filtros aplicados
-    filtered_df = df.copy()
-    
-    # Filtrar por ano
-    filtered_df = filtered_df[
-        (filtered_df['ANO_CMPT'] >= year_range[0]) & 
-        (filtered_df['ANO_CMPT'] <= year_range[1])
-    ]
-    
-    # Filtrar por estado
-    if estado_codigo:
-        filtered_df = filtered_df[filtered_df['res_CODIGO_UF'].astype(str) == estado_codigo]
-    
-    # Filtrar por município
-    if codigo_municipio:
-        filtered_df = filtered_df[filtered_df['MUNIC_RES'].astype(str) == codigo_municipio]
-    
-    # Filtrar por sexo
-    if sexo != "Todos":
-        if sexo == "Masculino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 1]
-        elif sexo == "Feminino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 3]
-    
-    # Filtrar por faixa etária
-    if faixa_etaria != "Todas":
-        age_ranges = {
-            '0-4': (0, 4),
-            '5-9': (5, 9),
-            '10-14': (10, 14),
-            '15-19': (15, 19),
-            '20-24': (20, 24),
-            '25-29': (25, 29),
-            '30-34': (30, 34),
-            '35-39': (35, 39),
-            '40-44': (40, 44),
-            '45-49': (45, 49),
-            '50-54': (50, 54),
-            '55-59': (55, 59),
-            '60-64': (60, 64),
-            '65-69': (65, 69),
-            '70-74': (70, 74),
-            '75-79': (75, 79),
-            '80-84': (80, 84),
-            '85-89': (85, 89),
-            '90+': (90, float('inf'))
-        }
-        age_min, age_max = age_ranges[faixa_etaria]
-        filtered_df = filtered_df[(filtered_df['IDADE'] >= age_min) & (filtered_df['IDADE'] <= age_max)]
-    
-    # Filtrar por raça/cor
-    if raca != "Todas":
-        if usar_raca_cor2 and raca == "Negra":
-            filtered_df = filtered_df[filtered_df['RACA_COR_DESC'].isin(["Preta", "Parda"])]
-        else:
-            filtered_df = filtered_df[filtered_df['RACA_COR_DESC'] == raca]
-    
-    # Filtrar por grupo CIR
-    if grupo_cir_selecionado != "Todos":
-        filtered_df = filtered_df[filtered_df['MUNIC_RES'].map(cir_dict) == grupo_cir_selecionado]
-    
-    # Filtrar por grupo diagnóstico
-    if diag_grupo != "Todos":
-        filtered_df = filtered_df[filtered_df['def_diag_princ_grupo'] == diag_grupo]
-        
-        # Filtrar por categoria diagnóstica
-        if diag_categoria != "Todas":
-            filtered_df = filtered_df[filtered_df['def_diag_princ_cat'] == diag_categoria]
-            
-            # Filtrar por subcategoria diagnóstica
-            if diag_subcategoria != "Todas":
-                filtered_df = filtered_df[filtered_df['def_diag_princ_subcategoria'] == diag_subcategoria]
+            subcategorias = ["Todas"] + opcoes_diagnostico(arvore_diagnosticos, diag_grupo, diag_categoria)
+            diag_subcategoria = st.sidebar.selectbox("Subcategoria Diagnóstica:", subcategorias,
+                                                     format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo,
+                                                                                            diag_categoria))
+    
+    # Filtrar dados conforme os filtros aplicados, cruzando os bitmaps do índice de filtros
+    indice_filtros = load_filter_index(year_range, estado_codigo, painel='indicadores_saude_mental')
+    filtros = filtros_painel(year_range, estado_codigo, codigo_municipio, sexo, faixa_etaria, raca,
+                             usar_raca_cor2, grupo_cir_selecionado, diag_grupo, diag_categoria, diag_subcategoria)
+    # Os indicadores por município só usam estas colunas; as demais não são materializadas.
+    # Os agregados ficam guardados pela assinatura da visão e o recorte só é filtrado quando falta algum.
+    assinatura = assinatura_filtros('indicadores_saude_mental', filtros, usar_raca_cor2,
+                                    versao_dados=versao_recorte(year_range, estado_codigo, painel='indicadores_saude_mental'))
+    filtered_df = sob_demanda(filtrar_dataframe, df, indice_filtros, filtros, colunas=['MUNIC_RES', 'MORTE', 'DIAS_PERM'])
     
     # Agregar dados por município
     # Calcular taxa de mortalidade
-    taxa_mortalidade_municipio = calcular_taxa_mortalidade_municipio(filtered_df)
+    taxa_mortalidade_municipio = obter_resultado(assinatura, 'taxa_mortalidade_municipio',
+                                                 lambda: calcular_taxa_mortalidade_municipio(filtered_df()))
     
     # Calcular tempo médio de permanência
-    tempo_permanencia_municipio = calcular_tempo_permanencia_municipio(filtered_df)
+    tempo_permanencia_municipio = obter_resultado(assinatura, 'tempo_permanencia_municipio',
+                                                  lambda: calcular_tempo_permanencia_municipio(filtered_df()))
     
     # Número de internações
-    internacoes_por_municipio = filtered_df.groupby('MUNIC_RES').size().reset_index(name='numero_internacoes')
+    internacoes_por_municipio = obter_resultado(assinatura, 'internacoes_municipio', lambda: (
+        filtered_df().groupby('MUNIC_RES').size().reset_index(name='numero_internacoes')))
     
     # Garantir que as colunas de chave sejam do mesmo tipo (string)
     internacoes_por_municipio['MUNIC_RES'] = internacoes_por_municipio['MUNIC_RES'].astype(str)
@@ -418,7 +369,7 @@ try:
             
             # Selecionar colunas numéricas para a matriz de correlação
             colunas_numericas = ['iCAPS', 'iRAPS', 'taxa_mortalidade', 'tempo_medio_permanencia', 'numero_internacoes']
-            corr_data = dados_completos[colunas_numericas].corr()
+            corr_data = matriz_correlacao(dados_completos, colunas_numericas)
             
             # Gerar o mapa de calor
             fig = px.imshow(
@@ -448,8 +399,8 @@ try:
             fig.update_layout(height=600)
             st.plotly_chart(fig, use_container_width=True)
             
-            # Calcular e mostrar a correlação estatística
-            corr_icaps_iraps = dados_completos['iCAPS'].corr(dados_completos['iRAPS'])
+            # Mostrar a correlação estatística (já calculada na matriz)
+            corr_icaps_iraps = corr_data.loc['iCAPS', 'iRAPS']
             st.info(f"Correlação entre iCAPS e iRAPS: {corr_icaps_iraps:.4f}")
         
         # Tab 5: Dados Brutos
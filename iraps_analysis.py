@@ -8,10 +8,17 @@ import seaborn as sns
 from datetime import datetime
 
 # Importar funções auxiliares dos módulos utils
-from utils.helpers import mostrar_filtros_aplicados, ajustar_dados_raca, load_municipalities, get_estados_dict
-from utils.data_loaders import (load_health_data, load_idsc_data, load_cir_data, 
-                               calcular_taxa_mortalidade_municipio, calcular_tempo_permanencia_municipio,
-                               load_population_data, calcular_taxa_internacao_por_100k)
+from utils.helpers import (mostrar_filtros_aplicados, ajustar_dados_raca, load_municipalities, get_estados_dict,
+                           canonizar_codigo_municipio)
+from utils.diagnosis_tree import opcoes_diagnostico, formatar_opcao_diagnostico
+from utils.municipality_dim import load_municipality_dim, municipios_da_uf, formatar_municipio
+from utils.filter_index import filtros_painel, filtrar_dataframe, contar_linhas
+from utils.data_loaders import (load_health_data, load_filter_index, load_diagnosis_tree, load_sih_years, load_idsc_data, load_cir_data,
+                               load_cir_numeric_data, calcular_taxa_mortalidade_municipio, calcular_tempo_permanencia_municipio,
+                               load_population_data, calcular_taxa_internacao_por_100k,
+                               versao_recorte, versao_populacao_municipios)
+from utils.result_store import assinatura_filtros, obter_resultado, sob_demanda
+from utils.regression_engine import regressoes_em_lote
 
 # Set page configuration
 st.set_page_config(
@@ -29,9 +36,6 @@ Este dashboard analisa o Índice RAPS (Rede de Atenção Psicossocial) em relaç
 
 # Load data
 try:
-    # Load main health data 
-    df = load_health_data()
-    
     # Load CIR classification data
     cir_result = load_cir_data()
     if cir_result is not None:
@@ -42,9 +46,10 @@ try:
     
     # Load municipalities dictionary
     municipios_dict = load_municipalities()
+    dimensao_municipios = load_municipality_dim()
     
     # Load CIR group data from base_magda.xlsx
-    cir_numeric_df = pd.read_excel('data/base_magda.xlsx')
+    cir_numeric_df = load_cir_numeric_data()
     
     # Display loading message
     with st.spinner('Carregando dados...'):
@@ -54,7 +59,7 @@ try:
     st.sidebar.header("Filtros")
     
     # Filter by year range
-    years = sorted(df['ANO_CMPT'].unique())
+    years = load_sih_years()
     year_range = st.sidebar.slider(
         "Período de análise:",
         min_value=int(min(years)),
@@ -74,20 +79,22 @@ try:
     estado_nome = st.sidebar.selectbox("Estado:", list(estados.keys()))
     estado_codigo = estados[estado_nome]
     
+    # Carregar apenas as partições do período e do estado selecionados
+    df = load_health_data(year_range, estado_codigo, painel='iraps_analysis')
+    
     # Filtro por Município (se um estado estiver selecionado)
     codigo_municipio = None
     if estado_nome != "Todos":
-        # Filtrar municípios pelo estado selecionado
-        municipios_estado = {k: v for k, v in municipios_dict.items() if k.startswith(estado_codigo)}
+        # Municípios do estado selecionado, da dimensão de municípios, exibidos no formato
+        # "Nome do Município (Código)"
+        municipios_lista = ["Todos"] + [str(codigo) for codigo in municipios_da_uf(dimensao_municipios, estado_codigo)]
         
-        # Criar lista para o selectbox com o formato: "Nome do Município (Código)"
-        municipios_lista = ["Todos"] + [f"{v} ({k})" for k, v in municipios_estado.items()]
+        municipio_selecionado = st.sidebar.selectbox("Município:", municipios_lista,
+                                                     format_func=formatar_municipio(dimensao_municipios))
         
-        municipio_selecionado = st.sidebar.selectbox("Município:", municipios_lista)
-        
-        # Extrair o código do município, se selecionado
+        # Código do município, se selecionado
         if municipio_selecionado != "Todos":
-            codigo_municipio = municipio_selecionado.split("(")[1].replace(")", "").strip()
+            codigo_municipio = municipio_selecionado
     
     # Filtro por sexo
     sexo = st.sidebar.selectbox("Sexo:", ["Todos", "Masculino", "Feminino"])
@@ -111,9 +118,11 @@ try:
     grupo_cir_selecionado = st.sidebar.selectbox("Grupo CIR:", grupos_cir)
     
     # Diagnostic Group Filter using tree structure
-    # Get unique diagnostic groups
-    grupos_diagnosticos = ["Todos"] + sorted(df['def_diag_princ_grupo'].unique().tolist())
-    diag_grupo = st.sidebar.selectbox("Grupo Diagnóstico:", grupos_diagnosticos)
+    # Opções lidas da árvore diagnóstica do recorte (montada no carregamento), com a contagem de internações
+    arvore_diagnosticos = load_diagnosis_tree(year_range, estado_codigo, painel='iraps_analysis')
+    grupos_diagnosticos = ["Todos"] + opcoes_diagnostico(arvore_diagnosticos)
+    diag_grupo = st.sidebar.selectbox("Grupo Diagnóstico:", grupos_diagnosticos,
+                                      format_func=formatar_opcao_diagnostico(arvore_diagnosticos))
     
     # Initialize category and subcategory filters
     diag_categoria = None
@@ -121,110 +130,42 @@ try:
     
     # If a diagnostic group is selected, show categories
     if diag_grupo != "Todos":
-        df_filtered_grupo = df[df['def_diag_princ_grupo'] == diag_grupo]
-        categorias = ["Todas"] + sorted(df_filtered_grupo['def_diag_princ_cat'].unique().tolist())
-        diag_categoria = st.sidebar.selectbox("Categoria Diagnóstica:", categorias)
+        categorias = ["Todas"] + opcoes_diagnostico(arvore_diagnosticos, diag_grupo)
+        diag_categoria = st.sidebar.selectbox("Categoria Diagnóstica:", categorias,
+                                              format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo))
         
         # If a category is selected, show subcategories
         if diag_categoria != "Todas":
-            df_filtered_cat = df_filtered_grupo[df_filtered_grupo['def_diag_princ_cat'] == diag_categoria]
-            subcategorias = ["Todas"] + sorted(df_filtered_cat['def_diag_princ_subcategoria'].unique().tolist())
-            diag_subcategoria = st.sidebar.selectbox("Subcategoria Diagnóstica:", subcategorias)
+            subcategorias = ["Todas"] + opcoes_diagnostico(arvore_diagnosticos, diag_grupo, diag_categoria)
+            diag_subcategoria = st.sidebar.selectbox("Subcategoria Diagnóstica:", subcategorias,
+                                                     format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo,
+                                                                                            diag_categoria))
 
     # Main content for iRAPS analysis
     st.header("Análise do Índice RAPS por Grupo CIR")
     
-    # Filtrar dados conforme os filtros aplicados
-    filtered_df = df.copy()
-    
-    # Filtrar por ano
-    filtered_df = filtered_df[
-        (filtered_df['ANO_CMPT'] >= year_range[0]) & 
-        (filtered_df['ANO_CMPT'] <= year_range[1])
-    ]
-    
-    # Filtrar por estado
-    if estado_codigo:
-        filtered_df = filtered_df[filtered_df['res_CODIGO_UF'].astype(str) == estado_codigo]
-    
-    # Filtrar por município
-    if codigo_municipio:
-        filtered_df = filtered_df[filtered_df['MUNIC_RES'].astype(str) == codigo_municipio]
-    
-    # Filtrar por sexo
-    if sexo != "Todos":
-        if sexo == "Masculino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 1]
-        elif sexo == "Feminino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 3]
-    
-    # Filtrar por faixa etária
-    if faixa_etaria != "Todas":
-        age_ranges = {
-            '0-4': (0, 4),
-            '5-9': (5, 9),
-            '10-14': (10, 14),
-            '15-19': (15, 19),
-            '20-24': (20, 24),
-            '25-29': (25, 29),
-            '30-34': (30, 34),
-            '35-39': (35, 39),
-            '40-44': (40, 44),
-            '45-49': (45, 49),
-            '50-54': (50, 54),
-            '55-59': (55, 59),
-            '60-64': (60, 64),
-            '65-69': (65, 69),
-            '70-74': (70, 74),
-            '75-79': (75, 79),
-            '80-84': (80, 84),
-            '85-89': (85, 89),
-            '90+': (90, float('inf'))
-        }
-        age_min, age_max = age_ranges[faixa_etaria]
-        filtered_df = filtered_df[(filtered_df['IDADE'] >= age_min) & (filtered_df['IDADE'] <= age_max)]
+    # Filtrar dados conforme os filtros aplicados, cruzando os bitmaps do índice de filtros
+    indice_filtros = load_filter_index(year_range, estado_codigo, painel='iraps_analysis')
+    filtros = filtros_painel(year_range, estado_codigo, codigo_municipio, sexo, faixa_etaria, raca,
+                             usar_raca_cor2, grupo_cir_selecionado, diag_grupo, diag_categoria, diag_subcategoria)
     
-    # Filtrar por raça/cor
-    if raca != "Todas":
-        if usar_raca_cor2 and raca == "Negra":
-            filtered_df = filtered_df[filtered_df['RACA_COR_DESC'].isin(["Preta", "Parda"])]
-        else:
-            filtered_df = filtered_df[filtered_df['RACA_COR_DESC'] == raca]
-    
-    # Filtrar por grupo CIR
-    if grupo_cir_selecionado != "Todos":
-        filtered_df = filtered_df[filtered_df['MUNIC_RES'].map(cir_dict) == grupo_cir_selecionado]
-    
-    # Filtrar por grupo diagnóstico
-    if diag_grupo != "Todos":
-        filtered_df = filtered_df[filtered_df['def_diag_princ_grupo'] == diag_grupo]
-        
-        # Filtrar por categoria diagnóstica
-        if diag_categoria != "Todas":
-            filtered_df = filtered_df[filtered_df['def_diag_princ_cat'] == diag_categoria]
-            
-            # Filtrar por subcategoria diagnóstica
-            if diag_subcategoria != "Todas":
-                filtered_df = filtered_df[filtered_df['def_diag_princ_subcategoria'] == diag_subcategoria]
+    # Os agregados ficam guardados pela assinatura da visão (filtros e versão do SIH, da CIR e da
+    # população); o recorte só é filtrado quando é preciso recalcular
+    assinatura = assinatura_filtros('iraps_analysis', filtros, usar_raca_cor2,
+                                    versao_dados=(versao_recorte(year_range, estado_codigo, painel='iraps_analysis'),
+                                                  versao_populacao_municipios()))
+    filtered_df = sob_demanda(filtrar_dataframe, df, indice_filtros, filtros)
     
     # Mostrar resumo dos filtros aplicados
     mostrar_filtros_aplicados(year_range, estado_nome, codigo_municipio, sexo, faixa_etaria, raca, municipios_dict, usar_raca_cor2, diag_grupo, diag_categoria, diag_subcategoria, grupo_cir_selecionado)
     
     # Verificar se temos dados filtrados disponíveis
-    if filtered_df.empty:
+    if contar_linhas(indice_filtros, filtros) == 0:
         st.warning("Não há dados disponíveis para os critérios selecionados. Por favor, altere os filtros.")
     else:
-        # Garantir que os tipos de dados sejam compatíveis para o merge
-        filtered_df_copy = filtered_df.copy()
-        filtered_df_copy['MUNIC_RES'] = filtered_df_copy['MUNIC_RES'].astype(str)
-        cir_numeric_copy = cir_numeric_df.copy()
-        cir_numeric_copy['IBGE'] = cir_numeric_copy['IBGE'].astype(str)
-        
-        # Merge com os dados de grupo CIR numérico
-        filtered_df = filtered_df_copy.merge(cir_numeric_copy[['IBGE', 'Grupo_CIR']], 
-                                            left_on='MUNIC_RES', 
-                                            right_on='IBGE', 
-                                            how='left')
+        # Códigos IBGE no mesmo formato de MUNIC_RES (int32 de 6 dígitos), para juntar sem
+        # converter o recorte filtrado; o grupo CIR numérico (Grupo_CIR) já vem no DataFrame
+        cir_numeric_copy = cir_numeric_df.assign(IBGE=canonizar_codigo_municipio(cir_numeric_df['IBGE']))
         
         # Verificar se a coluna iRAPS existe no DataFrame base_magda
         if 'iRAPS' not in cir_numeric_df.columns:
@@ -233,7 +174,7 @@ try:
             st.subheader("Distribuição de iRAPS por Grupo CIR")
             
             # Agregar os dados por Grupo_CIR
-            iraps_por_grupo = filtered_df.dropna(subset=['Grupo_CIR']).merge(
+            iraps_por_grupo = filtered_df()[['MUNIC_RES', 'Grupo_CIR']].dropna(subset=['Grupo_CIR']).merge(
                 cir_numeric_copy[['IBGE', 'iRAPS']], 
                 left_on='MUNIC_RES',
                 right_on='IBGE',
@@ -290,14 +231,15 @@ try:
                 else:
                     try:
                         # Calcular taxa de internações por 100k habitantes
-                        taxa_internacao = calcular_taxa_internacao_por_100k(filtered_df_copy, df_pop)
+                        taxa_internacao = obter_resultado(assinatura, 'taxa_internacao',
+                                                          lambda: calcular_taxa_internacao_por_100k(filtered_df(), df_pop))
                         
                         # Garantir que os tipos de dados sejam compatíveis
-                        taxa_internacao['MUNIC_RES'] = taxa_internacao['MUNIC_RES'].astype(str)
+                        taxa_internacao['MUNIC_RES'] = canonizar_codigo_municipio(taxa_internacao['MUNIC_RES'])
                         
                         # Adicionar iRAPS aos dados de taxa
                         taxa_vs_iraps = taxa_internacao.merge(
-                            cir_numeric_copy[['IBGE', 'iRAPS', 'Grupo_CIR']], 
+                            cir_numeric_copy[['IBGE', 'iRAPS']], 
                             left_on='MUNIC_RES',
                             right_on='IBGE',
                             how='left'
@@ -329,7 +271,7 @@ try:
                             st.plotly_chart(fig_scatter, use_container_width=True)
                             
                             # Calcular correlação entre taxa e iRAPS
-                            corr = taxa_vs_iraps['iRAPS'].corr(taxa_vs_iraps['taxa_por_100k'])
+                            corr = regressoes_em_lote(taxa_vs_iraps, ['taxa_por_100k'], ['iRAPS']).loc[('taxa_por_100k', 'iRAPS'), 'r']
                             st.metric("Correlação entre Taxa de Internações e iRAPS", f"{corr:.3f}")
                             
                             if corr < 0:
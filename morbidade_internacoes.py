@@ -7,7 +7,20 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import os
-import sqlite3
+
+# Importar funções auxiliares dos módulos utils
+from utils.data_cache import cache_versionado, versao_arquivos, impressao_digital
+from utils.excel_store import ler_planilha
+from utils.data_loaders import load_sih_years, recorte_sih_painel, versao_recorte
+from utils.diagnosis_tree import montar_arvore_diagnosticos, opcoes_diagnostico, formatar_opcao_diagnostico
+from utils.municipality_dim import load_municipality_dim, municipios_da_uf, formatar_municipio, atributo_municipios
+from utils.filter_index import montar_indice_filtros, filtros_painel, filtrar_dataframe
+from utils.hospitalization_cube import montar_cubo_internacoes, filtrar_cubo, agregar_cubo, contar_por, tabular_cubo
+from utils.helpers import agrupar_raca_negra
+from utils.population_cube import obter_cubo_populacao, populacao_por_ano
+from utils.population_db import consultar, fonte_populacao_paineis
+from utils.rate_engine import calcular_taxas_regiao_ano, calcular_taxas_uf_municipio
+from utils.result_store import assinatura_filtros, obter_resultado, sob_demanda
 
 # Set page configuration
 st.set_page_config(
@@ -23,35 +36,11 @@ Este dashboard analisa o perfil de internações hospitalares por transtornos me
 no Brasil, utilizando dados do Sistema de Informações Hospitalares (SIH).
 """)
 
-# Função para obter dados populacionais do banco SQLite
+# Função para obter dados populacionais (cubo de população montado a partir do banco SQLite)
 def get_population_data(codigo_municipio=None, estado=None, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False):
-    if raca:
-        raca = raca.replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-    
-    query = "SELECT ano, SUM(populacao) as tam_pop FROM populacao WHERE 1=1"
-    
-    if codigo_municipio:
-        query += f" AND codigo_municipio = '{codigo_municipio}'"
-    if estado:
-        query += f" AND SUBSTR(codigo_municipio, 1, 2) = '{estado}'"
-    if raca:
-        if usar_raca_cor2 and raca == "Negra":
-            query += f" AND (raca = 'Preta' OR raca = 'Parda')"
-        else:
-            query += f" AND raca = '{raca}'"
-    if sexo:
-        query += f" AND sexo = '{sexo}'"
-    if faixa_etaria:
-        query += f" AND faixa_etaria = '{faixa_etaria}'"
-    
-    query += " and ano < 2024 GROUP BY ano"
-    
     try:
-        conn = sqlite3.connect('populacao.db')
-        df_populacao = pd.read_sql_query(query, conn)
-        conn.close()
-        
-        return df_populacao
+        return populacao_por_ano(obter_cubo_populacao(), codigo_municipio=codigo_municipio, estado=estado,
+                                 raca=raca, sexo=sexo, faixa_etaria=faixa_etaria, usar_raca_cor2=usar_raca_cor2)
     except Exception as e:
         st.warning(f"Erro ao consultar o banco de dados de população: {e}")
         return pd.DataFrame(columns=['ano', 'tam_pop'])
@@ -59,20 +48,21 @@ def get_population_data(codigo_municipio=None, estado=None, raca=None, sexo=None
 # Função para verificar disponibilidade do banco de dados de população
 def check_population_data():
     try:
-        # Testar conexão com o banco de dados
-        conn = sqlite3.connect('populacao.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='populacao'")
-        result = cursor.fetchone()
-        conn.close()
-        
-        return result is not None
+        db_path, tabela = fonte_populacao_paineis()
+        if not os.path.exists(db_path):
+            return False
+        
+        # Testar conexão com o banco de dados (no banco normalizado "populacao" é uma visão)
+        result = consultar(db_path, "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", [tabela])
+        
+        return not result.empty
     except Exception as e:
         st.warning(f"Aviso: Banco de dados de população não disponível: {e}")
         return False
 
 # Função para calcular taxa por 100.000 habitantes usando o mesmo método do app_taxa_mortalidade.py
-def calcular_taxa_por_100k_habitantes(df, codigo_municipio=None, estado=None, raca=None, faixa_etaria=None, sexo=None, usar_raca_cor2=False):
+# (fatos: células filtradas do cubo de internações)
+def calcular_taxa_por_100k_habitantes(fatos, codigo_municipio=None, estado=None, raca=None, faixa_etaria=None, sexo=None, usar_raca_cor2=False):
     # Converter sexo para formato esperado pelo banco de dados
     sexo_db = None
     if sexo == "Masculino":
@@ -89,7 +79,7 @@ def calcular_taxa_por_100k_habitantes(df, codigo_municipio=None, estado=None, ra
                                        usar_raca_cor2=usar_raca_cor2)
     
     # Agrupar dados por ano
-    contagens_por_ano = df.groupby('ANO_CMPT', observed=True).size().reset_index(name='numero_casos')
+    contagens_por_ano = fatos.groupby('ANO_CMPT', observed=True)['internacoes'].sum().reset_index(name='numero_casos')
     contagens_por_ano = contagens_por_ano.rename(columns={'ANO_CMPT': 'ano'})
     
     # Mesclar com os dados populacionais
@@ -100,8 +90,19 @@ def calcular_taxa_por_100k_habitantes(df, codigo_municipio=None, estado=None, ra
     
     return df_completo
 
+# Função para obter a coluna das células do cubo usada como chave de agrupamento: rótulos de
+# sexo e faixa etária ou raça (com Preta e Parda substituídas por Negra quando usar_raca_cor2)
+def chave_celulas(fatos, coluna, usar_raca_cor2=False):
+    if coluna == 'SEXO':
+        return fatos['SEXO'].map({1: 'Masculino', 3: 'Feminino', 0: 'Não informado'}).rename('Sexo')
+    if coluna == 'FAIXA_ETARIA':
+        return fatos['FAIXA_ETARIA'].rename('Faixa Etária')
+    if usar_raca_cor2 and coluna in ('RACA_COR_DESC', 'def_raca_cor'):
+        return agrupar_raca_negra(fatos[coluna])
+    return fatos[coluna]
+
 # Função para carregar dados populacionais
-@st.cache_data
+@cache_versionado(versao_arquivos('data/populacao_ibge.csv'))
 def load_population_data():
     try:
         # Tentar carregar dados populacionais do IBGE
@@ -252,11 +253,11 @@ def ajustar_dados_raca(df, coluna_raca, usar_raca_cor2=False):
     return df_ajustado
 
 # Carregar dados dos municípios
-@st.cache_data
+@cache_versionado(versao_arquivos('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls'))
 def load_municipalities():
     try:
         # Lê o arquivo Excel pulando as 6 primeiras linhas
-        municipios_df = pd.read_excel('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls', skiprows=6)
+        municipios_df = ler_planilha('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls', skiprows=6)
         
         # Extrair os 6 primeiros caracteres do código do município
         municipios_df['cod_6digitos'] = municipios_df['Código Município Completo'].astype(str).str[:6]
@@ -270,37 +271,33 @@ def load_municipalities():
         return {}
 
 # Load data
-@st.cache_data
-def load_data():
-    df = pd.read_csv('data/sih_2000_2024.csv', low_memory=False)
-    
-    # Convert date columns if needed
-    if 'dt_inter' in df.columns:
-        df['dt_inter'] = pd.to_datetime(df['dt_inter'])
-    
-    # Filter for psychiatric conditions (Transtornos mentais e comportamentais)
-    mental_health_df = df[df['def_diag_princ_cap'].str.contains('Transtornos mentais e comportamentais', na=False)]
-    
-    # Check if race column exists
-    if 'RACA_COR' in mental_health_df.columns:
-        # Map race/color codes to descriptions if needed
-        race_mapping = {
-            1: 'Branca',
-            2: 'Preta',
-            3: 'Parda',
-            4: 'Amarela',
-            5: 'Indígena',
-            9: 'Sem informação'
-        }
-        mental_health_df['RACA_COR_DESC'] = mental_health_df['RACA_COR'].map(race_mapping)
-    
-    return mental_health_df
+# Recorte do período e do estado sobre a base do SIH compartilhada pelo processo, com as colunas
+# usadas por este painel; não alterá-lo in-place.
+def load_data(year_range=None, estado=None):
+    return recorte_sih_painel(year_range, estado, 'morbidade_internacoes')
+
+# Função para carregar o índice de bitmaps dos filtros, montado uma vez por recorte carregado
+@cache_versionado(versao_recorte, recurso=True)
+def load_filter_index(year_range=None, estado=None):
+    return montar_indice_filtros(load_data(year_range, estado))
+
+# Função para carregar a árvore diagnóstica (grupo → categoria → subcategoria, com contagens)
+# dos selectbox de diagnóstico, montada uma vez por recorte carregado
+@cache_versionado(versao_recorte, recurso=True)
+def load_diagnosis_tree(year_range=None, estado=None):
+    return montar_arvore_diagnosticos(load_data(year_range, estado))
+
+# Função para carregar o cubo de internações (ano × município × sexo × faixa etária × raça ×
+# regime × subcategoria), montado uma vez por recorte carregado
+@cache_versionado(versao_recorte, recurso=True)
+def load_cube(year_range=None, estado=None):
+    return montar_cubo_internacoes(load_data(year_range, estado))
 
 # Load the data
 try:
-    df = load_data()
     # Carregar dicionário de municípios
     municipios_dict = load_municipalities()
+    dimensao_municipios = load_municipality_dim()
     
     # Display loading message while processing
     with st.spinner('Carregando dados...'):
@@ -333,7 +330,7 @@ try:
     st.sidebar.header("Filtros")
     
     # Filter by year range
-    years = sorted(df['ANO_CMPT'].unique())
+    years = load_sih_years()
     year_range = st.sidebar.slider(
         "Período de análise:",
         min_value=int(min(years)),
@@ -388,37 +385,21 @@ try:
     )
     estado = estados[estado_nome]
     
-    # Filtro de Município
-    codigo_municipio_options = ["Todos"]
-    if estado:
-        # Filtra municípios pelo estado selecionado
-        codigos_filtrados = [str(cod) for cod in sorted(df['MUNIC_RES'].unique()) if str(cod).startswith(estado)]
-        codigo_municipio_options += codigos_filtrados
-    else:
-        codigo_municipio_options += [str(cod) for cod in sorted(df['MUNIC_RES'].unique())]
+    # Carregar apenas as partições do período e do estado selecionados
+    df = load_data(year_range, estado)
     
-    # Adiciona nomes dos municípios aos códigos
-    codigo_municipio_display = ["Todos"]
-    for codigo in codigo_municipio_options[1:]:  # Pula o "Todos"
-        nome_municipio = municipios_dict.get(codigo, "")
-        if nome_municipio:
-            codigo_municipio_display.append(f"{codigo} - {nome_municipio}")
-        else:
-            codigo_municipio_display.append(codigo)
+    # Filtro de Município: os municípios presentes no recorte (já listados no índice de filtros),
+    # exibidos como "Código - Nome" a partir da dimensão de municípios
+    municipios_recorte = load_filter_index(year_range, estado)['dimensoes']['municipio']
+    codigo_municipio_options = ["Todos"] + [str(codigo) for codigo in municipios_da_uf(dimensao_municipios, estado, municipios_recorte)]
     
-    # Usar os códigos com nomes para display
-    codigo_municipio_option_display = st.sidebar.selectbox(
+    codigo_municipio_option = st.sidebar.selectbox(
         "Município",
-        options=codigo_municipio_display,
-        index=0
+        options=codigo_municipio_options,
+        index=0,
+        format_func=formatar_municipio(dimensao_municipios, "{codigo} - {nome}")
     )
     
-    # Extrair apenas o código do município selecionado
-    if codigo_municipio_option_display == "Todos":
-        codigo_municipio_option = "Todos"
-    else:
-        codigo_municipio_option = codigo_municipio_option_display.split(" - ")[0]
-    
     codigo_municipio = None if codigo_municipio_option == "Todos" else codigo_municipio_option
     
     # Filtro por sexo
@@ -515,12 +496,16 @@ try:
         raca = "Todas"  # Valor padrão se não existir informação racial
     
     # Filtro por grupo diagnóstico em árvore (hierárquico)
+    # Opções lidas da árvore diagnóstica do recorte (montada no carregamento), com a contagem de internações
+    arvore_diagnosticos = load_diagnosis_tree(year_range, estado)
+    
     # Grupo Diagnóstico
-    diag_grupo_options = ["Todos"] + sorted(df['def_diag_princ_grupo'].dropna().unique().tolist())
+    diag_grupo_options = ["Todos"] + opcoes_diagnostico(arvore_diagnosticos)
     diag_grupo = st.sidebar.selectbox(
         "Grupo Diagnóstico",
         options=diag_grupo_options,
-        index=0
+        index=0,
+        format_func=formatar_opcao_diagnostico(arvore_diagnosticos)
     )
     diag_grupo = None if diag_grupo == "Todos" else diag_grupo
     
@@ -532,12 +517,13 @@ try:
     else:
         # Se um grupo for selecionado, mostra as categorias correspondentes
         if 'def_diag_princ_cat' in df.columns:
-            categorias_filtradas = sorted(df[df['def_diag_princ_grupo'] == diag_grupo]['def_diag_princ_cat'].dropna().unique().tolist())
+            categorias_filtradas = opcoes_diagnostico(arvore_diagnosticos, diag_grupo)
             diag_categoria_options = ["Todas"] + categorias_filtradas
             diag_categoria = st.sidebar.selectbox(
                 "Categoria Diagnóstica",
                 options=diag_categoria_options,
-                index=0
+                index=0,
+                format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo)
             )
             diag_categoria = None if diag_categoria == "Todas" else diag_categoria
         else:
@@ -555,126 +541,41 @@ try:
     else:
         # Se uma categoria for selecionada, mostra as subcategorias correspondentes
         if 'def_diag_princ_subcat' in df.columns:
-            subcategorias_filtradas = sorted(df[df['def_diag_princ_cat'] == diag_categoria]['def_diag_princ_subcat'].dropna().unique().tolist())
+            subcategorias_filtradas = opcoes_diagnostico(arvore_diagnosticos, diag_grupo, diag_categoria)
             diag_subcategoria_options = ["Todas"] + subcategorias_filtradas
             diag_subcategoria = st.sidebar.selectbox(
                 "Subcategoria Diagnóstica",
                 options=diag_subcategoria_options,
-                index=0
+                index=0,
+                format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo, diag_categoria)
             )
             diag_subcategoria = None if diag_subcategoria == "Todas" else diag_subcategoria
         else:
             st.sidebar.text("Dados de subcategorias diagnósticas não disponíveis")
             diag_subcategoria = None
     
-    # Aplicar filtros
-    filtered_df = df.copy()
-    
-    # Filtrar por ano
-    filtered_df = filtered_df[
-        (filtered_df['ANO_CMPT'] >= year_range[0]) & 
-        (filtered_df['ANO_CMPT'] <= year_range[1])
-    ]
-    
-    # Filtrar por estado
-    if estado:
-        filtered_df = filtered_df[filtered_df['res_CODIGO_UF'].astype(str) == estado]
+    # Aplicar filtros cruzando os bitmaps do índice de filtros
+    indice_filtros = load_filter_index(year_range, estado)
+    filtros = filtros_painel(year_range, estado, codigo_municipio, sexo, faixa_etaria, raca, usar_raca_cor2,
+                             diag_grupo=diag_grupo, diag_categoria=diag_categoria,
+                             diag_subcategoria=diag_subcategoria)
     
-    # Filtrar por município
-    if codigo_municipio:
-        filtered_df = filtered_df[filtered_df['MUNIC_RES'].astype(str) == codigo_municipio]
-    
-    # Filtrar por sexo
-    if sexo != "Todos":
-        if sexo == "Masculino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 1]
-        elif sexo == "Feminino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 3]
-    
-    # Filtrar por faixa etária
-    if faixa_etaria != "Todas":
-        age_ranges = {
-            '0-4': (0, 4),
-            '5-9': (5, 9),
-            '10-14': (10, 14),
-            '15-19': (15, 19),
-            '20-24': (20, 24),
-            '25-29': (25, 29),
-            '30-34': (30, 34),
-            '35-39': (35, 39),
-            '40-44': (40, 44),
-            '45-49': (45, 49),
-            '50-54': (50, 54),
-            '55-59': (55, 59),
-            '60-64': (60, 64),
-            '65-69': (65, 69),
-            '70-74': (70, 74),
-            '75-79': (75, 79),
-            '80-84': (80, 84),
-            '85-89': (85, 89),
-            '90-94': (90, 94),
-            '95-99': (95, 99),
-            '100+': (100, float('inf'))
-        }
-        age_min, age_max = age_ranges[faixa_etaria]
-        filtered_df = filtered_df[(filtered_df['IDADE'] >= age_min) & (filtered_df['IDADE'] <= age_max)]
-    
-    # Filtrar por raça/cor considerando a opção Raça/Cor 2
-    if 'RACA_COR' in df.columns and raca != "Todas":
-        if raca == "Negra" and usar_raca_cor2:
-            # Para Negra em Raça/Cor 2, incluir Preta e Parda
-            if 'RACA_COR_DESC' in df.columns:
-                filtered_df = filtered_df[filtered_df['RACA_COR_DESC'].isin(["Preta", "Parda"])]
-            else:
-                # Se não houver descrições, usar códigos 2 (Preta) e 3 (Parda)
-                filtered_df = filtered_df[filtered_df['RACA_COR'].isin([2, 3])]
-        else:
-            # Para outras raças ou modo tradicional
-            if 'RACA_COR_DESC' in df.columns:
-                filtered_df = filtered_df[filtered_df['RACA_COR_DESC'] == raca]
-            else:
-                # Encontrar o código correspondente à descrição
-                race_mapping_inv = {
-                    'Branca': 1,
-                    'Preta': 2,
-                    'Parda': 3,
-                    'Amarela': 4,
-                    'Indígena': 5,
-                    'Sem informação': 9
-                }
-                race_code = race_mapping_inv.get(raca)
-                if race_code:
-                    filtered_df = filtered_df[filtered_df['RACA_COR'] == race_code]
-                else:
-                    # Tentar converter diretamente se não for um dos valores mapeados
-                    try:
-                        race_code = int(raca)
-                        filtered_df = filtered_df[filtered_df['RACA_COR'] == race_code]
-                    except:
-                        pass
-    elif 'def_raca_cor' in df.columns and raca != "Todas":
-        if raca == "Negra" and usar_raca_cor2:
-            filtered_df = filtered_df[filtered_df['def_raca_cor'].isin(["Preta", "Parda"])]
-        else:
-            filtered_df = filtered_df[filtered_df['def_raca_cor'] == raca]
-    elif 'NACIONAL' in df.columns and raca != "Todas":
-        filtered_df = filtered_df[filtered_df['NACIONAL'].astype(str) == raca]
-    
-    # Filtrar por grupo diagnóstico
-    if diag_grupo is not None:
-        filtered_df = filtered_df[filtered_df['def_diag_princ_grupo'] == diag_grupo]
-    
-    # Filtrar por categoria diagnóstica
-    if diag_categoria is not None:
-        filtered_df = filtered_df[filtered_df['def_diag_princ_cat'] == diag_categoria]
-    
-    # Filtrar por subcategoria diagnóstica
-    if diag_subcategoria is not None:
-        filtered_df = filtered_df[filtered_df['def_diag_princ_subcat'] == diag_subcategoria]
-
-    # Implement a safer approach to working with filtered data
-    # Create a copy right after filtering to avoid SettingWithCopyWarning
-    filtered_df = filtered_df.copy()
+    # Os gráficos agregados são respondidos pelas células do cubo que atendem aos filtros;
+    # as linhas do recorte ficam só para as distribuições da permanência (histograma e boxplot).
+    # Cada agregado fica guardado pela assinatura da visão (filtros, tipo de raça e versão dos
+    # dados do SIH e da população); as células só são filtradas quando falta algum agregado.
+    assinatura = assinatura_filtros('morbidade_internacoes', filtros, usar_raca_cor2,
+                                    versao_dados=(versao_recorte(year_range, estado),
+                                                  impressao_digital(fonte_populacao_paineis()[0])))
+    fatos = sob_demanda(lambda: filtrar_cubo(load_cube(year_range, estado), filtros))
+    if 'RACA_COR_DESC' in df.columns:
+        raca_column = 'RACA_COR_DESC'
+    elif 'def_raca_cor' in df.columns:
+        raca_column = 'def_raca_cor'
+    else:
+        raca_column = None
+    filtered_df = filtrar_dataframe(df, indice_filtros, filtros,
+                                    colunas=['DIAS_PERM'] + ([raca_column] if raca_column else []))
     
     # Pré-calcular as taxas por 100.000 habitantes uma única vez se os dados populacionais estiverem disponíveis
     taxas_por_100k_df = None
@@ -690,15 +591,15 @@ try:
         raca_filtro = raca if raca != "Todas" else None
         
         # Calcular taxas por 100.000 habitantes uma única vez
-        taxas_por_100k_df = calcular_taxa_por_100k_habitantes(
-            filtered_df,
+        taxas_por_100k_df = obter_resultado(assinatura, 'taxas_ano', lambda: calcular_taxa_por_100k_habitantes(
+            fatos(),
             codigo_municipio=codigo_municipio,
             estado=estado,
             raca=raca_filtro,
             faixa_etaria=faixa_etaria if faixa_etaria != "Todas" else None,
             sexo=sexo_filtro,
             usar_raca_cor2=usar_raca_cor2
-        )
+        ))
     
     # Main dashboard content
     tabs = st.tabs([
@@ -719,21 +620,23 @@ try:
         
         col1, col2, col3 = st.columns(3)
         
+        totais = obter_resultado(assinatura, 'totais', lambda: agregar_cubo(fatos()))
+        
         with col1:
-            total_internments = len(filtered_df)
+            total_internments = int(totais['internacoes'])
             st.metric("Total de Internações", f"{total_internments:,}".replace(",", "."))
         
         with col2:
-            mortality_rate = (filtered_df['MORTE'] == 1).mean() * 100
+            mortality_rate = totais['obitos'] / totais['internacoes'] * 100
             st.metric("Taxa de Mortalidade", f"{mortality_rate:.2f}%")
         
         with col3:
-            mean_stay = filtered_df['DIAS_PERM'].mean()
+            mean_stay = totais['media_permanencia']
             st.metric("Média de Permanência (dias)", f"{mean_stay:.1f}")
         
         # Trend over time
         st.subheader("Evolução Temporal das Internações")
-        yearly_counts = filtered_df.groupby('ANO_CMPT', observed=True).size().reset_index(name='count')
+        yearly_counts = obter_resultado(assinatura, 'medidas_ano', lambda: agregar_cubo(fatos(), ['ANO_CMPT']))[['ANO_CMPT', 'internacoes']].rename(columns={'internacoes': 'count'})
         
         fig = px.line(
             yearly_counts, 
@@ -762,7 +665,7 @@ try:
         
         # Diagnostic groups distribution
         st.subheader("Distribuição por Grupos Diagnósticos")
-        diag_group_counts = filtered_df['def_diag_princ_grupo'].value_counts().reset_index()
+        diag_group_counts = obter_resultado(assinatura, 'contagem_grupo', lambda: contar_por(fatos(), 'def_diag_princ_grupo'))
         diag_group_counts.columns = ['Grupo Diagnóstico', 'Contagem']
         
         fig = px.pie(
@@ -799,7 +702,7 @@ try:
         # Length of stay by diagnostic group
         st.subheader("Tempo Médio de Permanência por Grupo Diagnóstico")
         
-        stay_by_diag = filtered_df.groupby('def_diag_princ_grupo', observed=True)['DIAS_PERM'].mean().reset_index()
+        stay_by_diag = obter_resultado(assinatura, 'medidas_grupo', lambda: agregar_cubo(fatos(), ['def_diag_princ_grupo']))[['def_diag_princ_grupo', 'media_permanencia']]
         stay_by_diag.columns = ['Grupo Diagnóstico', 'Média de Dias']
         stay_by_diag = stay_by_diag.sort_values('Média de Dias', ascending=False)
         
@@ -816,7 +719,7 @@ try:
         # Adicionar gráfico de Evolução Temporal do Tempo de Permanência
         st.subheader("Evolução Temporal do Tempo de Permanência")
         
-        stay_by_year = filtered_df.groupby('ANO_CMPT', observed=True)['DIAS_PERM'].mean().reset_index()
+        stay_by_year = obter_resultado(assinatura, 'medidas_ano', lambda: agregar_cubo(fatos(), ['ANO_CMPT']))[['ANO_CMPT', 'media_permanencia']]
         stay_by_year.columns = ['Ano', 'Média de Dias']
         
         fig = px.line(
@@ -832,30 +735,24 @@ try:
         # Adicionar gráfico de Tempo de Permanência por Raça/Cor
         st.subheader("Tempo Médio de Permanência por Raça/Cor")
         
-        # Verificar qual campo de raça/cor está disponível
-        if 'RACA_COR_DESC' in filtered_df.columns:
-            raca_column = 'RACA_COR_DESC'
-        elif 'def_raca_cor' in filtered_df.columns:
-            raca_column = 'def_raca_cor'
-        else:
+        # Campo de raça/cor disponível (raca_column, definido junto com os filtros)
+        if raca_column is None:
             st.info("Dados de raça/cor não disponíveis para análise de tempo de permanência.")
-            raca_column = None
         
         if raca_column:
             # Se estiver usando Raça/Cor 2 e a classificação for RACA_COR_DESC ou def_raca_cor
             if usar_raca_cor2:
-                # Criar cópia para não afetar o dataframe original
-                df_raca_perm = filtered_df.copy()
-                
-                # Substituir Preta e Parda por Negra
-                df_raca_perm.loc[df_raca_perm[raca_column].isin(['Preta', 'Parda']), raca_column] = 'Negra'
-                
-                # Calcular média de permanência por raça/cor
-                stay_by_race = df_raca_perm.groupby(raca_column, observed=True)['DIAS_PERM'].mean().reset_index()
-            else:
-                # Usar dataframe original com classificação tradicional
-                stay_by_race = filtered_df.groupby(raca_column, observed=True)['DIAS_PERM'].mean().reset_index()
+                # Apenas raça (Preta e Parda substituídas por Negra) e permanência, sem copiar o recorte
+                df_raca_perm = pd.DataFrame({
+                    raca_column: agrupar_raca_negra(filtered_df[raca_column]),
+                    'DIAS_PERM': filtered_df['DIAS_PERM'],
+                })
+            
+            # Média de permanência por raça/cor somando as células do cubo (Negra quando usar_raca_cor2)
+            stay_by_race = obter_resultado(assinatura, 'medidas_raca', lambda: agregar_cubo(
+                fatos(), [chave_celulas(fatos(), raca_column, usar_raca_cor2)]))
             
+            stay_by_race = stay_by_race[[raca_column, 'media_permanencia']]
             stay_by_race.columns = ['Raça/Cor', 'Média de Dias']
             stay_by_race = stay_by_race.sort_values('Média de Dias', ascending=False)
             
@@ -908,8 +805,8 @@ try:
         # Mortality rate by diagnostic group
         st.subheader("Taxa de Mortalidade por Grupo Diagnóstico")
         
-        mortality_by_diag = filtered_df.groupby('def_diag_princ_grupo', observed=True)['MORTE'].mean().reset_index()
-        mortality_by_diag['Taxa de Mortalidade (%)'] = mortality_by_diag['MORTE'] * 100
+        mortality_by_diag = obter_resultado(assinatura, 'medidas_grupo', lambda: agregar_cubo(fatos(), ['def_diag_princ_grupo']))
+        mortality_by_diag['Taxa de Mortalidade (%)'] = mortality_by_diag['taxa_mortalidade'] * 100
         mortality_by_diag = mortality_by_diag.sort_values('Taxa de Mortalidade (%)', ascending=False)
         
         fig = px.bar(
@@ -925,8 +822,8 @@ try:
         # Adicionar gráfico de Evolução Temporal da Taxa de Mortalidade
         st.subheader("Evolução Temporal da Taxa de Mortalidade")
         
-        mort_by_year = filtered_df.groupby('ANO_CMPT', observed=True)['MORTE'].mean().reset_index()
-        mort_by_year['Taxa de Mortalidade (%)'] = mort_by_year['MORTE'] * 100
+        mort_by_year = obter_resultado(assinatura, 'medidas_ano', lambda: agregar_cubo(fatos(), ['ANO_CMPT']))
+        mort_by_year['Taxa de Mortalidade (%)'] = mort_by_year['taxa_mortalidade'] * 100
         
         fig = px.line(
             mort_by_year, 
@@ -942,8 +839,9 @@ try:
         st.subheader("Principais Categorias Diagnósticas")
         
         # Obter as 10 categorias de diagnóstico mais comuns
-        if 'def_diag_princ_cat' in filtered_df.columns:
-            top_categories = filtered_df['def_diag_princ_cat'].value_counts().nlargest(10).reset_index()
+        if 'def_diag_princ_cat' in df.columns:
+            top_categories = obter_resultado(assinatura, 'contagem_categoria',
+                                             lambda: contar_por(fatos(), 'def_diag_princ_cat').head(10))
             top_categories.columns = ['Categoria Diagnóstica', 'Contagem']
             
             fig = px.bar(
@@ -966,7 +864,7 @@ try:
         # Distribution by hospitalization regime
         st.subheader("Distribuição por Regime de Internação")
         
-        regime_counts = filtered_df['def_regime'].value_counts().reset_index()
+        regime_counts = obter_resultado(assinatura, 'contagem_regime', lambda: contar_por(fatos(), 'def_regime'))
         regime_counts.columns = ['Regime', 'Contagem']
         
         fig = px.pie(
@@ -981,7 +879,9 @@ try:
         st.subheader("Evolução Temporal por Regime de Internação")
         
         # Agrupar dados por ano e regime
-        regime_by_year = filtered_df.groupby(['ANO_CMPT', 'def_regime'], observed=True).size().reset_index(name='Contagem')
+        regime_by_year = (obter_resultado(assinatura, 'medidas_ano_regime',
+                                          lambda: agregar_cubo(fatos(), ['ANO_CMPT', 'def_regime']))[['ANO_CMPT', 'def_regime', 'internacoes']]
+                          .rename(columns={'internacoes': 'Contagem'}))
         
         # Criar gráfico de linha
         fig = px.line(
@@ -1018,9 +918,8 @@ try:
             # Sex distribution
             st.subheader("Distribuição por Sexo")
             
-            # Convert numerical sex to categorical
-            filtered_df.loc[:, 'Sexo'] = filtered_df['SEXO'].map({1: 'Masculino', 3: 'Feminino', 0: 'Não informado'})
-            sex_counts = filtered_df['Sexo'].value_counts().reset_index()
+            sex_counts = obter_resultado(assinatura, 'contagem_sexo',
+                                         lambda: contar_por(fatos(), chave_celulas(fatos(), 'SEXO')))
             sex_counts.columns = ['Sexo', 'Contagem']
             
             fig = px.pie(
@@ -1035,12 +934,9 @@ try:
             # Age distribution
             st.subheader("Distribuição por Idade")
             
-            # Create age groups
-            age_bins = [0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100, float('inf')]
-            age_labels = ['0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69', '70-74', '75-79', '80-84', '85-89', '90-94', '95-99', '100+']
-            
-            filtered_df.loc[:, 'Faixa Etária'] = pd.cut(filtered_df['IDADE'], bins=age_bins, labels=age_labels, right=False)
-            age_counts = filtered_df['Faixa Etária'].value_counts().reset_index()
+            # Faixas etárias já calculadas no carregamento (FAIXA_ETARIA, categórica ordenada)
+            age_counts = obter_resultado(assinatura, 'contagem_faixa',
+                                         lambda: contar_por(fatos(), chave_celulas(fatos(), 'FAIXA_ETARIA')))
             age_counts.columns = ['Faixa Etária', 'Contagem']
             age_counts = age_counts.sort_values('Faixa Etária')
             
@@ -1057,21 +953,13 @@ try:
         st.subheader("Distribuição por Raça/Cor")
         
         # Check if race data is available
-        if 'RACA_COR' in filtered_df.columns:
-            if 'RACA_COR_DESC' in filtered_df.columns:
+        if 'RACA_COR' in df.columns:
+            if 'RACA_COR_DESC' in df.columns:
                 # Criar uma distribuição de raça que reflita a classificação escolhida
-                if usar_raca_cor2:
-                    # Criar cópia para não afetar o dataframe original
-                    df_raca = filtered_df.copy()
-                    
-                    # Substituir Preta e Parda por Negra
-                    df_raca.loc[df_raca['RACA_COR_DESC'].isin(['Preta', 'Parda']), 'RACA_COR_DESC'] = 'Negra'
-                    
-                    race_counts = df_raca['RACA_COR_DESC'].value_counts().reset_index()
-                    race_counts.columns = ['Raça/Cor', 'Contagem']
-                else:
-                    race_counts = filtered_df['RACA_COR_DESC'].value_counts().reset_index()
-                    race_counts.columns = ['Raça/Cor', 'Contagem']
+                # (raça das células com Preta e Parda substituídas por Negra quando usar_raca_cor2)
+                race_counts = obter_resultado(assinatura, 'contagem_raca', lambda: contar_por(
+                    fatos(), chave_celulas(fatos(), 'RACA_COR_DESC', usar_raca_cor2)))
+                race_counts.columns = ['Raça/Cor', 'Contagem']
             
             # Create race distribution visualization
             col1, col2 = st.columns(2)
@@ -1100,19 +988,10 @@ try:
             st.subheader("Distribuição Racial por Grupo Diagnóstico")
             
             # Create a cross-tabulation between race and diagnosis group
-            if usar_raca_cor2:
-                # Usar o dataframe ajustado
-                race_diag_pivot = pd.crosstab(
-                    df_raca['RACA_COR_DESC'], 
-                    df_raca['def_diag_princ_grupo'],
-                    normalize='columns'  # Normalize to get proportions within each diagnosis group
-                )
-            else:
-                race_diag_pivot = pd.crosstab(
-                    filtered_df['RACA_COR_DESC'], 
-                    filtered_df['def_diag_princ_grupo'],
-                    normalize='columns'  # Normalize to get proportions within each diagnosis group
-                )
+            # (proportions within each diagnosis group)
+            race_diag_pivot = obter_resultado(assinatura, 'tabela_raca_grupo_proporcao', lambda: tabular_cubo(
+                fatos(), chave_celulas(fatos(), 'RACA_COR_DESC', usar_raca_cor2), 'def_diag_princ_grupo',
+                normalizar_colunas=True))
             
             fig = px.imshow(
                 race_diag_pivot,
@@ -1125,30 +1004,17 @@ try:
             st.plotly_chart(fig, use_container_width=True)
             
             # Add absolute counts table
-            if usar_raca_cor2:
-                race_diag_abs = pd.crosstab(
-                    df_raca['RACA_COR_DESC'], 
-                    df_raca['def_diag_princ_grupo']
-                )
-            else:
-                race_diag_abs = pd.crosstab(
-                    filtered_df['RACA_COR_DESC'], 
-                    filtered_df['def_diag_princ_grupo']
-                )
+            race_diag_abs = obter_resultado(assinatura, 'tabela_raca_grupo', lambda: tabular_cubo(
+                fatos(), chave_celulas(fatos(), 'RACA_COR_DESC', usar_raca_cor2), 'def_diag_princ_grupo'))
             
             st.subheader("Tabela de Contagem: Raça/Cor por Grupo Diagnóstico")
             st.dataframe(race_diag_abs, use_container_width=True)
         
-        elif 'def_raca_cor' in filtered_df.columns:
+        elif 'def_raca_cor' in df.columns:
             # Caso semelhante para def_raca_cor
-            if usar_raca_cor2:
-                df_raca = filtered_df.copy()
-                df_raca.loc[df_raca['def_raca_cor'].isin(['Preta', 'Parda']), 'def_raca_cor'] = 'Negra'
-                race_counts = df_raca['def_raca_cor'].value_counts().reset_index()
-                race_counts.columns = ['Raça/Cor', 'Contagem']
-            else:
-                race_counts = filtered_df['def_raca_cor'].value_counts().reset_index()
-                race_counts.columns = ['Raça/Cor', 'Contagem']
+            race_counts = obter_resultado(assinatura, 'contagem_raca', lambda: contar_por(
+                fatos(), chave_celulas(fatos(), 'def_raca_cor', usar_raca_cor2)))
+            race_counts.columns = ['Raça/Cor', 'Contagem']
                 
             # Create race distribution visualization
             col1, col2 = st.columns(2)
@@ -1174,19 +1040,14 @@ try:
                 st.plotly_chart(fig, use_container_width=True)
 
         # Mortality by race (if available)
-        if 'RACA_COR_DESC' in filtered_df.columns:
+        if 'RACA_COR_DESC' in df.columns:
             st.subheader("Taxa de Mortalidade por Raça/Cor")
             
             # Usar o mesmo dataframe ajustado que já foi criado anteriormente
-            if usar_raca_cor2:
-                # Verificando se df_raca já foi criado
-                df_raca = filtered_df.copy()
-                df_raca.loc[df_raca['RACA_COR_DESC'].isin(['Preta', 'Parda']), 'RACA_COR_DESC'] = 'Negra'
-                mort_by_race = df_raca.groupby('RACA_COR_DESC', observed=True)['MORTE'].mean().reset_index()
-            else:
-                mort_by_race = filtered_df.groupby('RACA_COR_DESC', observed=True)['MORTE'].mean().reset_index()
+            mort_by_race = obter_resultado(assinatura, 'medidas_raca', lambda: agregar_cubo(
+                fatos(), [chave_celulas(fatos(), raca_column, usar_raca_cor2)]))
             
-            mort_by_race['Taxa de Mortalidade (%)'] = mort_by_race['MORTE'] * 100
+            mort_by_race['Taxa de Mortalidade (%)'] = mort_by_race['taxa_mortalidade'] * 100
             
             fig = px.bar(
                 mort_by_race,
@@ -1196,17 +1057,13 @@ try:
                 color='RACA_COR_DESC'
             )
             st.plotly_chart(fig, use_container_width=True)
-        elif 'def_raca_cor' in filtered_df.columns:
+        elif 'def_raca_cor' in df.columns:
             st.subheader("Taxa de Mortalidade por Raça/Cor")
             
-            if usar_raca_cor2:
-                df_raca = filtered_df.copy()
-                df_raca.loc[df_raca['def_raca_cor'].isin(['Preta', 'Parda']), 'def_raca_cor'] = 'Negra'
-                mort_by_race = df_raca.groupby('def_raca_cor', observed=True)['MORTE'].mean().reset_index()
-            else:
-                mort_by_race = filtered_df.groupby('def_raca_cor', observed=True)['MORTE'].mean().reset_index()
+            mort_by_race = obter_resultado(assinatura, 'medidas_raca', lambda: agregar_cubo(
+                fatos(), [chave_celulas(fatos(), raca_column, usar_raca_cor2)]))
             
-            mort_by_race['Taxa de Mortalidade (%)'] = mort_by_race['MORTE'] * 100
+            mort_by_race['Taxa de Mortalidade (%)'] = mort_by_race['taxa_mortalidade'] * 100
             
             fig = px.bar(
                 mort_by_race,
@@ -1221,7 +1078,9 @@ try:
         st.subheader("Análise Demográfica por Grupos Diagnósticos")
         
         # Sex by diagnostic group
-        sex_by_diag = filtered_df.groupby(['def_diag_princ_grupo', 'Sexo'], observed=True).size().reset_index(name='Contagem')
+        sex_by_diag = (obter_resultado(assinatura, 'medidas_grupo_sexo', lambda: agregar_cubo(
+                           fatos(), [fatos()['def_diag_princ_grupo'], chave_celulas(fatos(), 'SEXO')]))[['def_diag_princ_grupo', 'Sexo', 'internacoes']]
+                       .rename(columns={'internacoes': 'Contagem'}))
         
         fig = px.bar(
             sex_by_diag, 
@@ -1238,10 +1097,8 @@ try:
         # Age by diagnostic group (heatmap)
         st.subheader("Distribuição de Idade por Grupo Diagnóstico")
         
-        age_diag_pivot = pd.crosstab(
-            filtered_df['Faixa Etária'], 
-            filtered_df['def_diag_princ_grupo']
-        )
+        age_diag_pivot = obter_resultado(assinatura, 'tabela_faixa_grupo', lambda: tabular_cubo(
+            fatos(), chave_celulas(fatos(), 'FAIXA_ETARIA'), 'def_diag_princ_grupo'))
         
         fig = px.imshow(
             age_diag_pivot,
@@ -1255,8 +1112,9 @@ try:
         st.subheader("Taxa de Mortalidade por Características Demográficas")
         
         # Mortality by sex
-        mort_by_sex = filtered_df.groupby('Sexo', observed=True)['MORTE'].mean().reset_index()
-        mort_by_sex['Taxa de Mortalidade (%)'] = mort_by_sex['MORTE'] * 100
+        mort_by_sex = obter_resultado(assinatura, 'medidas_sexo',
+                                      lambda: agregar_cubo(fatos(), [chave_celulas(fatos(), 'SEXO')]))
+        mort_by_sex = mort_by_sex.assign(**{'Taxa de Mortalidade (%)': mort_by_sex['taxa_mortalidade'] * 100})
         
         fig = px.bar(
             mort_by_sex,
@@ -1268,8 +1126,9 @@ try:
         st.plotly_chart(fig, use_container_width=True)
         
         # Mortality by age group
-        mort_by_age = filtered_df.groupby('Faixa Etária', observed=True)['MORTE'].mean().reset_index()
-        mort_by_age['Taxa de Mortalidade (%)'] = mort_by_age['MORTE'] * 100
+        mort_by_age = obter_resultado(assinatura, 'medidas_faixa',
+                                      lambda: agregar_cubo(fatos(), [chave_celulas(fatos(), 'FAIXA_ETARIA')]))
+        mort_by_age['Taxa de Mortalidade (%)'] = mort_by_age['taxa_mortalidade'] * 100
         mort_by_age = mort_by_age.sort_values('Faixa Etária')
         
         fig = px.bar(
@@ -1322,10 +1181,11 @@ try:
             "17": "Tocantins"
         }
         
-        state_counts = filtered_df['res_CODIGO_UF'].astype(str).value_counts().reset_index()
-        state_counts.columns = ['UF', 'Contagem']
+        state_counts = obter_resultado(assinatura, 'contagem_uf',
+                                       lambda: contar_por(fatos(), fatos()['res_CODIGO_UF'].astype(str)))
+        state_counts = state_counts.set_axis(['UF', 'Contagem'], axis=1)
         # Add state names
-        state_counts['Nome Estado'] = state_counts['UF'].map(state_names)
+        state_counts = state_counts.assign(**{'Nome Estado': state_counts['UF'].map(state_names)})
         state_counts = state_counts.sort_values('Contagem', ascending=False)
         
         # Use state names for display if available
@@ -1354,43 +1214,23 @@ try:
         if dados_populacionais_disponiveis:
             st.subheader("Taxa de Internações por 100.000 Habitantes por Estado")
             
-            # Preparar DataFrame com taxas por estado
-            taxas_estados = []
+            # Taxas médias do período por UF e por município, calculadas em uma única passada
+            taxas_uf, taxas_municipio = obter_resultado(assinatura, 'taxas_uf_municipio', lambda: calcular_taxas_uf_municipio(
+                fatos(),
+                raca=raca_filtro,
+                faixa_etaria=faixa_etaria if faixa_etaria != "Todas" else None,
+                sexo=sexo_filtro,
+                usar_raca_cor2=usar_raca_cor2,
+                coluna_casos='internacoes'
+            ))
             
-            # Para cada estado, obter a taxa do DataFrame pré-calculado
-            for _, row in state_counts.iterrows():
-                estado_uf = row['UF']
-                
-                # Filtrar dados para o estado atual
-                df_estado = filtered_df[filtered_df['res_CODIGO_UF'].astype(str) == estado_uf]
-                
-                if len(df_estado) > 0:
-                    # Calcular taxa para este estado usando a função
-                    df_taxa_estado = calcular_taxa_por_100k_habitantes(
-                        df_estado,
-                        estado=estado_uf,
-                        raca=raca_filtro,
-                        faixa_etaria=faixa_etaria if faixa_etaria != "Todas" else None,
-                        sexo=sexo_filtro,
-                        usar_raca_cor2=usar_raca_cor2
-                    )
-                    
-                    # Calcular média da taxa para o período
-                    if not df_taxa_estado.empty and 'taxa_por_100k' in df_taxa_estado.columns:
-                        taxa_media = df_taxa_estado['taxa_por_100k'].mean()
-                        
-                        # Adicionar à lista de taxas
-                        taxas_estados.append({
-                            'UF': estado_uf,
-                            'Nome Estado': row['Nome Estado'],
-                            'taxa_por_100k': taxa_media,
-                            'Contagem': row['Contagem']
-                        })
+            # Juntar as taxas às contagens por estado
+            state_rates = state_counts.merge(
+                taxas_uf[['local', 'taxa_por_100k']], left_on='UF', right_on='local'
+            )[['UF', 'Nome Estado', 'taxa_por_100k', 'Contagem']]
             
-            # Criar DataFrame com as taxas
-            if taxas_estados:
-                state_rates = pd.DataFrame(taxas_estados)
-                
+            # Criar gráfico com as taxas
+            if not state_rates.empty:
                 # Ordenar por taxa
                 state_rates = state_rates.sort_values('taxa_por_100k', ascending=False)
                 
@@ -1430,11 +1270,12 @@ try:
         # Top municipalities
         st.subheader("Municípios com Maior Número de Internações")
         
-        top_cities = filtered_df['MUNIC_RES'].astype(str).value_counts().head(20).reset_index()
+        top_cities = obter_resultado(assinatura, 'contagem_municipio',
+                                     lambda: contar_por(fatos(), fatos()['MUNIC_RES'].astype(str)).head(20))
         top_cities.columns = ['Código do Município', 'Contagem']
         
-        # Add municipality names when available using municipios_dict directly
-        top_cities['Nome do Município'] = top_cities['Código do Município'].map(municipios_dict)
+        # Add municipality names when available (array join against the municipality dimension)
+        top_cities['Nome do Município'] = atributo_municipios(dimensao_municipios, top_cities['Código do Município'], 'nome')
         
         # Replace NaN with "Município " + code
         top_cities['Nome do Município'] = top_cities['Nome do Município'].fillna(
@@ -1460,75 +1301,48 @@ try:
         if dados_populacionais_disponiveis:
             st.subheader("Taxa de Internações por 100.000 Habitantes por Município")
             
-            # Preparar DataFrame com taxas por município
-            taxas_municipios = []
-            
-            # Para cada município, calcular a taxa - usar top_cities ao invés de city_counts que não existe
-            for _, row in top_cities.head(100).iterrows():
-                codigo_mun = row['Código do Município']
-                
-                # Filtrar dados para o município atual
-                df_municipio = filtered_df[filtered_df['MUNIC_RES'].astype(str) == codigo_mun]
-                
-                if len(df_municipio) > 0:
-                    # Calcular taxa para este município
-                    df_taxa_municipio = calcular_taxa_por_100k_habitantes(
-                        df_municipio,
-                        codigo_municipio=codigo_mun,
-                        raca=raca_filtro,
-                        faixa_etaria=faixa_etaria if faixa_etaria != "Todas" else None,
-                        sexo=sexo_filtro,
-                        usar_raca_cor2=usar_raca_cor2
-                    )
-                    
-                    # Calcular média da taxa para o período
-                    if not df_taxa_municipio.empty and 'taxa_por_100k' in df_taxa_municipio.columns:
-                        taxa_media = df_taxa_municipio['taxa_por_100k'].mean()
-                        
-                        # Adicionar à lista de taxas
-                        taxas_municipios.append({
-                            'MUNIC_RES': codigo_mun,
-                            'Nome do Município': row['Nome do Município'],
-                            'taxa_por_100k': taxa_media,
-                            'Contagem': row['Contagem']
-                        })
-        
-        # Criar DataFrame com as taxas
-        if taxas_municipios:
-            city_rates = pd.DataFrame(taxas_municipios)
+            # Juntar as taxas (já calculadas para todos os municípios) aos municípios com mais internações
+            city_rates = top_cities.merge(
+                taxas_municipio[['local', 'taxa_por_100k']], left_on='Código do Município', right_on='local'
+            ).rename(columns={'Código do Município': 'MUNIC_RES'})[['MUNIC_RES', 'Nome do Município', 'taxa_por_100k', 'Contagem']]
             
-            # Ordenar por taxa
-            city_rates = city_rates.sort_values('taxa_por_100k', ascending=False).head(20)
+            # Criar gráfico com as taxas
+            if not city_rates.empty:
+                # Ordenar por taxa
+                city_rates = city_rates.sort_values('taxa_por_100k', ascending=False).head(20)
             
-            # Criar gráfico
-            fig = px.bar(
-                city_rates,
-                x='Nome do Município',
-                y='taxa_por_100k',
-                labels={'Nome do Município': 'Município', 'taxa_por_100k': 'Taxa por 100.000 habitantes'},
-                title='Top 20 Municípios por Taxa de Internações por 100.000 Habitantes',
-                color='taxa_por_100k',
-                color_continuous_scale=px.colors.sequential.Viridis
-            )
+                # Criar gráfico
+                fig = px.bar(
+                    city_rates,
+                    x='Nome do Município',
+                    y='taxa_por_100k',
+                    labels={'Nome do Município': 'Município', 'taxa_por_100k': 'Taxa por 100.000 habitantes'},
+                    title='Top 20 Municípios por Taxa de Internações por 100.000 Habitantes',
+                    color='taxa_por_100k',
+                    color_continuous_scale=px.colors.sequential.Viridis
+                )
             
-            fig.update_layout(xaxis_tickangle=-45, yaxis_title="Taxa por 100.000 habitantes")
-            st.plotly_chart(fig, use_container_width=True)
+                fig.update_layout(xaxis_tickangle=-45, yaxis_title="Taxa por 100.000 habitantes")
+                st.plotly_chart(fig, use_container_width=True)
             
-            # Mostrar tabela com taxas
-            st.subheader("Tabela de Municípios - Taxa por 100.000 Habitantes")
-            st.dataframe(city_rates)
-        else:
-            st.warning("Não foi possível calcular taxas por 100.000 habitantes por município. Verifique se os dados populacionais para os filtros selecionados estão disponíveis no banco de dados.")
+                # Mostrar tabela com taxas
+                st.subheader("Tabela de Municípios - Taxa por 100.000 Habitantes")
+                st.dataframe(city_rates)
+            else:
+                st.warning("Não foi possível calcular taxas por 100.000 habitantes por município. Verifique se os dados populacionais para os filtros selecionados estão disponíveis no banco de dados.")
         
         # Distribution of psychiatric hospitalization rates across municipalities
-        if 'res_LATITUDE' in filtered_df.columns and 'res_LONGITUDE' in filtered_df.columns:
+        if 'res_LATITUDE' in df.columns and 'res_LONGITUDE' in df.columns:
             st.subheader("Distribuição Geográfica das Internações")
             
             # Get coordinates for each municipality and count of cases
-            geo_data = filtered_df.groupby(['MUNIC_RES', 'res_LATITUDE', 'res_LONGITUDE'], observed=True).size().reset_index(name='Contagem')
+            geo_data = (obter_resultado(assinatura, 'medidas_municipio_coordenadas',
+                                        lambda: agregar_cubo(fatos(), ['MUNIC_RES', 'res_LATITUDE', 'res_LONGITUDE']))
+                        [['MUNIC_RES', 'res_LATITUDE', 'res_LONGITUDE', 'internacoes']]
+                        .rename(columns={'internacoes': 'Contagem'}))
             
-            # Add municipality names using municipios_dict directly
-            geo_data['Nome do Município'] = geo_data['MUNIC_RES'].astype(str).map(municipios_dict)
+            # Add municipality names (array join against the municipality dimension)
+            geo_data['Nome do Município'] = atributo_municipios(dimensao_municipios, geo_data['MUNIC_RES'], 'nome')
             geo_data['Nome do Município'] = geo_data['Nome do Município'].fillna('Município ' + geo_data['MUNIC_RES'].astype(str))
             
             # Remove rows with missing coordinates
@@ -1553,31 +1367,13 @@ try:
             # Remover todo o bloco do mapa de calor com taxas por 100.000 habitantes
         
         # Add analysis of hospitalization by region if possible
-        if 'res_CODIGO_UF' in filtered_df.columns:
+        if 'res_CODIGO_UF' in df.columns:
             # Adicionar linha divisória para melhorar a visualização
             st.markdown("---")
             st.header("Análise por Região do Brasil")
             
-            # Map states to regions
-            region_map = {
-                # Norte
-                "11": "Norte", "12": "Norte", "13": "Norte", "14": "Norte", 
-                "15": "Norte", "16": "Norte", "17": "Norte",
-                # Nordeste
-                "21": "Nordeste", "22": "Nordeste", "23": "Nordeste", "24": "Nordeste",
-                "25": "Nordeste", "26": "Nordeste", "27": "Nordeste", "28": "Nordeste", "29": "Nordeste",
-                # Sudeste
-                "31": "Sudeste", "32": "Sudeste", "33": "Sudeste", "35": "Sudeste",
-                # Sul
-                "41": "Sul", "42": "Sul", "43": "Sul",
-                # Centro-Oeste
-                "50": "Centro-Oeste", "51": "Centro-Oeste", "52": "Centro-Oeste", "53": "Centro-Oeste"
-            }
-            
-            # Create region column - use loc to avoid SettingWithCopyWarning
-            filtered_df.loc[:, 'Região'] = filtered_df['res_CODIGO_UF'].astype(str).str[:2].map(region_map)
-            
-            region_counts = filtered_df['Região'].value_counts().reset_index()
+            # Região de cada internação, atribuída no carregamento (REGIAO)
+            region_counts = obter_resultado(assinatura, 'contagem_regiao', lambda: contar_por(fatos(), 'REGIAO'))
             region_counts.columns = ['Região', 'Contagem']
             
             fig = px.pie(
@@ -1597,7 +1393,9 @@ try:
             st.plotly_chart(fig, use_container_width=True)
             
             # Hospitalization trends by region over time
-            region_year_counts = filtered_df.groupby(['ANO_CMPT', 'Região'], observed=True).size().reset_index(name='Contagem')
+            region_year_counts = (obter_resultado(assinatura, 'medidas_ano_regiao',
+                                                  lambda: agregar_cubo(fatos(), ['ANO_CMPT', 'REGIAO']))[['ANO_CMPT', 'REGIAO', 'internacoes']]
+                                  .rename(columns={'REGIAO': 'Região', 'internacoes': 'Contagem'}))
             
             fig = px.line(
                 region_year_counts, 
@@ -1626,15 +1424,6 @@ try:
                 independentemente do tamanho da população.
                 """)
                 
-                # Preparar mapeamento de UFs por região
-                regiao_ufs = {
-                    'Norte': ['11', '12', '13', '14', '15', '16', '17'],
-                    'Nordeste': ['21', '22', '23', '24', '25', '26', '27', '28', '29'],
-                    'Sudeste': ['31', '32', '33', '35'],
-                    'Sul': ['41', '42', '43'],
-                    'Centro-Oeste': ['50', '51', '52', '53']
-                }
-                
                 # Converter sexo para formato esperado pelo banco de dados
                 sexo_filtro = None
                 if sexo == "Masculino":
@@ -1645,59 +1434,19 @@ try:
                 # Converter raça para formato esperado pelo banco de dados
                 raca_filtro = raca if raca != "Todas" else None
                 
-                # Preparar DataFrame para armazenar taxas por região e ano
-                taxas_regiao_ano = []
+                # Casos por região × ano em um único groupby, divididos pela população
+                # das regiões (cubo de população) em uma única operação vetorizada
+                df_taxas_regiao = obter_resultado(assinatura, 'taxas_regiao_ano', lambda: calcular_taxas_regiao_ano(
+                    fatos(),
+                    raca=raca_filtro,
+                    sexo=sexo_filtro,
+                    faixa_etaria=faixa_etaria if faixa_etaria != "Todas" else None,
+                    usar_raca_cor2=usar_raca_cor2,
+                    coluna_casos='internacoes'
+                ))
                 
-                # Para cada combinação de região e ano, calcular a taxa
-                for regiao, ufs in regiao_ufs.items():
-                    # Filtrar dados para a região atual
-                    df_regiao = filtered_df[filtered_df['res_CODIGO_UF'].astype(str).str[:2].isin(ufs)]
-                    
-                    if len(df_regiao) > 0:
-                        # Agrupar por ano
-                        anos = df_regiao['ANO_CMPT'].unique()
-                        
-                        for ano in anos:
-                            # Filtrar para o ano atual
-                            df_ano = df_regiao[df_regiao['ANO_CMPT'] == ano]
-                            
-                            # Contar casos neste ano para esta região
-                            casos = len(df_ano)
-                            
-                            # Consultar população para esta região e ano
-                            pop_total = 0
-                            for uf in ufs:
-                                # Consultar população de cada estado da região
-                                df_pop_uf = get_population_data(
-                                    estado=uf,
-                                    raca=raca_filtro,
-                                    sexo=sexo_filtro,
-                                    faixa_etaria=faixa_etaria if faixa_etaria != "Todas" else None,
-                                    usar_raca_cor2=usar_raca_cor2
-                                )
-                                
-                                # Somar população do ano específico
-                                pop_uf_ano = df_pop_uf[df_pop_uf['ano'] == ano]['tam_pop'].sum()
-                                pop_total += pop_uf_ano
-                            
-                            # Calcular taxa se houver população
-                            if pop_total > 0:
-                                taxa = (casos / pop_total) * 100000
-                                
-                                # Adicionar à lista
-                                taxas_regiao_ano.append({
-                                    'Região': regiao,
-                                    'ano': ano,
-                                    'casos': casos,
-                                    'populacao': pop_total,
-                                    'taxa_por_100k': taxa
-                                })
-                
-                # Criar DataFrame com as taxas
-                if taxas_regiao_ano:
-                    df_taxas_regiao = pd.DataFrame(taxas_regiao_ano)
-                    
-                    # Criar gráfico
+                # Criar gráfico com as taxas
+                if not df_taxas_regiao.empty:
                     fig = px.line(
                         df_taxas_regiao,
                         x='ano',
@@ -0,0 +1,151 @@
+import os
+
+import streamlit as st
+import pandas as pd
+from datetime import datetime
+
+# Importar funções auxiliares dos módulos utils
+from utils.data_cache import (estatisticas_cache, configurar_cache, limpar_cache, aquecer_caches,
+                              POLITICAS_DESPEJO)
+from utils.population_db import estatisticas_conexoes
+from utils.result_store import estatisticas_resultados, limpar_resultados
+
+# Set page configuration
+st.set_page_config(
+    page_title="Administração do Cache",
+    page_icon="🗄️",
+    layout="wide"
+)
+
+# Title and description
+st.title("Administração do Cache de Dados")
+st.markdown("""
+Uso de memória, acertos e despejos dos carregadores em cache deste processo do Streamlit.
+O orçamento é global: quando o total ultrapassa o limite, as entradas são despejadas pela política escolhida.
+""")
+
+MB = 1024 ** 2
+
+# Variável de ambiente que libera as ações que alteram o cache
+VARIAVEL_ADMINISTRACAO = 'ADMIN_CACHE'
+
+NOMES_POLITICAS = {'lru': 'LRU (menos recentemente usada)', 'lfu': 'LFU (menos usada)'}
+
+# Função para verificar se as ações que alteram o cache estão liberadas. Elas valem para todas as
+# sessões do processo, e a página aparece no menu de qualquer painel; por isso só ficam
+# disponíveis com ADMIN_CACHE=1 no ambiente ou admin_cache = true no .streamlit/secrets.toml.
+def administracao_liberada():
+    if os.environ.get(VARIAVEL_ADMINISTRACAO) == '1':
+        return True
+    try:
+        return bool(st.secrets.get('admin_cache', False))
+    except Exception:
+        # Sem arquivo de secrets
+        return False
+
+liberada = administracao_liberada()
+estatisticas = estatisticas_cache()
+
+# Configuração do orçamento e da política de despejo
+st.sidebar.header("Configuração")
+if liberada:
+    orcamento_mb = st.sidebar.number_input(
+        "Orçamento de memória (MB)",
+        min_value=64,
+        value=int(estatisticas['orcamento_bytes'] // MB),
+        step=256
+    )
+    politica = st.sidebar.radio(
+        "Política de despejo",
+        options=list(POLITICAS_DESPEJO),
+        index=list(POLITICAS_DESPEJO).index(estatisticas['politica']),
+        format_func=lambda opcao: NOMES_POLITICAS[opcao]
+    )
+    if orcamento_mb * MB != estatisticas['orcamento_bytes'] or politica != estatisticas['politica']:
+        configurar_cache(orcamento_bytes=orcamento_mb * MB, politica=politica)
+        estatisticas = estatisticas_cache()
+
+    if st.sidebar.button("Verificar mudanças nos dados agora"):
+        recarregadas = aquecer_caches()
+        st.sidebar.success(f"{recarregadas} entradas recarregadas")
+        estatisticas = estatisticas_cache()
+
+    if st.sidebar.button("Esvaziar cache"):
+        limpar_cache()
+        st.sidebar.success("Cache esvaziado")
+        estatisticas = estatisticas_cache()
+else:
+    st.sidebar.markdown(f"**Orçamento de memória:** {estatisticas['orcamento_bytes'] / MB:,.0f} MB")
+    st.sidebar.markdown(f"**Política de despejo:** {NOMES_POLITICAS[estatisticas['politica']]}")
+    st.sidebar.info(f"Página somente leitura. Para alterar o orçamento, a política ou esvaziar os caches, "
+                    f"defina {VARIAVEL_ADMINISTRACAO}=1 no ambiente ou admin_cache = true no secrets.toml.")
+
+# Resumo do uso
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.metric("Memória em uso", f"{estatisticas['bytes'] / MB:,.1f} MB")
+with col2:
+    uso = estatisticas['bytes'] / estatisticas['orcamento_bytes'] if estatisticas['orcamento_bytes'] else 0
+    st.metric("Uso do orçamento", f"{uso:.1%}")
+with col3:
+    st.metric("Entradas", len(estatisticas['entradas']))
+
+# Métricas por função
+st.subheader("Métricas por Função")
+if estatisticas['funcoes']:
+    por_funcao = pd.DataFrame.from_dict(estatisticas['funcoes'], orient='index')
+    por_funcao = por_funcao.assign(
+        **{'MB': por_funcao['bytes'] / MB, 'Taxa de acerto (%)': por_funcao['taxa_acerto'] * 100}
+    ).rename(columns={
+        'acertos': 'Acertos',
+        'falhas': 'Falhas',
+        'despejos': 'Despejos',
+        'invalidacoes': 'Invalidações',
+        'entradas': 'Entradas',
+        'tempo_medio_carga_s': 'Carga média (s)',
+    })
+    colunas = ['Entradas', 'MB', 'Acertos', 'Falhas', 'Taxa de acerto (%)', 'Despejos', 'Invalidações', 'Carga média (s)']
+    st.dataframe(por_funcao[colunas].sort_values('MB', ascending=False), use_container_width=True)
+else:
+    st.info("Nenhum carregador foi usado neste processo ainda.")
+
+# Entradas em cache
+st.subheader("Entradas em Cache")
+if estatisticas['entradas']:
+    entradas = pd.DataFrame(estatisticas['entradas'])
+    entradas['MB'] = entradas['bytes'] / MB
+    entradas['Carregada em'] = entradas['carregado_em'].map(lambda instante: datetime.fromtimestamp(instante).strftime('%d/%m/%Y %H:%M:%S'))
+    entradas = entradas.rename(columns={'funcao': 'Função', 'argumentos': 'Argumentos', 'acessos': 'Acessos'})
+    st.dataframe(entradas[['Função', 'Argumentos', 'MB', 'Acessos', 'Carregada em']].sort_values('MB', ascending=False),
+                 use_container_width=True)
+
+# Resultados calculados pelos painéis, guardados pela assinatura dos filtros de cada visão
+st.subheader("Resultados por Visão")
+if liberada and st.button("Esvaziar resultados (memória e disco)"):
+    limpar_resultados(disco=True)
+    st.success("Resultados esvaziados")
+resultados = estatisticas_resultados()
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    st.metric("Visões em memória", resultados['visoes'])
+with col2:
+    st.metric("Memória dos resultados", f"{resultados['bytes'] / MB:,.1f} MB de {resultados['orcamento_bytes'] / MB:,.0f} MB")
+with col3:
+    st.metric("Taxa de acerto", f"{resultados['taxa_acerto']:.1%}")
+with col4:
+    st.metric("Resultados no disco", f"{resultados['arquivos_disco']} ({resultados['bytes_disco'] / MB:,.1f} MB)"
+              if resultados['em_disco'] else "desativado")
+st.caption(f"Acertos em memória: {resultados['acertos_memoria']} · acertos no disco: {resultados['acertos_disco']} · "
+           f"cálculos: {resultados['falhas']} (média de {resultados['tempo_medio_calculo_s']:.2f} s) · "
+           f"despejos: {resultados['despejos']}")
+
+# Conexões com os bancos de população
+st.subheader("Conexões com os Bancos de População")
+conexoes = estatisticas_conexoes()
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.metric("Consultas", conexoes['consultas'])
+with col2:
+    st.metric("Reuso de conexões", f"{conexoes['taxa_reuso']:.1%}")
+with col3:
+    st.metric("Tempo médio por consulta", f"{conexoes['tempo_medio_ms']:.1f} ms")
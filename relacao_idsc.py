@@ -6,11 +6,30 @@ import plotly.graph_objects as go
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
-import sqlite3
 import openpyxl
 import os
 import warnings
 
+# Importar funções auxiliares dos módulos utils
+from utils.data_cache import cache_versionado, versao_arquivos, impressao_digital
+from utils.excel_store import ler_planilha
+from utils.data_loaders import load_sih_years, recorte_sih_painel, versao_recorte, caminho_idsc
+from utils.diagnosis_tree import montar_arvore_diagnosticos, opcoes_diagnostico, formatar_opcao_diagnostico
+from utils.municipality_dim import (load_municipality_dim, municipios_da_uf, formatar_municipio, atributo_municipios,
+                                     scores_idsc, colunas_idsc_disponiveis, versao_dimensao_municipios, COLUNAS_IDSC)
+from utils.filter_index import montar_indice_filtros, filtros_painel, filtrar_dataframe
+from utils.population_cube import obter_cubo_populacao, populacao_por_ano, populacao_mais_recente
+from utils.population_db import fonte_populacao_paineis
+from utils.result_store import assinatura_filtros, obter_resultado, sob_demanda
+from utils.regression_engine import regressoes_em_lote, regressao
+
+# Métodos de correlação oferecidos no painel: (método, coluna de peso)
+METODOS_CORRELACAO_PAINEL = {
+    "Pearson": ('pearson', None),
+    "Pearson ponderado pela população": ('pearson', 'populacao'),
+    "Spearman (postos)": ('spearman', None),
+}
+
 # Set page configuration
 st.set_page_config(
     page_title="Relação IDSC e Indicadores Psiquiátricos",
@@ -129,111 +148,12 @@ def ajustar_dados_raca(df, coluna_raca, usar_raca_cor2=False):
     
     return df_ajustado
 
-# Função para carregar os dados do IDSC
-@st.cache_data
-def load_idsc_data(year):
-    try:
-        file_path = f"data/Base_de_Dados_IDSC-BR_{year}.xlsx"
-        sheet_name = f"IDSC-BR {year}"
-        
-        # Verificar se o arquivo existe
-        if not os.path.exists(file_path):
-            st.error(f"Arquivo do IDSC para o ano {year} não encontrado: {file_path}")
-            return {}, pd.DataFrame(), {}, {}, {}, {}
-        
-        # Primeiro tente ler com pandas normalmente
-        try:
-            idsc_df = pd.read_excel(file_path, sheet_name=sheet_name)
-        except Exception as e:
-            if "Bad CRC-32" in str(e):
-                st.warning(f"Arquivo Excel corrompido. Tentando método alternativo de leitura...")
-                # Tentar ler com engine diferente
-                try:
-                    idsc_df = pd.read_excel(file_path, sheet_name=sheet_name, engine='openpyxl')
-                except Exception as inner_e:
-                    # Se falhar, tentar método ainda mais robusto com xlrd
-                    try:
-                        import xlrd
-                        idsc_df = pd.read_excel(file_path, sheet_name=0, engine='xlrd')
-                    except Exception as xlrd_e:
-                        st.error(f"Não foi possível ler o arquivo Excel: {e}. Detalhes: {xlrd_e}")
-                        # Retornar dicionários vazios em caso de erro
-                        return {}, pd.DataFrame(), {}, {}, {}, {}
-            else:
-                st.error(f"Erro ao ler arquivo Excel: {e}")
-                # Retornar dicionários vazios em caso de erro
-                return {}, pd.DataFrame(), {}, {}, {}, {}
-        
-        # Verificar se o DataFrame está vazio
-        if idsc_df is None or idsc_df.empty:
-            st.error(f"O arquivo IDSC para o ano {year} não contém dados válidos.")
-            return {}, pd.DataFrame(), {}, {}, {}, {}
-        
-        
-        # Verificar se a coluna COD_MUN existe
-        if 'COD_MUN' not in idsc_df.columns:
-            st.error(f"Coluna 'COD_MUN' não encontrada no arquivo IDSC {year}.")
-            return {}, pd.DataFrame(), {}, {}, {}, {}
-            
-        # Ajustar o código do município removendo o último dígito para compatibilidade
-        idsc_df['COD_MUN_AJUSTADO'] = idsc_df['COD_MUN'].astype(str).str[:-1]
-        
-        # Pegando a coluna correta do IDSC
-        idsc_column = f"IDSC-BR {year}"
-        
-        # Verificar se a coluna IDSC existe
-        if idsc_column not in idsc_df.columns:
-            st.error(f"Coluna '{idsc_column}' não encontrada no arquivo IDSC {year}.")
-            return {}, pd.DataFrame(), {}, {}, {}, {}
-        
-        # Criar um dicionário de códigos de municípios para valores IDSC
-        idsc_dict = {}
-        
-        # Criar dicionários para os Goals individuais
-        goal1_dict = {}
-        goal3_dict = {}
-        goal5_dict = {}
-        goal10_dict = {}
-        
-        # Verificar se as colunas de Goals existem
-        goal1_col = 'Goal 1 Score' if 'Goal 1 Score' in idsc_df.columns else None
-        goal3_col = 'Goal 3 Score' if 'Goal 3 Score' in idsc_df.columns else None
-        goal5_col = 'Goal 5 Score' if 'Goal 5 Score' in idsc_df.columns else None
-        goal10_col = 'Goal 10 Score' if 'Goal 10 Score' in idsc_df.columns else None
-        
-        for _, row in idsc_df.iterrows():
-            # Verificar se a linha tem todos os dados necessários
-            if pd.isna(row['COD_MUN_AJUSTADO']) or pd.isna(row[idsc_column]):
-                continue
-                
-            idsc_dict[row['COD_MUN_AJUSTADO']] = row[idsc_column]
-            
-            # Adicionar os Goals individuais, se existirem
-            if goal1_col and not pd.isna(row.get(goal1_col, pd.NA)):
-                goal1_dict[row['COD_MUN_AJUSTADO']] = row[goal1_col]
-            if goal3_col and not pd.isna(row.get(goal3_col, pd.NA)):
-                goal3_dict[row['COD_MUN_AJUSTADO']] = row[goal3_col]
-            if goal5_col and not pd.isna(row.get(goal5_col, pd.NA)):
-                goal5_dict[row['COD_MUN_AJUSTADO']] = row[goal5_col]
-            if goal10_col and not pd.isna(row.get(goal10_col, pd.NA)):
-                goal10_dict[row['COD_MUN_AJUSTADO']] = row[goal10_col]
-        
-        # Verificar se os dicionários não estão vazios
-        if not idsc_dict:
-            st.warning(f"Nenhum valor de IDSC encontrado para o ano {year}.")
-        
-        return idsc_dict, idsc_df, goal1_dict, goal3_dict, goal5_dict, goal10_dict
-    except Exception as e:
-        st.error(f"Erro ao carregar dados do IDSC: {e}")
-        # Retornar dicionários vazios em caso de erro
-        return {}, pd.DataFrame(), {}, {}, {}, {}
-
 # Carregar dados dos municípios
-@st.cache_data
+@cache_versionado(versao_arquivos('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls'))
 def load_municipalities():
     try:
         # Lê o arquivo Excel pulando as 6 primeiras linhas
-        municipios_df = pd.read_excel('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls', skiprows=6)
+        municipios_df = ler_planilha('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls', skiprows=6)
         
         # Extrair os 6 primeiros caracteres do código do município
         municipios_df['cod_6digitos'] = municipios_df['Código Município Completo'].astype(str).str[:6]
@@ -247,60 +167,60 @@ def load_municipalities():
         return {}
 
 # Load data
-@st.cache_data
-def load_data():
-    df = pd.read_csv('data/sih_2000_2024.csv', low_memory=False)
-    
-    # Convert date columns if needed
-    if 'dt_inter' in df.columns:
-        df['dt_inter'] = pd.to_datetime(df['dt_inter'])
-    
-    # Filter for psychiatric conditions (Transtornos mentais e comportamentais)
-    mental_health_df = df[df['def_diag_princ_cap'].str.contains('Transtornos mentais e comportamentais', na=False)]
-    
-    # Check if race column exists
-    if 'RACA_COR' in mental_health_df.columns:
-        # Map race/color codes to descriptions if needed
-        race_mapping = {
-            1: 'Branca',
-            2: 'Preta',
-            3: 'Parda',
-            4: 'Amarela',
-            5: 'Indígena',
-            9: 'Sem informação'
-        }
-        mental_health_df['RACA_COR_DESC'] = mental_health_df['RACA_COR'].map(race_mapping)
-    
-    return mental_health_df
+# Recorte do período e do estado sobre a base do SIH compartilhada pelo processo, com as colunas
+# usadas por este painel; não alterá-lo in-place.
+def load_data(year_range=None, estado=None):
+    return recorte_sih_painel(year_range, estado, 'relacao_idsc')
+
+# Função para carregar o índice de bitmaps dos filtros, montado uma vez por recorte carregado
+@cache_versionado(versao_recorte, recurso=True)
+def load_filter_index(year_range=None, estado=None):
+    return montar_indice_filtros(load_data(year_range, estado))
+
+# Função para carregar a árvore diagnóstica (grupo → categoria → subcategoria, com contagens)
+# dos selectbox de diagnóstico, montada uma vez por recorte carregado
+@cache_versionado(versao_recorte, recurso=True)
+def load_diagnosis_tree(year_range=None, estado=None):
+    return montar_arvore_diagnosticos(load_data(year_range, estado))
 
-# Função para obter dados de população do banco de dados
+# Função para obter dados de população (cubo de população montado a partir do banco SQLite)
 def get_population_data(codigo_municipio=None, estado=None, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False):
-    if raca:
-        raca = raca.replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-    
-    query = "SELECT ano, SUM(populacao) as tam_pop FROM populacao WHERE 1=1"
-    
-    if codigo_municipio:
-        query += f" AND codigo_municipio = '{codigo_municipio}'"
-    if estado:
-        query += f" AND SUBSTR(codigo_municipio, 1, 2) = '{estado}'"
-    if raca:
-        if usar_raca_cor2 and raca == "Negra":
-            query += f" AND (raca = 'Preta' OR raca = 'Parda')"
-        else:
-            query += f" AND raca = '{raca}'"
-    if sexo:
-        query += f" AND sexo = '{sexo}'"
-    if faixa_etaria:
-        query += f" AND faixa_etaria = '{faixa_etaria}'"
+    return populacao_por_ano(obter_cubo_populacao(), codigo_municipio=codigo_municipio, estado=estado,
+                             raca=raca, sexo=sexo, faixa_etaria=faixa_etaria, usar_raca_cor2=usar_raca_cor2)
+
+# Função para obter a população de vários municípios de uma vez (fatia do cubo de população).
+# Retorna uma série código do município -> população do ano mais recente disponível.
+def get_population_data_municipios(codigos_municipios, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False):
+    return populacao_mais_recente(obter_cubo_populacao(), codigos_municipios, raca=raca, sexo=sexo,
+                                  faixa_etaria=faixa_etaria, usar_raca_cor2=usar_raca_cor2)
+
+# Função para juntar a população aos totais por município e calcular as taxas por 100.000 habitantes.
+# taxas é um dicionário coluna da taxa -> coluna do total usado no numerador.
+def adicionar_taxas_100k(df_municipios, taxas, usar_raca_cor2=False, sexo=None, faixa_etaria=None, raca=None):
+    # Converter sexo para formato compatível com banco de dados
+    sexo_db = None
+    if sexo == "Masculino":
+        sexo_db = "M"
+    elif sexo == "Feminino":
+        sexo_db = "F"
     
-    query += " and ano < 2024 GROUP BY ano"
+    df_municipios['MUNIC_RES_STR'] = df_municipios['MUNIC_RES'].astype(str)
+    populacao_municipios = get_population_data_municipios(
+        df_municipios['MUNIC_RES_STR'],
+        raca=raca,
+        sexo=sexo_db,
+        faixa_etaria=faixa_etaria,
+        usar_raca_cor2=usar_raca_cor2
+    )
     
-    conn = sqlite3.connect('populacao.db')
-    df_populacao = pd.read_sql_query(query, conn)
-    conn.close()
+    # Municípios sem população (ou com população zero) ficam sem taxa
+    populacao = df_municipios['MUNIC_RES_STR'].map(populacao_municipios)
+    populacao = populacao.where(populacao > 0)
+    df_municipios['populacao'] = populacao
+    for coluna_taxa, coluna_total in taxas.items():
+        df_municipios[coluna_taxa] = df_municipios[coluna_total] / populacao * 100000
     
-    return df_populacao
+    return df_municipios
 
 # Função para calcular a taxa de mortalidade por município por 100.000 habitantes
 def calcular_taxa_mortalidade_municipio(df_filtered, usar_raca_cor2=False, estado=None, sexo=None, faixa_etaria=None, raca=None):
@@ -314,41 +234,12 @@ def calcular_taxa_mortalidade_municipio(df_filtered, usar_raca_cor2=False, estad
     mortalidade_por_municipio['taxa_mortalidade'] = (mortalidade_por_municipio['total_mortes'] / 
                                                     mortalidade_por_municipio['total_internacoes']) * 100
     
-    # Converter sexo para formato compatível com banco de dados
-    sexo_db = None
-    if sexo == "Masculino":
-        sexo_db = "M"
-    elif sexo == "Feminino":
-        sexo_db = "F"
-    
-    # Obter dados de população para cada município
-    mortalidade_por_municipio['MUNIC_RES_STR'] = mortalidade_por_municipio['MUNIC_RES'].astype(str)
-    
     # Aplicar os dados de população e calcular taxas por 100k
-    for idx, row in mortalidade_por_municipio.iterrows():
-        codigo_municipio = row['MUNIC_RES_STR']
-        # Buscar população para este município específico
-        df_pop = get_population_data(
-            codigo_municipio=codigo_municipio,
-            estado=estado,
-            raca=raca,
-            sexo=sexo_db,
-            faixa_etaria=faixa_etaria,
-            usar_raca_cor2=usar_raca_cor2
-        )
-        
-        # Se encontrou dados de população, calcular a taxa
-        if not df_pop.empty:
-            # Usar o ano mais recente disponível
-            pop_recente = df_pop.iloc[-1]['tam_pop']
-            
-            # Calcular taxa por 100.000 habitantes
-            if pop_recente > 0:
-                mortalidade_por_municipio.at[idx, 'populacao'] = pop_recente
-                mortalidade_por_municipio.at[idx, 'taxa_internacoes_100k'] = (row['total_internacoes'] / pop_recente) * 100000
-                mortalidade_por_municipio.at[idx, 'taxa_mortalidade_100k'] = (row['total_mortes'] / pop_recente) * 100000
-    
-    return mortalidade_por_municipio
+    return adicionar_taxas_100k(
+        mortalidade_por_municipio,
+        {'taxa_internacoes_100k': 'total_internacoes', 'taxa_mortalidade_100k': 'total_mortes'},
+        usar_raca_cor2, sexo, faixa_etaria, raca
+    )
 
 # Função para calcular o tempo médio de permanência por município
 def calcular_tempo_permanencia_municipio(df_filtered, usar_raca_cor2=False, estado=None, sexo=None, faixa_etaria=None, raca=None):
@@ -358,46 +249,26 @@ def calcular_tempo_permanencia_municipio(df_filtered, usar_raca_cor2=False, esta
         tempo_medio_permanencia=('DIAS_PERM', 'mean')
     ).reset_index()
     
-    # Converter sexo para formato compatível com banco de dados
-    sexo_db = None
-    if sexo == "Masculino":
-        sexo_db = "M"
-    elif sexo == "Feminino":
-        sexo_db = "F"
-    
-    # Obter dados de população para cada município
-    permanencia_por_municipio['MUNIC_RES_STR'] = permanencia_por_municipio['MUNIC_RES'].astype(str)
-    
     # Aplicar os dados de população e calcular taxas por 100k
-    for idx, row in permanencia_por_municipio.iterrows():
-        codigo_municipio = row['MUNIC_RES_STR']
-        # Buscar população para este município específico
-        df_pop = get_population_data(
-            codigo_municipio=codigo_municipio,
-            estado=estado,
-            raca=raca,
-            sexo=sexo_db,
-            faixa_etaria=faixa_etaria,
-            usar_raca_cor2=usar_raca_cor2
-        )
-        
-        # Se encontrou dados de população, calcular a taxa
-        if not df_pop.empty:
-            # Usar o ano mais recente disponível
-            pop_recente = df_pop.iloc[-1]['tam_pop']
-            
-            # Calcular taxa por 100.000 habitantes
-            if pop_recente > 0:
-                permanencia_por_municipio.at[idx, 'populacao'] = pop_recente
-                permanencia_por_municipio.at[idx, 'taxa_internacoes_100k'] = (row['total_internacoes'] / pop_recente) * 100000
-    
-    return permanencia_por_municipio
+    return adicionar_taxas_100k(
+        permanencia_por_municipio,
+        {'taxa_internacoes_100k': 'total_internacoes'},
+        usar_raca_cor2, sexo, faixa_etaria, raca
+    )
+
+# Função para obter a linha de tendência e a correlação de um par (indicador, score) a partir das
+# regressões da visão; com Spearman, r e p vêm dos postos e a linha continua sendo a linear
+def tendencia_e_correlacao(regressoes_tabela, indicador, score):
+    slope, intercept, r_value, p_value, std_err = regressao(regressoes_tabela['linha'], indicador, score)
+    if regressoes_tabela['correlacao'] is not regressoes_tabela['linha']:
+        _, _, r_value, p_value, _ = regressao(regressoes_tabela['correlacao'], indicador, score)
+    return slope, intercept, r_value, p_value, std_err
 
 # Função para carregar municípios
 def carregar_dicionario_municipios():
     try:
         # Tentar ler o arquivo Excel com os nomes dos municípios
-        df_mun = pd.read_excel('data/municipios.xlsx')
+        df_mun = ler_planilha('data/municipios.xlsx')
         
         # Criar um dicionário código -> nome
         municipios_dict = dict(zip(df_mun['Código'].astype(str), df_mun['Nome']))
@@ -408,9 +279,9 @@ def carregar_dicionario_municipios():
 
 # Carregar dados
 try:
-    df = load_data()
     # Carregar dicionário de municípios
     municipios_dict = load_municipalities()
+    dimensao_municipios = load_municipality_dim()
     
     # Display loading message while processing
     with st.spinner('Carregando dados...'):
@@ -427,11 +298,22 @@ try:
         index=2  # Default para 2024
     )
     
-    # Carregar dados do IDSC para o ano selecionado
-    idsc_dict, idsc_df, goal1_dict, goal3_dict, goal5_dict, goal10_dict = load_idsc_data(ano_idsc)
+    # Método da correlação mostrada nas abas; com Spearman, a linha de tendência continua
+    # sendo a da regressão linear
+    metodo_correlacao = st.sidebar.selectbox(
+        "Método de correlação:",
+        options=list(METODOS_CORRELACAO_PAINEL),
+        index=0
+    )
+    
+    # Os scores do IDSC de todos os anos já estão na matriz da dimensão de municípios;
+    # trocar o ano só muda a fatia usada
+    if not os.path.exists(caminho_idsc(ano_idsc)):
+        st.error(f"Arquivo do IDSC para o ano {ano_idsc} não encontrado: {caminho_idsc(ano_idsc)}")
+    colunas_idsc = colunas_idsc_disponiveis(dimensao_municipios, ano_idsc)
     
     # Filter by year range
-    years = sorted(df['ANO_CMPT'].unique())
+    years = load_sih_years()
     year_range = st.sidebar.slider(
         "Período de análise:",
         min_value=int(min(years)),
@@ -486,37 +368,21 @@ try:
     )
     estado = estados[estado_nome]
     
-    # Filtro de Município
-    codigo_municipio_options = ["Todos"]
-    if estado:
-        # Filtra municípios pelo estado selecionado
-        codigos_filtrados = [str(cod) for cod in sorted(df['MUNIC_RES'].unique()) if str(cod).startswith(estado)]
-        codigo_municipio_options += codigos_filtrados
-    else:
-        codigo_municipio_options += [str(cod) for cod in sorted(df['MUNIC_RES'].unique())]
+    # Carregar apenas as partições do período e do estado selecionados
+    df = load_data(year_range, estado)
     
-    # Adiciona nomes dos municípios aos códigos
-    codigo_municipio_display = ["Todos"]
-    for codigo in codigo_municipio_options[1:]:  # Pula o "Todos"
-        nome_municipio = municipios_dict.get(codigo, "")
-        if nome_municipio:
-            codigo_municipio_display.append(f"{codigo} - {nome_municipio}")
-        else:
-            codigo_municipio_display.append(codigo)
+    # Filtro de Município: os municípios presentes no recorte (já listados no índice de filtros),
+    # exibidos como "Código - Nome" a partir da dimensão de municípios
+    municipios_recorte = load_filter_index(year_range, estado)['dimensoes']['municipio']
+    codigo_municipio_options = ["Todos"] + [str(codigo) for codigo in municipios_da_uf(dimensao_municipios, estado, municipios_recorte)]
     
-    # Usar os códigos com nomes para display
-    codigo_municipio_option_display = st.sidebar.selectbox(
+    codigo_municipio_option = st.sidebar.selectbox(
         "Município",
-        options=codigo_municipio_display,
-        index=0
+        options=codigo_municipio_options,
+        index=0,
+        format_func=formatar_municipio(dimensao_municipios, "{codigo} - {nome}")
     )
     
-    # Extrair apenas o código do município selecionado
-    if codigo_municipio_option_display == "Todos":
-        codigo_municipio_option = "Todos"
-    else:
-        codigo_municipio_option = codigo_municipio_option_display.split(" - ")[0]
-    
     codigo_municipio = None if codigo_municipio_option == "Todos" else codigo_municipio_option
     
     # Filtro por sexo
@@ -606,12 +472,16 @@ try:
         raca = "Todas"  # Valor padrão se não existir informação racial
         
     # Filtro por grupo diagnóstico em árvore (hierárquico)
+    # Opções lidas da árvore diagnóstica do recorte (montada no carregamento), com a contagem de internações
+    arvore_diagnosticos = load_diagnosis_tree(year_range, estado)
+    
     # Grupo Diagnóstico
-    diag_grupo_options = ["Todos"] + sorted(df['def_diag_princ_grupo'].dropna().unique().tolist())
+    diag_grupo_options = ["Todos"] + opcoes_diagnostico(arvore_diagnosticos)
     diag_grupo = st.sidebar.selectbox(
         "Grupo Diagnóstico",
         options=diag_grupo_options,
-        index=0
+        index=0,
+        format_func=formatar_opcao_diagnostico(arvore_diagnosticos)
     )
     diag_grupo = None if diag_grupo == "Todos" else diag_grupo
     
@@ -623,12 +493,13 @@ try:
     else:
         # Se um grupo for selecionado, mostra as categorias correspondentes
         if 'def_diag_princ_cat' in df.columns:
-            categorias_filtradas = sorted(df[df['def_diag_princ_grupo'] == diag_grupo]['def_diag_princ_cat'].dropna().unique().tolist())
+            categorias_filtradas = opcoes_diagnostico(arvore_diagnosticos, diag_grupo)
             diag_categoria_options = ["Todas"] + categorias_filtradas
             diag_categoria = st.sidebar.selectbox(
                 "Categoria Diagnóstica",
                 options=diag_categoria_options,
-                index=0
+                index=0,
+                format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo)
             )
             diag_categoria = None if diag_categoria == "Todas" else diag_categoria
         else:
@@ -646,180 +517,101 @@ try:
     else:
         # Se uma categoria for selecionada, mostra as subcategorias correspondentes
         if 'def_diag_princ_subcat' in df.columns:
-            subcategorias_filtradas = sorted(df[df['def_diag_princ_cat'] == diag_categoria]['def_diag_princ_subcat'].dropna().unique().tolist())
+            subcategorias_filtradas = opcoes_diagnostico(arvore_diagnosticos, diag_grupo, diag_categoria)
             diag_subcategoria_options = ["Todas"] + subcategorias_filtradas
             diag_subcategoria = st.sidebar.selectbox(
                 "Subcategoria Diagnóstica",
                 options=diag_subcategoria_options,
-                index=0
+                index=0,
+                format_func=formatar_opcao_diagnostico(arvore_diagnosticos, diag_grupo, diag_categoria)
             )
             diag_subcategoria = None if diag_subcategoria == "Todas" else diag_subcategoria
         else:
             st.sidebar.text("Dados de subcategorias diagnósticas não disponíveis")
             diag_subcategoria = None
     
-    # Aplicar filtros
-    filtered_df = df.copy()
-    
-    # Filtrar por ano
-    filtered_df = filtered_df[
-        (filtered_df['ANO_CMPT'] >= year_range[0]) & 
-        (filtered_df['ANO_CMPT'] <= year_range[1])
-    ]
-    
-    # Filtrar por estado
-    if estado:
-        filtered_df = filtered_df[filtered_df['res_CODIGO_UF'].astype(str) == estado]
-    
-    # Filtrar por município - NÃO APLICAR este filtro para análise IDSC x indicadores
-    # if codigo_municipio:
-    #    filtered_df = filtered_df[filtered_df['MUNIC_RES'].astype(str) == codigo_municipio]
-    
-    # Filtrar por sexo
-    if sexo != "Todos":
-        if sexo == "Masculino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 1]
-        elif sexo == "Feminino":
-            filtered_df = filtered_df[filtered_df['SEXO'] == 3]
-    
-    # Filtrar por faixa etária
-    if faixa_etaria != "Todas":
-        age_ranges = {
-            '0-4': (0, 4),
-            '5-9': (5, 9),
-            '10-14': (10, 14),
-            '15-19': (15, 19),
-            '20-24': (20, 24),
-            '25-29': (25, 29),
-            '30-34': (30, 34),
-            '35-39': (35, 39),
-            '40-44': (40, 44),
-            '45-49': (45, 49),
-            '50-54': (50, 54),
-            '55-59': (55, 59),
-            '60-64': (60, 64),
-            '65-69': (65, 69),
-            '70-74': (70, 74),
-            '75-79': (75, 79),
-            '80-84': (80, 84),
-            '85-89': (85, 89),
-            '90-94': (90, 94),
-            '95-99': (95, 99),
-            '100+': (100, float('inf'))
-        }
-        age_min, age_max = age_ranges[faixa_etaria]
-        filtered_df = filtered_df[(filtered_df['IDADE'] >= age_min) & (filtered_df['IDADE'] <= age_max)]
-    
-    # Filtrar por raça/cor considerando a opção Raça/Cor 2
-    if 'RACA_COR' in df.columns and raca != "Todas":
-        if raca == "Negra" and usar_raca_cor2:
-            # Para Negra em Raça/Cor 2, incluir Preta e Parda
-            if 'RACA_COR_DESC' in df.columns:
-                filtered_df = filtered_df[filtered_df['RACA_COR_DESC'].isin(["Preta", "Parda"])]
-            else:
-                # Se não houver descrições, usar códigos 2 (Preta) e 3 (Parda)
-                filtered_df = filtered_df[filtered_df['RACA_COR'].isin([2, 3])]
-        else:
-            # Para outras raças ou modo tradicional
-            if 'RACA_COR_DESC' in df.columns:
-                filtered_df = filtered_df[filtered_df['RACA_COR_DESC'] == raca]
-            else:
-                # Encontrar o código correspondente à descrição
-                race_mapping_inv = {
-                    'Branca': 1,
-                    'Preta': 2,
-                    'Parda': 3,
-                    'Amarela': 4,
-                    'Indígena': 5,
-                    'Sem informação': 9
-                }
-                race_code = race_mapping_inv.get(raca)
-                if race_code:
-                    filtered_df = filtered_df[filtered_df['RACA_COR'] == race_code]
-                else:
-                    # Tentar converter diretamente se não for um dos valores mapeados
-                    try:
-                        race_code = int(raca)
-                        filtered_df = filtered_df[filtered_df['RACA_COR'] == race_code]
-                    except:
-                        pass
-    elif 'def_raca_cor' in df.columns and raca != "Todas":
-        if raca == "Negra" and usar_raca_cor2:
-            filtered_df = filtered_df[filtered_df['def_raca_cor'].isin(["Preta", "Parda"])]
-        else:
-            filtered_df = filtered_df[filtered_df['def_raca_cor'] == raca]
-    
-    # Filtrar por grupo diagnóstico
-    if diag_grupo is not None:
-        filtered_df = filtered_df[filtered_df['def_diag_princ_grupo'] == diag_grupo]
-    
-    # Filtrar por categoria diagnóstica
-    if diag_categoria is not None:
-        filtered_df = filtered_df[filtered_df['def_diag_princ_cat'] == diag_categoria]
-    
-    # Filtrar por subcategoria diagnóstica
-    if diag_subcategoria is not None:
-        filtered_df = filtered_df[filtered_df['def_diag_princ_subcat'] == diag_subcategoria]
-    
-    # Implement a safer approach to working with filtered data
-    # Create a copy right after filtering to avoid SettingWithCopyWarning
-    filtered_df = filtered_df.copy()
+    # Aplicar filtros cruzando os bitmaps do índice de filtros
+    # (sem o filtro de município, que não se aplica à análise IDSC x indicadores)
+    indice_filtros = load_filter_index(year_range, estado)
+    filtros = filtros_painel(year_range, estado, None, sexo, faixa_etaria, raca, usar_raca_cor2,
+                             diag_grupo=diag_grupo, diag_categoria=diag_categoria,
+                             diag_subcategoria=diag_subcategoria)
+    # Os indicadores por município só usam estas colunas; as demais não são materializadas.
+    # Os indicadores ficam guardados pela assinatura da visão (filtros e versão do SIH e da população)
+    # e o recorte só é filtrado quando algum deles ainda não foi calculado.
+    assinatura = assinatura_filtros('relacao_idsc', filtros, usar_raca_cor2,
+                                    versao_dados=(versao_recorte(year_range, estado),
+                                                  impressao_digital(fonte_populacao_paineis()[0])))
+    filtered_df = sob_demanda(filtrar_dataframe, df, indice_filtros, filtros, colunas=['MUNIC_RES', 'MORTE', 'DIAS_PERM'])
     
     # Calcular indicadores por município
     # Calcular indicadores por município com taxas por 100.000 habitantes
-    taxa_mortalidade_df = calcular_taxa_mortalidade_municipio(filtered_df, usar_raca_cor2, estado, sexo, faixa_etaria, raca)
-    tempo_permanencia_df = calcular_tempo_permanencia_municipio(filtered_df, usar_raca_cor2, estado, sexo, faixa_etaria, raca)
-    
-    # Contar internações por município
-    internacoes_por_municipio = filtered_df.groupby('MUNIC_RES').size().reset_index(name='total_internacoes')
-    
-    # Adicionar dados de população e calcular taxa por 100.000 habitantes
-    # Converter sexo para formato compatível com banco de dados
-    sexo_db = None
-    if sexo == "Masculino":
-        sexo_db = "M"
-    elif sexo == "Feminino":
-        sexo_db = "F"
-
-    # Obter dados de população para cada município
-    internacoes_por_municipio['MUNIC_RES_STR'] = internacoes_por_municipio['MUNIC_RES'].astype(str)
-
-    # Aplicar os dados de população e calcular taxas por 100k
-    for idx, row in internacoes_por_municipio.iterrows():
-        codigo_municipio = row['MUNIC_RES_STR']
-        # Buscar população para este município específico
-        df_pop = get_population_data(
-            codigo_municipio=codigo_municipio,
-            estado=estado,
-            raca=raca,
-            sexo=sexo_db,
-            faixa_etaria=faixa_etaria,
-            usar_raca_cor2=usar_raca_cor2
-        )
-        
-        # Se encontrou dados de população, calcular a taxa
-        if not df_pop.empty:
-            # Usar o ano mais recente disponível
-            pop_recente = df_pop.iloc[-1]['tam_pop']
-            
-            # Calcular taxa por 100.000 habitantes
-            if pop_recente > 0:
-                internacoes_por_municipio.at[idx, 'populacao'] = pop_recente
-                internacoes_por_municipio.at[idx, 'taxa_internacoes_100k'] = (row['total_internacoes'] / pop_recente) * 100000
-    
-    # Adicionar valores IDSC aos dataframes de indicadores
+    taxa_mortalidade_df = obter_resultado(assinatura, 'taxa_mortalidade_municipio', lambda: calcular_taxa_mortalidade_municipio(
+        filtered_df(), usar_raca_cor2, estado, sexo, faixa_etaria, raca))
+    tempo_permanencia_df = obter_resultado(assinatura, 'tempo_permanencia_municipio', lambda: calcular_tempo_permanencia_municipio(
+        filtered_df(), usar_raca_cor2, estado, sexo, faixa_etaria, raca))
+    
+    # Contar internações por município e adicionar a população e a taxa por 100.000 habitantes
+    internacoes_por_municipio = obter_resultado(assinatura, 'internacoes_municipio', lambda: adicionar_taxas_100k(
+        filtered_df().groupby('MUNIC_RES').size().reset_index(name='total_internacoes'),
+        {'taxa_internacoes_100k': 'total_internacoes'},
+        usar_raca_cor2, sexo, faixa_etaria, raca
+    ))
+    
+    # Adicionar os scores do IDSC (IDSC e Goals) aos dataframes de indicadores, numa única
+    # indexação da matriz do IDSC por município
     for df_indicador in [taxa_mortalidade_df, tempo_permanencia_df, internacoes_por_municipio]:
         df_indicador['MUNIC_RES_STR'] = df_indicador['MUNIC_RES'].astype(str)
-        df_indicador['IDSC'] = df_indicador['MUNIC_RES_STR'].map(idsc_dict)
-        df_indicador['Goal_1'] = df_indicador['MUNIC_RES_STR'].map(goal1_dict)
-        df_indicador['Goal_3'] = df_indicador['MUNIC_RES_STR'].map(goal3_dict)
-        df_indicador['Goal_5'] = df_indicador['MUNIC_RES_STR'].map(goal5_dict)
-        df_indicador['Goal_10'] = df_indicador['MUNIC_RES_STR'].map(goal10_dict)
-        df_indicador['Nome_Municipio'] = df_indicador['MUNIC_RES_STR'].map(municipios_dict)
+        df_indicador[list(COLUNAS_IDSC)] = scores_idsc(dimensao_municipios, df_indicador['MUNIC_RES'], ano_idsc)
+        df_indicador['Nome_Municipio'] = atributo_municipios(dimensao_municipios, df_indicador['MUNIC_RES'], 'nome')
         
         # Remover municípios sem IDSC
         df_indicador.dropna(subset=['IDSC'], inplace=True)
 
+    # Regressões de cada indicador contra todos os scores (IDSC, Goals, iCAPS e iRAPS), numa única
+    # passada por tabela, guardadas pela assinatura da visão, do ano do IDSC e do método escolhido.
+    # Os indicadores são aparados nos quantis 1% e 99%, como nos gráficos das abas.
+    metodo, peso = METODOS_CORRELACAO_PAINEL[metodo_correlacao]
+    indices_rede = [coluna for coluna in ['iCAPS', 'iRAPS'] if coluna in dimensao_municipios['tabela'].columns]
+    scores_regressao = list(COLUNAS_IDSC) + indices_rede
+    assinatura_regressoes = assinatura_filtros('relacao_idsc', filtros, usar_raca_cor2,
+                                               versao_dados=(versao_recorte(year_range, estado),
+                                                             impressao_digital(fonte_populacao_paineis()[0]),
+                                                             versao_dimensao_municipios()),
+                                               ano_idsc=ano_idsc, metodo_correlacao=metodo_correlacao)
+    
+    # Com taxas por 100.000 habitantes, a aba de tempo de permanência só usa municípios com população
+    tempo_com_populacao = None
+    if 'taxa_internacoes_100k' in tempo_permanencia_df.columns and tempo_permanencia_df['taxa_internacoes_100k'].notna().sum() > 5:
+        tempo_com_populacao = tempo_permanencia_df['taxa_internacoes_100k'].notna().to_numpy()
+    
+    regressoes = {}
+    for nome_tabela, rotulo_tabela, df_indicador, colunas_indicadores, linhas_regressao in [
+        ('taxa_mortalidade', "taxa de mortalidade", taxa_mortalidade_df, ['taxa_mortalidade_100k', 'taxa_mortalidade'], None),
+        ('tempo_permanencia', "tempo de permanência", tempo_permanencia_df, ['tempo_medio_permanencia'], tempo_com_populacao),
+        ('internacoes', "internações", internacoes_por_municipio, ['taxa_internacoes_100k', 'total_internacoes'], None),
+    ]:
+        for coluna in indices_rede:
+            df_indicador[coluna] = atributo_municipios(dimensao_municipios, df_indicador['MUNIC_RES'], coluna)
+        colunas_indicadores = [coluna for coluna in colunas_indicadores if coluna in df_indicador.columns]
+        # Sem população suficiente para ponderar, a tabela usa a regressão sem pesos
+        peso_tabela = peso if peso in df_indicador.columns and df_indicador[peso].notna().sum() > 5 else None
+        if peso is not None and peso_tabela is None:
+            st.info(f"Dados de população insuficientes para ponderar as correlações de {rotulo_tabela}. Usando Pearson sem pesos.")
+        tabela_linha = obter_resultado(assinatura_regressoes, f'regressoes_{nome_tabela}', regressoes_em_lote,
+                                       df_indicador, colunas_indicadores, scores_regressao, peso=peso_tabela,
+                                       aparar=(0.01, 0.99), linhas=linhas_regressao)
+        tabela_correlacao = tabela_linha if metodo == 'pearson' else obter_resultado(
+            assinatura_regressoes, f'correlacoes_{nome_tabela}', regressoes_em_lote,
+            df_indicador, colunas_indicadores, scores_regressao, metodo=metodo,
+            aparar=(0.01, 0.99), linhas=linhas_regressao)
+        regressoes[nome_tabela] = {'linha': tabela_linha, 'correlacao': tabela_correlacao}
+    
+    # Correlações de todos os pares, para consulta rápida
+    with st.expander(f"Correlações de todos os indicadores com os scores ({metodo_correlacao})"):
+        resumo_correlacoes = pd.concat([tabela['correlacao'] for tabela in regressoes.values()])
+        st.dataframe(resumo_correlacoes[['r', 'p', 'n']], use_container_width=True)
+
     # Main dashboard content with tabs
     tabs = st.tabs([
         "Taxa de Mortalidade x IDSC", 
@@ -893,13 +685,9 @@ try:
             
             # Adicionar linha de tendência
             try:
-                import numpy as np
-                from scipy import stats
-                
-                # Calcular linha de tendência
-                slope, intercept, r_value, p_value, std_err = stats.linregress(
-                    taxa_mortalidade_filtered['IDSC'],
-                    taxa_mortalidade_filtered['taxa_mortalidade_100k']
+                # Linha de tendência e correlação já calculadas para a visão
+                slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                    regressoes['taxa_mortalidade'], 'taxa_mortalidade_100k', 'IDSC'
                 )
                 
                 x_range = np.linspace(
@@ -1003,13 +791,9 @@ try:
             
             # Adicionar linha de tendência
             try:
-                import numpy as np
-                from scipy import stats
-                
-                # Calcular linha de tendência
-                slope, intercept, r_value, p_value, std_err = stats.linregress(
-                    taxa_mortalidade_filtered['IDSC'],
-                    taxa_mortalidade_filtered['taxa_mortalidade']
+                # Linha de tendência e correlação já calculadas para a visão
+                slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                    regressoes['taxa_mortalidade'], 'taxa_mortalidade', 'IDSC'
                 )
                 
                 x_range = np.linspace(
@@ -1126,13 +910,9 @@ try:
             
             # Adicionar linha de tendência
             try:
-                import numpy as np
-                from scipy import stats
-                
-                # Calcular linha de tendência
-                slope, intercept, r_value, p_value, std_err = stats.linregress(
-                    tempo_permanencia_filtered['IDSC'],
-                    tempo_permanencia_filtered['tempo_medio_permanencia']
+                # Linha de tendência e correlação já calculadas para a visão
+                slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                    regressoes['tempo_permanencia'], 'tempo_medio_permanencia', 'IDSC'
                 )
                 
                 x_range = np.linspace(
@@ -1236,13 +1016,9 @@ try:
             
             # Adicionar linha de tendência
             try:
-                import numpy as np
-                from scipy import stats
-                
-                # Calcular linha de tendência
-                slope, intercept, r_value, p_value, std_err = stats.linregress(
-                    tempo_permanencia_filtered['IDSC'],
-                    tempo_permanencia_filtered['tempo_medio_permanencia']
+                # Linha de tendência e correlação já calculadas para a visão
+                slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                    regressoes['tempo_permanencia'], 'tempo_medio_permanencia', 'IDSC'
                 )
                 
                 x_range = np.linspace(
@@ -1358,13 +1134,9 @@ try:
             
             # Adicionar linha de tendência
             try:
-                import numpy as np
-                from scipy import stats
-                
-                # Calcular linha de tendência
-                slope, intercept, r_value, p_value, std_err = stats.linregress(
-                    internacoes_filtered['IDSC'],
-                    internacoes_filtered['taxa_internacoes_100k']
+                # Linha de tendência e correlação já calculadas para a visão
+                slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                    regressoes['internacoes'], 'taxa_internacoes_100k', 'IDSC'
                 )
                 
                 x_range = np.linspace(
@@ -1467,13 +1239,9 @@ try:
             
             # Adicionar linha de tendência
             try:
-                import numpy as np
-                from scipy import stats
-                
-                # Calcular linha de tendência
-                slope, intercept, r_value, p_value, std_err = stats.linregress(
-                    internacoes_filtered['IDSC'],
-                    internacoes_filtered['total_internacoes']
+                # Linha de tendência e correlação já calculadas para a visão
+                slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                    regressoes['internacoes'], 'total_internacoes', 'IDSC'
                 )
                 
                 x_range = np.linspace(
@@ -1549,13 +1317,13 @@ try:
         
         # Verificar se há dados de Goals disponíveis
         goal_options = {}
-        if goal1_dict:
+        if "Goal_1" in colunas_idsc:
             goal_options["Goal 1"] = {"column": "Goal_1", "description": goal_descriptions["Goal 1"]}
-        if goal3_dict:
+        if "Goal_3" in colunas_idsc:
             goal_options["Goal 3"] = {"column": "Goal_3", "description": goal_descriptions["Goal 3"]}
-        if goal5_dict:
+        if "Goal_5" in colunas_idsc:
             goal_options["Goal 5"] = {"column": "Goal_5", "description": goal_descriptions["Goal 5"]}
-        if goal10_dict:
+        if "Goal_10" in colunas_idsc:
             goal_options["Goal 10"] = {"column": "Goal_10", "description": goal_descriptions["Goal 10"]}
         
         if not goal_options:
@@ -1630,13 +1398,9 @@ try:
                     
                     # Adicionar linha de tendência
                     try:
-                        import numpy as np
-                        from scipy import stats
-                        
-                        # Calcular linha de tendência
-                        slope, intercept, r_value, p_value, std_err = stats.linregress(
-                            taxa_mortalidade_filtered[goal_column],
-                            taxa_mortalidade_filtered['taxa_mortalidade_100k']
+                        # Linha de tendência e correlação já calculadas para a visão
+                        slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                            regressoes['taxa_mortalidade'], 'taxa_mortalidade_100k', goal_column
                         )
                         
                         x_range = np.linspace(
@@ -1749,13 +1513,9 @@ try:
                     
                     # Adicionar linha de tendência
                     try:
-                        import numpy as np
-                        from scipy import stats
-                        
-                        # Calcular linha de tendência
-                        slope, intercept, r_value, p_value, std_err = stats.linregress(
-                            taxa_mortalidade_filtered[goal_column],
-                            taxa_mortalidade_filtered['taxa_mortalidade']
+                        # Linha de tendência e correlação já calculadas para a visão
+                        slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                            regressoes['taxa_mortalidade'], 'taxa_mortalidade', goal_column
                         )
                         
                         x_range = np.linspace(
@@ -1898,13 +1658,9 @@ try:
                     
                     # Adicionar linha de tendência
                     try:
-                        import numpy as np
-                        from scipy import stats
-                        
-                        # Calcular linha de tendência
-                        slope, intercept, r_value, p_value, std_err = stats.linregress(
-                            tempo_permanencia_filtered[goal_column],
-                            tempo_permanencia_filtered['tempo_medio_permanencia']
+                        # Linha de tendência e correlação já calculadas para a visão
+                        slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                            regressoes['tempo_permanencia'], 'tempo_medio_permanencia', goal_column
                         )
                         
                         x_range = np.linspace(
@@ -2017,13 +1773,9 @@ try:
                     
                     # Adicionar linha de tendência
                     try:
-                        import numpy as np
-                        from scipy import stats
-                        
-                        # Calcular linha de tendência
-                        slope, intercept, r_value, p_value, std_err = stats.linregress(
-                            tempo_permanencia_filtered[goal_column],
-                            tempo_permanencia_filtered['tempo_medio_permanencia']
+                        # Linha de tendência e correlação já calculadas para a visão
+                        slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                            regressoes['tempo_permanencia'], 'tempo_medio_permanencia', goal_column
                         )
                         
                         x_range = np.linspace(
@@ -2165,13 +1917,9 @@ try:
                     
                     # Adicionar linha de tendência
                     try:
-                        import numpy as np
-                        from scipy import stats
-                        
-                        # Calcular linha de tendência
-                        slope, intercept, r_value, p_value, std_err = stats.linregress(
-                            internacoes_filtered[goal_column],
-                            internacoes_filtered['taxa_internacoes_100k']
+                        # Linha de tendência e correlação já calculadas para a visão
+                        slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                            regressoes['internacoes'], 'taxa_internacoes_100k', goal_column
                         )
                         
                         x_range = np.linspace(
@@ -2283,13 +2031,9 @@ try:
                     
                     # Adicionar linha de tendência
                     try:
-                        import numpy as np
-                        from scipy import stats
-                        
-                        # Calcular linha de tendência
-                        slope, intercept, r_value, p_value, std_err = stats.linregress(
-                            internacoes_filtered[goal_column],
-                            internacoes_filtered['total_internacoes']
+                        # Linha de tendência e correlação já calculadas para a visão
+                        slope, intercept, r_value, p_value, std_err = tendencia_e_correlacao(
+                            regressoes['internacoes'], 'total_internacoes', goal_column
                         )
                         
                         x_range = np.linspace(
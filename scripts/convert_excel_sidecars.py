@@ -0,0 +1,59 @@
+import os
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Permitir importar o pacote utils ao executar a partir da raiz do projeto
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.data_loaders import BASE_MAGDA_PATH
+from utils.excel_store import DIRETORIO_PLANILHAS, caminho_sidecar, converter_planilha
+from utils.municipality_dim import DTB_MUNICIPIOS_PATH, MUNICIPIOS_PATH
+
+# Planilhas lidas pelos painéis: (arquivo, aba, linhas puladas)
+PLANILHAS = [
+    (DTB_MUNICIPIOS_PATH, 0, 6),
+    (MUNICIPIOS_PATH, 0, None),
+    (BASE_MAGDA_PATH, 0, None),
+]
+
+# Função para listar as planilhas do IDSC presentes no diretório de dados
+def planilhas_idsc(diretorio='data'):
+    planilhas = []
+    for nome in sorted(os.listdir(diretorio)) if os.path.isdir(diretorio) else []:
+        encontrado = re.fullmatch(r'Base_de_Dados_IDSC-BR_(\d{4})\.xlsx', nome)
+        if encontrado:
+            ano = encontrado.group(1)
+            planilhas.append((os.path.join(diretorio, nome), f"IDSC-BR {ano}", None))
+    return planilhas
+
+def main():
+    parser = argparse.ArgumentParser(description="Converte as planilhas usadas pelos painéis em sidecars Parquet tipados")
+    parser.add_argument("--dados", default="data", help="Diretório com as planilhas do IDSC")
+
+    args = parser.parse_args()
+
+    print(f"Convertendo planilhas para {DIRETORIO_PLANILHAS}...")
+    falhas = 0
+    for caminho, aba, linhas_puladas in PLANILHAS + planilhas_idsc(args.dados):
+        if not os.path.exists(caminho):
+            print(f"  {caminho}: ausente, ignorado")
+            continue
+        inicio = time.time()
+        try:
+            df = converter_planilha(caminho, sheet_name=aba, skiprows=linhas_puladas)
+        except Exception as e:
+            falhas += 1
+            print(f"  {caminho} ({aba}): falhou - {e}")
+            continue
+        tamanho = os.path.getsize(caminho_sidecar(caminho, aba, linhas_puladas))
+        print(f"  {caminho} ({aba}): {len(df)} linhas x {len(df.columns)} colunas, "
+              f"{tamanho / 1024:.0f} KB em {time.time() - inicio:.1f}s")
+
+    if falhas:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
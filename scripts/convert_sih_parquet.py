@@ -0,0 +1,32 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Permitir importar o pacote utils ao executar a partir da raiz do projeto
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.sih_store import (SIH_CSV_PATH, SIH_PARQUET_PATH, SIH_IPC_PATH,
+                             converter_sih_para_parquet, exportar_sih_ipc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Converte o extrato CSV do SIH em Parquet tipado, particionado por ano e UF")
+    parser.add_argument("--csv", default=SIH_CSV_PATH, help="Arquivo CSV de origem")
+    parser.add_argument("--output", default=SIH_PARQUET_PATH, help="Diretório do dataset Parquet de destino")
+    parser.add_argument("--chunksize", type=int, default=500_000, help="Linhas lidas por bloco")
+    parser.add_argument("--ipc", default=SIH_IPC_PATH, help="Arquivo Arrow IPC com o recorte de saúde mental")
+
+    args = parser.parse_args()
+
+    print(f"Convertendo {args.csv} para {args.output}...")
+    inicio = time.time()
+    total_linhas = converter_sih_para_parquet(args.csv, args.output, chunksize=args.chunksize)
+    print(f"{total_linhas} linhas convertidas em {time.time() - inicio:.1f}s")
+
+    print(f"Exportando o recorte de saúde mental para {args.ipc}...")
+    inicio = time.time()
+    total_linhas = exportar_sih_ipc(args.output, args.ipc)
+    print(f"{total_linhas} internações exportadas em {time.time() - inicio:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Permitir importar o pacote utils ao executar a partir da raiz do projeto
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.sih_store import (SIH_PARQUET_PATH, SIH_IPC_PATH, SIH_VERSAO_PATH, SIH_CHUNKSIZE,
+                             anexar_competencias_sih)
+
+def main():
+    parser = argparse.ArgumentParser(description="Anexa novas competências do SIH ao dataset Parquet, regravando apenas as partições afetadas")
+    parser.add_argument("csv", nargs="+", help="Arquivos CSV com as competências novas (mesmo layout do extrato)")
+    parser.add_argument("--output", default=SIH_PARQUET_PATH, help="Diretório do dataset Parquet")
+    parser.add_argument("--ipc", default=SIH_IPC_PATH, help="Arquivo Arrow IPC com o recorte de saúde mental")
+    parser.add_argument("--versao", default=SIH_VERSAO_PATH, help="Manifesto de versões dos dados")
+    parser.add_argument("--chunksize", type=int, default=SIH_CHUNKSIZE, help="Linhas lidas por bloco")
+
+    args = parser.parse_args()
+
+    for csv_path in args.csv:
+        print(f"Anexando {csv_path} a {args.output}...")
+        inicio = time.time()
+        resultado = anexar_competencias_sih(csv_path, args.output, args.ipc, args.versao, chunksize=args.chunksize)
+        particoes = ", ".join(f"{ano}/{uf}" for ano, uf in resultado['particoes'])
+        print(f"{resultado['linhas']} linhas anexadas em {time.time() - inicio:.1f}s "
+              f"(versão {resultado['versao']}; partições: {particoes})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+
+# Permitir importar o pacote utils ao executar a partir da raiz do projeto
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.population_db import (POPULACAO_PAINEIS_PATH, POPULACAO_MUNICIPIOS_PATH,
+                                 POPULACAO_NORMALIZADA_PATH)
+
+# Tabelas normalizadas: a UF é gravada em vez de calculada com SUBSTR a cada consulta.
+# Cada layout fica na sua tabela, para que as visões devolvam exatamente o que os bancos
+# antigos devolviam: o layout por município não tem os estratos (sexo, raça, faixa etária)
+# e não pode entrar nos denominadores dos painéis.
+SCHEMA_NORMALIZADO = """
+CREATE TABLE populacao_base (
+    ano INTEGER NOT NULL,
+    uf TEXT NOT NULL,
+    codigo_municipio TEXT NOT NULL,
+    sexo TEXT,
+    raca TEXT,
+    faixa_etaria TEXT,
+    populacao INTEGER NOT NULL
+);
+CREATE TABLE populacao_municipio_base (
+    ano INTEGER NOT NULL,
+    uf TEXT NOT NULL,
+    codigo_municipio TEXT NOT NULL,
+    populacao INTEGER NOT NULL
+);
+"""
+
+# Índices de cobertura: as consultas dos painéis e do load_population_data são
+# respondidas apenas pelo índice, sem varrer a tabela
+INDICES = """
+CREATE INDEX idx_populacao_estratos
+    ON populacao_base (ano, uf, codigo_municipio, sexo, raca, faixa_etaria, populacao);
+CREATE INDEX idx_populacao_municipio
+    ON populacao_municipio_base (ano, uf, codigo_municipio, populacao);
+"""
+
+# Visões de compatibilidade com os dois layouts antigos
+VISOES = """
+CREATE VIEW populacao AS
+    SELECT ano, codigo_municipio, sexo, raca, faixa_etaria, populacao FROM populacao_base;
+CREATE VIEW populacao_municipio AS
+    SELECT ano, uf, codigo_municipio AS cod_municipio, populacao FROM populacao_municipio_base;
+"""
+
+
+# Função para verificar se um banco existe e possui a tabela populacao
+def tem_tabela_populacao(db_path):
+    if not db_path or not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='populacao'"
+        ).fetchone() is not None
+    finally:
+        conn.close()
+
+
+# Função para migrar os dois layouts de população para o schema normalizado
+def migrar_populacao(painel_db, municipios_db, output):
+    tmp_path = output + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA_NORMALIZADO)
+
+        # Layout dos painéis: ano, codigo_municipio, sexo, raca, faixa_etaria, populacao
+        if tem_tabela_populacao(painel_db):
+            conn.execute("ATTACH DATABASE ? AS painel", (painel_db,))
+            conn.execute("""
+                INSERT INTO populacao_base
+                SELECT ano, SUBSTR(CAST(codigo_municipio AS TEXT), 1, 2), CAST(codigo_municipio AS TEXT),
+                       sexo, raca, faixa_etaria, populacao
+                FROM painel.populacao
+                WHERE populacao IS NOT NULL
+            """)
+            conn.commit()
+            conn.execute("DETACH DATABASE painel")
+            print(f"Layout dos painéis importado de {painel_db}")
+
+        # Layout por município: ano, uf, cod_municipio, populacao (só na visão populacao_municipio)
+        if tem_tabela_populacao(municipios_db):
+            conn.execute("ATTACH DATABASE ? AS municipios", (municipios_db,))
+            conn.execute("""
+                INSERT INTO populacao_municipio_base
+                SELECT ano, CAST(uf AS TEXT), CAST(cod_municipio AS TEXT), populacao
+                FROM municipios.populacao
+                WHERE populacao IS NOT NULL
+            """)
+            conn.commit()
+            conn.execute("DETACH DATABASE municipios")
+            print(f"Layout por município importado de {municipios_db}")
+
+        conn.executescript(INDICES)
+        conn.executescript(VISOES)
+        conn.execute("ANALYZE")
+        conn.commit()
+        total_linhas = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM populacao_base) + (SELECT COUNT(*) FROM populacao_municipio_base)"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+    # Substituir o banco final apenas quando a migração terminar
+    os.replace(tmp_path, output)
+    return total_linhas
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra os bancos de população para um schema normalizado e indexado")
+    parser.add_argument("--painel-db", default=POPULACAO_PAINEIS_PATH,
+                        help="Banco com o layout dos painéis (codigo_municipio, sexo, raca, faixa_etaria)")
+    parser.add_argument("--municipios-db", default=POPULACAO_MUNICIPIOS_PATH,
+                        help="Banco com o layout por município (uf, cod_municipio)")
+    parser.add_argument("--output", default=POPULACAO_NORMALIZADA_PATH, help="Banco normalizado de destino")
+
+    args = parser.parse_args()
+
+    if not tem_tabela_populacao(args.painel_db) and not tem_tabela_populacao(args.municipios_db):
+        print("Nenhum banco de população encontrado para migrar.")
+        sys.exit(1)
+
+    print(f"Migrando população para {args.output}...")
+    inicio = time.time()
+    total_linhas = migrar_populacao(args.painel_db, args.municipios_db, args.output)
+    print(f"{total_linhas} linhas migradas em {time.time() - inicio:.1f}s")
+
+if __name__ == "__main__":
+    main()
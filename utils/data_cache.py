@@ -0,0 +1,379 @@
+import copy
+import functools
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Orçamento global de memória dos carregadores em cache (todas as funções somadas) e
+# política de despejo quando o orçamento é ultrapassado: 'lru' (menos recentemente usada)
+# ou 'lfu' (menos usada; empate pela menos recente)
+ORCAMENTO_CACHE_BYTES = 4 * 1024 ** 3
+POLITICA_DESPEJO = 'lru'
+POLITICAS_DESPEJO = ('lru', 'lfu')
+
+# Intervalo entre as verificações do aquecedor, que recarrega em segundo plano as entradas
+# cujos dados mudaram
+INTERVALO_AQUECIMENTO_S = 30
+
+# Entradas do cache por (função, argumentos): valor, versão dos dados, tamanho estimado, uso e
+# chaves das entradas de que dependem
+_trava = threading.Lock()
+_entradas = {}
+_travas_chaves = {}
+_configuracao = {'orcamento_bytes': ORCAMENTO_CACHE_BYTES, 'politica': POLITICA_DESPEJO}
+_metricas = {}
+_aquecedor = None
+
+# Chaves das entradas lidas pela carga em andamento em cada thread, para registrar dependências
+_acessos_thread = threading.local()
+
+
+# Função para calcular a impressão digital (tamanho e data de modificação) de arquivos ou
+# diretórios. Arquivos ausentes também entram, para que sua criação invalide o cache.
+def impressao_digital(*caminhos):
+    itens = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            for raiz, _, arquivos in os.walk(caminho):
+                for nome in arquivos:
+                    estado = os.stat(os.path.join(raiz, nome))
+                    itens.append((os.path.join(raiz, nome), estado.st_size, estado.st_mtime_ns))
+        elif os.path.exists(caminho):
+            estado = os.stat(caminho)
+            itens.append((caminho, estado.st_size, estado.st_mtime_ns))
+        else:
+            itens.append((caminho, None, None))
+    return hashlib.sha1(repr(sorted(itens)).encode()).hexdigest()[:16]
+
+
+# Função para criar uma função de versão que depende só de arquivos fixos
+def versao_arquivos(*caminhos):
+    return lambda *args, **kwargs: impressao_digital(*caminhos)
+
+
+# Função para mapear a memória de um array NumPy: o bloco é identificado pelo objeto que possui a
+# memória (o fim da cadeia .base), de modo que visões de um mesmo array apontam para o mesmo dono
+def _mapear_array(array, donos, bytes_=None):
+    dono = array
+    while isinstance(dono, np.ndarray) and dono.base is not None:
+        dono = dono.base
+    donos[(id(dono), array.__array_interface__['data'][0], array.nbytes)] = array.nbytes if bytes_ is None else bytes_
+
+
+# Função para mapear a memória dos valores de uma Series ou de um Index (sem o índice da Series)
+def _mapear_dados_pandas(objeto, donos):
+    if isinstance(objeto, (pd.RangeIndex, pd.MultiIndex)):
+        donos[(id(objeto), 0, 0)] = int(objeto.memory_usage(deep=True))
+        return
+    dados = objeto.array
+    if isinstance(dados, pd.Categorical):
+        _mapear_array(dados.codes, donos)
+        donos[(id(dados.categories), 0, 0)] = int(dados.categories.memory_usage(deep=True))
+    elif isinstance(objeto.dtype, np.dtype):
+        bytes_ = objeto.memory_usage(deep=True, index=False) if isinstance(objeto, pd.Series) \
+            else objeto.memory_usage(deep=True)
+        _mapear_array(objeto.to_numpy(), donos, int(bytes_))
+    else:
+        bytes_ = objeto.memory_usage(deep=True, index=False) if isinstance(objeto, pd.Series) \
+            else objeto.memory_usage(deep=True)
+        donos[(id(dados), 0, 0)] = int(bytes_)
+
+
+# Função para mapear a memória ocupada por um valor em cache (DataFrames, arrays e os dicionários,
+# listas e tuplas que os contêm) em um dicionário bloco -> bytes. Blocos compartilhados, como as
+# colunas de uma fatia (iloc) e as da base de que ela saiu, têm a mesma chave e contam uma vez.
+def _mapear_memoria(valor, donos, vistos):
+    if id(valor) in vistos:
+        return
+    vistos.add(id(valor))
+
+    if isinstance(valor, pd.DataFrame):
+        _mapear_dados_pandas(valor.index, donos)
+        for _, serie in valor.items():
+            _mapear_dados_pandas(serie, donos)
+    elif isinstance(valor, pd.Series):
+        _mapear_dados_pandas(valor.index, donos)
+        _mapear_dados_pandas(valor, donos)
+    elif isinstance(valor, pd.Index):
+        _mapear_dados_pandas(valor, donos)
+    elif isinstance(valor, np.ndarray):
+        _mapear_array(valor, donos)
+    elif isinstance(valor, dict):
+        donos[(id(valor), 0, 0)] = sys.getsizeof(valor)
+        for chave, item in valor.items():
+            _mapear_memoria(chave, donos, vistos)
+            _mapear_memoria(item, donos, vistos)
+    elif isinstance(valor, (list, tuple, set, frozenset)):
+        donos[(id(valor), 0, 0)] = sys.getsizeof(valor)
+        for item in valor:
+            _mapear_memoria(item, donos, vistos)
+    else:
+        donos[(id(valor), 0, 0)] = sys.getsizeof(valor)
+
+
+# Função para estimar a memória ocupada por um valor em cache. Objetos e blocos de memória
+# compartilhados são contados uma vez.
+def estimar_bytes(valor):
+    donos = {}
+    _mapear_memoria(valor, donos, set())
+    return sum(donos.values())
+
+
+# Função para estimar a memória que um valor possui, sem os blocos que ele divide com os valores
+# de que depende (por exemplo, uma fatia da base do SIH não é cobrada pelas colunas da base)
+def estimar_bytes_proprios(valor, dependencias=()):
+    donos = {}
+    _mapear_memoria(valor, donos, set())
+    compartilhados = {}
+    for dependencia in dependencias:
+        _mapear_memoria(dependencia, compartilhados, set())
+    donos_compartilhados = {chave[0] for chave in compartilhados}
+    return sum(bytes_ for chave, bytes_ in donos.items() if chave[0] not in donos_compartilhados)
+
+
+# Função para obter (criando) os contadores de uma função em cache
+def _metricas_funcao(nome):
+    if nome not in _metricas:
+        _metricas[nome] = {'acertos': 0, 'falhas': 0, 'despejos': 0, 'invalidacoes': 0, 'tempo_carga_s': 0.0}
+    return _metricas[nome]
+
+
+# Função para listar as entradas que dependem de uma entrada (com a trava global adquirida)
+def _dependentes(chave):
+    return [outra for outra, entrada in _entradas.items() if chave in entrada['dependencias']]
+
+
+# Função para remover uma entrada do cache e as que dependem dela, cujos valores dividem a sua
+# memória (com a trava global adquirida). Retorna os bytes removidos.
+def _remover(chave, motivo=None):
+    entrada = _entradas.pop(chave)
+    if motivo is not None:
+        _metricas_funcao(entrada['funcao'])[motivo] += 1
+    return entrada['bytes'] + sum(_remover(dependente, motivo) for dependente in _dependentes(chave)
+                                  if dependente in _entradas)
+
+
+# Função para verificar se um recurso (entregue às sessões sem cópia) ainda é referenciado fora do
+# cache, por exemplo pela sessão que o está usando, ou se alguma entrada que depende dele está em
+# uso (uma fatia da base aponta para a memória da base sem referenciá-la). Despejá-lo não liberaria
+# a memória, e a próxima carga deixaria duas cópias residentes, só uma delas contada no orçamento.
+def _em_uso(chave):
+    entrada = _entradas[chave]
+    if entrada['recurso']:
+        # Referências esperadas: a própria entrada e o argumento do getrefcount
+        if sys.getrefcount(entrada['valor']) > 2:
+            return True
+        # Itens de uma tupla (ex.: DataFrame e índice): também a variável do laço
+        if isinstance(entrada['valor'], tuple) and any(
+                sys.getrefcount(item) > 3 for item in entrada['valor']
+                if isinstance(item, (pd.DataFrame, pd.Series, np.ndarray, dict, list))):
+            return True
+    return any(_em_uso(dependente) for dependente in _dependentes(chave))
+
+
+# Função para despejar entradas até o total caber no orçamento, preservando a entrada recém-guardada
+# e os recursos ainda em uso (com a trava global adquirida). Despejar uma entrada despeja também as
+# que dependem dela. Se só restarem recursos em uso, o total fica acima do orçamento até que eles
+# sejam liberados.
+def _despejar(preservar=None):
+    total = sum(entrada['bytes'] for entrada in _entradas.values())
+    while total > _configuracao['orcamento_bytes']:
+        candidatas = [chave for chave in _entradas if chave != preservar and not _em_uso(chave)]
+        if not candidatas:
+            break
+        if _configuracao['politica'] == 'lfu':
+            vitima = min(candidatas, key=lambda chave: (_entradas[chave]['acessos'], _entradas[chave]['ultimo_acesso']))
+        else:
+            vitima = min(candidatas, key=lambda chave: _entradas[chave]['ultimo_acesso'])
+        total -= _remover(vitima, 'despejos')
+
+
+# Função para carregar e guardar uma entrada. Uma trava por chave impede que várias sessões
+# carreguem os mesmos dados ao mesmo tempo. As entradas das funções em depende_de lidas durante a
+# carga viram dependências da nova entrada, que é cobrada só pela memória que não divide com elas.
+def _carregar(chave, registro, versao_dados):
+    with _trava:
+        trava_chave = _travas_chaves.setdefault(chave, threading.Lock())
+
+    with trava_chave:
+        with _trava:
+            entrada = _entradas.get(chave)
+            if entrada is not None and entrada['versao_dados'] == versao_dados:
+                return entrada
+
+        externas = getattr(_acessos_thread, 'chaves', None)
+        _acessos_thread.chaves = []
+        inicio = time.perf_counter()
+        try:
+            valor = registro['carregador'](*registro['args'], **registro['kwargs'])
+        finally:
+            acessadas, _acessos_thread.chaves = _acessos_thread.chaves, externas
+        duracao = time.perf_counter() - inicio
+
+        with _trava:
+            dependencias = tuple(acessada for acessada in dict.fromkeys(acessadas)
+                                 if acessada[0] in registro['depende_de'] and acessada in _entradas)
+            valores_dependencias = [_entradas[dependencia]['valor'] for dependencia in dependencias]
+        tamanho = estimar_bytes_proprios(valor, valores_dependencias)
+
+        with _trava:
+            metricas = _metricas_funcao(registro['funcao'])
+            metricas['falhas'] += 1
+            metricas['tempo_carga_s'] += duracao
+            if chave in _entradas:
+                _remover(chave, 'invalidacoes')
+            dependencias = tuple(dependencia for dependencia in dependencias if dependencia in _entradas)
+            entrada = dict(registro, valor=valor, versao_dados=versao_dados, bytes=tamanho,
+                           dependencias=dependencias, acessos=1, ultimo_acesso=time.monotonic(),
+                           carregado_em=time.time())
+            _entradas[chave] = entrada
+            _despejar(preservar=chave)
+        return entrada
+
+
+# Decorador para carregadores cacheados pela versão dos dados. versao recebe os mesmos
+# argumentos do carregador e devolve a versão dos dados de que a chamada depende (por exemplo,
+# a impressão digital dos arquivos lidos). Cada combinação de argumentos guarda uma entrada,
+# substituída quando a versão muda; as entradas dividem um orçamento global de memória.
+# Com recurso=True o mesmo objeto é entregue a todas as sessões (como st.cache_resource),
+# senão cada chamada recebe uma cópia (como st.cache_data). depende_de lista os carregadores
+# cacheados cujos valores este divide sem copiar (ex.: fatias de uma base): a entrada deles
+# não é despejada enquanto uma entrada dependente estiver em uso, e sai do cache junto com ela.
+def cache_versionado(versao, recurso=False, depende_de=()):
+    nomes_dependencias = {f"{funcao.__module__}.{funcao.__qualname__}" for funcao in depende_de}
+
+    def decorador(carregador):
+        nome = f"{carregador.__module__}.{carregador.__qualname__}"
+
+        @functools.wraps(carregador)
+        def carregar(*args, **kwargs):
+            versao_dados = versao(*args, **kwargs)
+            chave = (nome, repr(args), repr(sorted(kwargs.items())))
+            with _trava:
+                entrada = _entradas.get(chave)
+                if entrada is not None and entrada['versao_dados'] == versao_dados:
+                    entrada['acessos'] += 1
+                    entrada['ultimo_acesso'] = time.monotonic()
+                    _metricas_funcao(nome)['acertos'] += 1
+                else:
+                    entrada = None
+
+            if entrada is None:
+                registro = {'funcao': nome, 'carregador': carregador, 'versao': versao,
+                            'args': args, 'kwargs': kwargs, 'recurso': recurso,
+                            'depende_de': nomes_dependencias}
+                entrada = _carregar(chave, registro, versao_dados)
+                _iniciar_aquecedor()
+
+            # Registrar o acesso para a carga em andamento nesta thread, se houver
+            acessadas = getattr(_acessos_thread, 'chaves', None)
+            if acessadas is not None:
+                acessadas.append(chave)
+            return entrada['valor'] if recurso else copy.deepcopy(entrada['valor'])
+
+        # Função para remover as entradas deste carregador (e as que dependem delas)
+        def limpar():
+            with _trava:
+                for chave in [chave for chave, entrada in _entradas.items() if entrada['funcao'] == nome]:
+                    if chave in _entradas:
+                        _remover(chave)
+
+        carregar.clear = limpar
+        return carregar
+    return decorador
+
+
+# Função para alterar o orçamento de memória e/ou a política de despejo em tempo de execução
+def configurar_cache(orcamento_bytes=None, politica=None):
+    with _trava:
+        if orcamento_bytes is not None:
+            _configuracao['orcamento_bytes'] = int(orcamento_bytes)
+        if politica is not None:
+            if politica not in POLITICAS_DESPEJO:
+                raise ValueError(f"Política de despejo desconhecida: {politica}")
+            _configuracao['politica'] = politica
+        _despejar()
+        return dict(_configuracao)
+
+
+# Função para esvaziar o cache (os contadores são mantidos)
+def limpar_cache():
+    with _trava:
+        _entradas.clear()
+
+
+# Função para obter as métricas do cache: configuração, uso total e, por função, acertos,
+# falhas, despejos, invalidações, entradas, bytes e tempo médio de carga
+def estatisticas_cache():
+    with _trava:
+        por_funcao = {nome: dict(metricas, entradas=0, bytes=0) for nome, metricas in _metricas.items()}
+        entradas = []
+        for entrada in _entradas.values():
+            por_funcao[entrada['funcao']]['entradas'] += 1
+            por_funcao[entrada['funcao']]['bytes'] += entrada['bytes']
+            entradas.append({
+                'funcao': entrada['funcao'],
+                'argumentos': ", ".join([repr(arg) for arg in entrada['args']] +
+                                        [f"{nome}={valor!r}" for nome, valor in entrada['kwargs'].items()]),
+                'bytes': entrada['bytes'],
+                'acessos': entrada['acessos'],
+                'carregado_em': entrada['carregado_em'],
+            })
+        configuracao = dict(_configuracao)
+
+    for metricas in por_funcao.values():
+        pedidos = metricas['acertos'] + metricas['falhas']
+        metricas['taxa_acerto'] = metricas['acertos'] / pedidos if pedidos else 0.0
+        metricas['tempo_medio_carga_s'] = metricas['tempo_carga_s'] / metricas['falhas'] if metricas['falhas'] else 0.0
+    return {
+        'orcamento_bytes': configuracao['orcamento_bytes'],
+        'politica': configuracao['politica'],
+        'bytes': sum(entrada['bytes'] for entrada in entradas),
+        'funcoes': por_funcao,
+        'entradas': entradas,
+    }
+
+
+# Função para recarregar as entradas em cache cujos dados mudaram desde a última carga.
+# Retorna a quantidade de entradas recarregadas.
+def aquecer_caches():
+    with _trava:
+        entradas = list(_entradas.items())
+
+    recarregadas = 0
+    for chave, entrada in entradas:
+        try:
+            versao_atual = entrada['versao'](*entrada['args'], **entrada['kwargs'])
+            if versao_atual == entrada['versao_dados']:
+                continue
+            _carregar(chave, entrada, versao_atual)
+            recarregadas += 1
+        except Exception as e:
+            logger.warning("Falha ao recarregar %s: %s", entrada['funcao'], e)
+    return recarregadas
+
+
+# Função executada pela thread do aquecedor
+def _laco_aquecimento():
+    while True:
+        time.sleep(INTERVALO_AQUECIMENTO_S)
+        recarregadas = aquecer_caches()
+        if recarregadas:
+            logger.info("%d entradas recarregadas após mudança nos dados", recarregadas)
+
+
+# Função para iniciar, uma vez por processo, a thread do aquecedor
+def _iniciar_aquecedor():
+    global _aquecedor
+    with _trava:
+        if _aquecedor is None:
+            _aquecedor = threading.Thread(target=_laco_aquecimento, name='aquecedor-caches', daemon=True)
+            _aquecedor.start()
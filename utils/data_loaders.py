@@ -1,69 +1,226 @@
+import logging
 import streamlit as st
+import numpy as np
 import pandas as pd
 import openpyxl
 import warnings
-import sqlite3
+
+from utils.population_db import consultar, fonte_populacao_municipios
+from utils.sih_store import (load_mental_health_data, listar_anos_sih, colunas_sih_painel, colunas_sih_paineis,
+                             versao_recorte_sih, reduzir_coluna_numerica)
+from utils.data_cache import cache_versionado, impressao_digital, versao_arquivos
+from utils.excel_store import ler_planilha
+from utils.filter_index import montar_indice_filtros, classificar_faixa_etaria
+from utils.diagnosis_tree import montar_arvore_diagnosticos
+from utils.helpers import canonizar_codigo_municipio
+from utils.population_cube import REGIOES_UFS
+from utils.rate_engine import REGIAO_POR_UF
+
+logger = logging.getLogger(__name__)
+
+# Bases de CIR juntadas aos recortes do SIH
+CIR_MUNICIPIOS_PATH = 'data/cir_municipios.csv'
+BASE_MAGDA_PATH = 'data/base_magda.xlsx'
+
+# Proporção máxima de valores distintos para guardar uma coluna de texto como categórica
+LIMITE_CATEGORICA = 0.5
+
+# Função para normalizar os tipos do SIH (inteiros compactos e texto repetitivo como categórico).
+# Retorna o DataFrame normalizado e um relatório com os bytes economizados por coluna.
+def normalizar_dados_sih(df):
+    novas_colunas = {}
+    relatorio = []
+    for coluna in df.columns:
+        serie = df[coluna]
+        if pd.api.types.is_numeric_dtype(serie):
+            nova = reduzir_coluna_numerica(serie)
+        elif (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)) \
+                and not isinstance(serie.dtype, pd.CategoricalDtype) \
+                and serie.nunique() <= LIMITE_CATEGORICA * max(len(serie), 1):
+            nova = serie.astype('category')
+        else:
+            nova = serie
+
+        bytes_antes = serie.memory_usage(deep=True, index=False)
+        bytes_depois = nova.memory_usage(deep=True, index=False)
+        relatorio.append({
+            'coluna': coluna,
+            'tipo_original': str(serie.dtype),
+            'tipo_normalizado': str(nova.dtype),
+            'bytes_antes': bytes_antes,
+            'bytes_depois': bytes_depois,
+            'bytes_economizados': bytes_antes - bytes_depois,
+        })
+        if nova is not serie:
+            novas_colunas[coluna] = nova
+
+    df_normalizado = df.assign(**novas_colunas) if novas_colunas else df
+    return df_normalizado, pd.DataFrame(relatorio)
+
+# Função para registrar no log do servidor a economia de memória da normalização: o detalhe por
+# coluna em nível DEBUG e o total em nível INFO
+def registrar_relatorio_normalizacao(relatorio, titulo="SIH"):
+    if relatorio.empty:
+        return
+    economizados = relatorio[relatorio['bytes_economizados'] > 0]
+    if logger.isEnabledFor(logging.DEBUG):
+        for _, linha in economizados.iterrows():
+            logger.debug("[%s] %s: %s -> %s (%.1f MB economizados)", titulo, linha['coluna'],
+                         linha['tipo_original'], linha['tipo_normalizado'], linha['bytes_economizados'] / 1024 ** 2)
+    logger.info("[%s] Memória: %.1f MB -> %.1f MB", titulo, relatorio['bytes_antes'].sum() / 1024 ** 2,
+                relatorio['bytes_depois'].sum() / 1024 ** 2)
+
+# Função para adicionar ao SIH, uma única vez no carregamento, as dimensões derivadas usadas
+# pelos filtros e gráficos: código de município canônico (int32), UF inteira, FAIXA_ETARIA,
+# REGIAO, grupo CIR rotulado (grupo_cir, de cir_municipios.csv) e numérico (Grupo_CIR, de base_magda.xlsx)
+def adicionar_dimensoes_derivadas(df):
+    novas_colunas = {}
+    if 'MUNIC_RES' in df.columns:
+        novas_colunas['MUNIC_RES'] = canonizar_codigo_municipio(df['MUNIC_RES'])
+    if 'res_CODIGO_UF' in df.columns:
+        uf = df['res_CODIGO_UF']
+        if not pd.api.types.is_integer_dtype(uf):
+            uf = pd.to_numeric(uf, errors='coerce')
+        novas_colunas['res_CODIGO_UF'] = uf.astype('Int8' if uf.isna().any() else 'int8')
+        novas_colunas['REGIAO'] = pd.Categorical(uf.map(REGIAO_POR_UF), categories=list(REGIOES_UFS))
+    if 'IDADE' in df.columns:
+        novas_colunas['FAIXA_ETARIA'] = classificar_faixa_etaria(df['IDADE'])
+
+    municipios = novas_colunas.get('MUNIC_RES')
+    if municipios is not None:
+        cir_dict, _ = load_cir_data()
+        if cir_dict:
+            cir_por_codigo = {int(codigo): grupo for codigo, grupo in cir_dict.items() if str(codigo).isdigit()}
+            novas_colunas['grupo_cir'] = municipios.map(cir_por_codigo).astype('category')
+
+        cir_numeric_df = load_cir_numeric_data()
+        if {'IBGE', 'Grupo_CIR'}.issubset(cir_numeric_df.columns):
+            grupos = cir_numeric_df.dropna(subset=['IBGE'])
+            cir_numerico = pd.Series(grupos['Grupo_CIR'].to_numpy(),
+                                     index=canonizar_codigo_municipio(grupos['IBGE']).to_numpy())
+            cir_numerico = cir_numerico[~cir_numerico.index.duplicated()]
+            novas_colunas['Grupo_CIR'] = reduzir_coluna_numerica(municipios.map(cir_numerico))
+
+    return df.assign(**novas_colunas)
+
+# Função para obter a versão de um recorte do SIH a partir dos argumentos dos carregadores.
+# Inclui as bases de CIR, que adicionar_dimensoes_derivadas junta ao recorte.
+def versao_recorte(year_range=None, estado=None, painel=None):
+    return versao_recorte_sih(year_range, estado), impressao_digital(CIR_MUNICIPIOS_PATH, BASE_MAGDA_PATH)
+
+# Colunas derivadas que o recorte de um painel leva além das colunas declaradas para ele
+COLUNAS_DERIVADAS = ['RACA_COR_DESC', 'REGIAO', 'FAIXA_ETARIA', 'grupo_cir', 'Grupo_CIR']
+
+# Função para obter a versão da base do SIH: a versão do recorte completo e as bases de CIR.
+# Também é a versão dos recortes dos painéis, fatias da base; seus argumentos são ignorados.
+def versao_base_sih(*args, **kwargs):
+    return versao_recorte_sih(), impressao_digital(CIR_MUNICIPIOS_PATH, BASE_MAGDA_PATH)
+
+# Função para carregar, uma vez por processo, a base de saúde mental do SIH com as colunas de
+# todos os painéis, em ordem de ano e UF, junto com os blocos de linhas de cada par (ano, UF).
+# Lida do recorte IPC, as colunas numéricas apontam para o arquivo mapeado em memória; os
+# recortes dos painéis (recorte_sih_painel) são fatias desta base. cache_resource entrega a
+# mesma base a todas as sessões; ela não deve ser alterada in-place.
+@cache_versionado(versao_base_sih, recurso=True)
+def load_health_base():
+    df = load_mental_health_data(columns=colunas_sih_paineis())
+    df, relatorio = normalizar_dados_sih(df)
+    registrar_relatorio_normalizacao(relatorio, "SIH")
+    df = adicionar_dimensoes_derivadas(df)
+
+    # O recorte IPC e o dataset Parquet já vêm em ordem de ano e UF; o CSV pode não vir
+    anos = df['ANO_CMPT'].to_numpy(dtype='float64', na_value=np.nan)
+    ufs = df['res_CODIGO_UF'].to_numpy(dtype='float64', na_value=np.nan)
+    if not np.all((anos[1:] > anos[:-1]) | ((anos[1:] == anos[:-1]) & (ufs[1:] >= ufs[:-1]))):
+        df = df.sort_values(['ANO_CMPT', 'res_CODIGO_UF'], kind='stable', ignore_index=True)
+        anos = df['ANO_CMPT'].to_numpy(dtype='float64', na_value=np.nan)
+        ufs = df['res_CODIGO_UF'].to_numpy(dtype='float64', na_value=np.nan)
+
+    inicios = np.flatnonzero(np.r_[len(df) > 0, (anos[1:] != anos[:-1]) | (ufs[1:] != ufs[:-1])])
+    blocos = pd.DataFrame({'ano': anos[inicios], 'uf': ufs[inicios],
+                           'inicio': inicios, 'fim': np.r_[inicios[1:], len(df)].astype(np.int64)})
+    return df, blocos
+
+# Função para recortar a base do SIH para um período, um estado e as colunas de um painel.
+# Um período com todos os estados é uma fatia contínua da base (sem cópia); com um estado,
+# só as linhas dele são copiadas. O recorte é guardado como dependente da base, que não é
+# despejada enquanto uma sessão usa um recorte, e é cobrado só pelas linhas que copiou.
+@cache_versionado(versao_base_sih, recurso=True, depende_de=(load_health_base,))
+def recorte_sih_painel(year_range=None, estado=None, painel=None):
+    df, blocos = load_health_base()
+    if year_range:
+        blocos = blocos[(blocos['ano'] >= int(year_range[0])) & (blocos['ano'] <= int(year_range[1]))]
+    if estado:
+        blocos = blocos[blocos['uf'] == int(estado)]
+        posicoes = np.concatenate([np.arange(inicio, fim) for inicio, fim in zip(blocos['inicio'], blocos['fim'])]
+                                  + [np.array([], dtype=np.int64)])
+        recorte = df.take(posicoes)
+    elif year_range:
+        recorte = df.iloc[blocos['inicio'].min():blocos['fim'].max()] if len(blocos) else df.iloc[:0]
+    else:
+        recorte = df
+    recorte = recorte.reset_index(drop=True)
+
+    colunas = colunas_sih_painel(painel)
+    if colunas is None:
+        return recorte
+    colunas = set(colunas + ['def_diag_princ_cap'] + COLUNAS_DERIVADAS)
+    return recorte[[coluna for coluna in recorte.columns if coluna in colunas]]
 
 # Load data from SIH
-@st.cache_data
-def load_health_data():
+# Recorte da base compartilhada (load_health_base) para o período, o estado e as colunas do
+# painel; os painéis não devem alterá-lo in-place.
+def load_health_data(year_range=None, estado=None, painel=None):
     try:
-        df = pd.read_csv('data/sih_2000_2024.csv', low_memory=False)
-        
-        # Convert date columns if needed
-        if 'dt_inter' in df.columns:
-            df['dt_inter'] = pd.to_datetime(df['dt_inter'])
-        
-        # Filter for psychiatric conditions (Transtornos mentais e comportamentais)
-        mental_health_df = df[df['def_diag_princ_cap'].str.contains('Transtornos mentais e comportamentais', na=False)]
-        
-        # Check if race column exists
-        if 'RACA_COR' in mental_health_df.columns:
-            # Map race/color codes to descriptions if needed
-            race_mapping = {
-                1: 'Branca',
-                2: 'Preta',
-                3: 'Parda',
-                4: 'Amarela',
-                5: 'Indígena',
-                9: 'Sem informação'
-            }
-            mental_health_df['RACA_COR_DESC'] = mental_health_df['RACA_COR'].map(race_mapping)
-        
-        return mental_health_df
+        return recorte_sih_painel(year_range, estado, painel)
     except Exception as e:
         st.error(f"Erro ao carregar dados de saúde: {e}")
         return pd.DataFrame()
 
+# Função para carregar o índice de bitmaps dos filtros, montado uma vez por recorte carregado
+# (e por versão do recorte)
+@cache_versionado(versao_recorte, recurso=True)
+def load_filter_index(year_range=None, estado=None, painel=None):
+    return montar_indice_filtros(load_health_data(year_range, estado, painel))
+
+# Função para carregar a árvore diagnóstica (grupo → categoria → subcategoria, com contagens)
+# que alimenta os selectbox de diagnóstico, montada uma vez por recorte carregado
+@cache_versionado(versao_recorte, recurso=True)
+def load_diagnosis_tree(year_range=None, estado=None, painel=None):
+    return montar_arvore_diagnosticos(load_health_data(year_range, estado, painel))
+
+# Função para listar os anos de competência disponíveis no SIH (uma ingestão pode trazer um ano novo)
+@cache_versionado(versao_recorte_sih)
+def load_sih_years():
+    try:
+        return listar_anos_sih()
+    except Exception as e:
+        st.error(f"Erro ao listar os anos do SIH: {e}")
+        return []
+
+# Função para obter o caminho do arquivo do IDSC de um ano
+def caminho_idsc(year):
+    return f"data/Base_de_Dados_IDSC-BR_{year}.xlsx"
+
+# Função para obter a versão do arquivo do IDSC de um ano
+def versao_idsc(year):
+    return impressao_digital(caminho_idsc(year))
+
 # Função para carregar os dados do IDSC
-@st.cache_data
+@cache_versionado(versao_idsc)
 def load_idsc_data(year):
     try:
-        file_path = f"data/Base_de_Dados_IDSC-BR_{year}.xlsx"
+        file_path = caminho_idsc(year)
         sheet_name = f"IDSC-BR {year}"
         
-        # Primeiro tente ler com pandas normalmente
+        # Ler a aba a partir do sidecar Parquet (convertido na primeira leitura; arquivos com
+        # "Bad CRC-32" são relidos com openpyxl e xlrd durante a conversão)
         try:
-            idsc_df = pd.read_excel(file_path, sheet_name=sheet_name)
+            idsc_df = ler_planilha(file_path, sheet_name=sheet_name)
         except Exception as e:
-            if "Bad CRC-32" in str(e):
-                st.warning(f"Arquivo Excel corrompido. Tentando método alternativo de leitura...")
-                # Tentar ler com engine diferente
-                try:
-                    idsc_df = pd.read_excel(file_path, sheet_name=sheet_name, engine='openpyxl')
-                except Exception as inner_e:
-                    # Se falhar, tentar método ainda mais robusto com xlrd
-                    try:
-                        import xlrd
-                        idsc_df = pd.read_excel(file_path, sheet_name=0, engine='xlrd')
-                    except Exception as xlrd_e:
-                        st.error(f"Não foi possível ler o arquivo Excel: {e}. Detalhes: {xlrd_e}")
-                        # Retornar dicionários vazios em caso de erro
-                        return {}, pd.DataFrame(), {}, {}, {}, {}
-            else:
-                st.error(f"Erro ao ler arquivo Excel: {e}")
-                # Retornar dicionários vazios em caso de erro
-                return {}, pd.DataFrame(), {}, {}, {}, {}
+            st.error(f"Erro ao ler arquivo Excel: {e}")
+            # Retornar dicionários vazios em caso de erro
+            return {}, pd.DataFrame(), {}, {}, {}, {}
         
         # Verificar se o DataFrame está vazio
         if idsc_df is None or idsc_df.empty:
@@ -86,37 +243,22 @@ def load_idsc_data(year):
             st.error(f"Coluna '{idsc_column}' não encontrada no arquivo IDSC {year}.")
             return {}, pd.DataFrame(), {}, {}, {}, {}
         
-        # Criar um dicionário de códigos de municípios para valores IDSC
-        idsc_dict = {}
-        
-        # Criar dicionários para os Goals individuais
-        goal1_dict = {}
-        goal3_dict = {}
-        goal5_dict = {}
-        goal10_dict = {}
+        # Linhas com código e valor do IDSC; os Goals entram só para essas linhas, sem os nulos
+        validas = idsc_df[idsc_df['COD_MUN_AJUSTADO'].notna() & idsc_df[idsc_column].notna()]
+        codigos = validas['COD_MUN_AJUSTADO']
         
-        # Verificar se as colunas de Goals existem
-        goal1_col = 'Goal 1 Score' if 'Goal 1 Score' in idsc_df.columns else None
-        goal3_col = 'Goal 3 Score' if 'Goal 3 Score' in idsc_df.columns else None
-        goal5_col = 'Goal 5 Score' if 'Goal 5 Score' in idsc_df.columns else None
-        goal10_col = 'Goal 10 Score' if 'Goal 10 Score' in idsc_df.columns else None
+        # Montar os dicionários código -> valor por coluna, de uma vez
+        def dicionario(coluna):
+            if coluna not in validas.columns:
+                return {}
+            preenchidas = validas[coluna].notna()
+            return dict(zip(codigos[preenchidas], validas.loc[preenchidas, coluna]))
         
-        for _, row in idsc_df.iterrows():
-            # Verificar se a linha tem todos os dados necessários
-            if pd.isna(row['COD_MUN_AJUSTADO']) or pd.isna(row[idsc_column]):
-                continue
-                
-            idsc_dict[row['COD_MUN_AJUSTADO']] = row[idsc_column]
-            
-            # Adicionar os Goals individuais, se existirem
-            if goal1_col and not pd.isna(row.get(goal1_col, pd.NA)):
-                goal1_dict[row['COD_MUN_AJUSTADO']] = row[goal1_col]
-            if goal3_col and not pd.isna(row.get(goal3_col, pd.NA)):
-                goal3_dict[row['COD_MUN_AJUSTADO']] = row[goal3_col]
-            if goal5_col and not pd.isna(row.get(goal5_col, pd.NA)):
-                goal5_dict[row['COD_MUN_AJUSTADO']] = row[goal5_col]
-            if goal10_col and not pd.isna(row.get(goal10_col, pd.NA)):
-                goal10_dict[row['COD_MUN_AJUSTADO']] = row[goal10_col]
+        idsc_dict = dicionario(idsc_column)
+        goal1_dict = dicionario('Goal 1 Score')
+        goal3_dict = dicionario('Goal 3 Score')
+        goal5_dict = dicionario('Goal 5 Score')
+        goal10_dict = dicionario('Goal 10 Score')
         
         # Verificar se os dicionários não estão vazios
         if not idsc_dict:
@@ -129,11 +271,11 @@ def load_idsc_data(year):
         return {}, pd.DataFrame(), {}, {}, {}, {}
 
 # Função para carregar dados de CIR (Classificação dos Municípios)
-@st.cache_data
+@cache_versionado(versao_arquivos(CIR_MUNICIPIOS_PATH))
 def load_cir_data():
     try:
         # Ajuste o caminho conforme necessário
-        file_path = "data/cir_municipios.csv"
+        file_path = CIR_MUNICIPIOS_PATH
         cir_df = pd.read_csv(file_path)
         
         # Criar um dicionário de códigos de municípios para grupos CIR
@@ -149,15 +291,28 @@ def load_cir_data():
         st.warning(f"Erro ao carregar dados de CIR: {e}")
         return ({}, pd.DataFrame())
 
+# Função para carregar os grupos CIR numéricos e os índices iCAPS/iRAPS (base_magda.xlsx)
+@cache_versionado(versao_arquivos(BASE_MAGDA_PATH))
+def load_cir_numeric_data():
+    try:
+        return ler_planilha(BASE_MAGDA_PATH)
+    except Exception as e:
+        st.warning(f"Erro ao carregar dados de grupos CIR numéricos: {e}")
+        return pd.DataFrame()
+
+# Função para obter a versão do banco de população consultado por load_population_data
+def versao_populacao_municipios(year=None, state_code=None, municipality_code=None):
+    return impressao_digital(fonte_populacao_municipios()[0])
+
 # Função para carregar dados de população do banco populacao.db
-@st.cache_data
+@cache_versionado(versao_populacao_municipios)
 def load_population_data(year=None, state_code=None, municipality_code=None):
     try:
-        # Conectar ao banco de dados
-        conn = sqlite3.connect('data/populacao.db')
+        # Banco normalizado (visão populacao_municipio) quando migrado; senão data/populacao.db
+        db_path, tabela = fonte_populacao_municipios()
         
         # Construir a query SQL com base nos filtros
-        query = "SELECT * FROM populacao"
+        query = f"SELECT ano, uf, cod_municipio, populacao FROM {tabela}"
         params = []
         
         # Adicionar filtros à query
@@ -179,11 +334,8 @@ def load_population_data(year=None, state_code=None, municipality_code=None):
         if where_clauses:
             query += " WHERE " + " AND ".join(where_clauses)
             
-        # Executar a query
-        df_pop = pd.read_sql_query(query, conn, params=params)
-        
-        # Fechar a conexão
-        conn.close()
+        # Executar a query em uma conexão somente leitura compartilhada pelo processo
+        df_pop = consultar(db_path, query, params)
         
         return df_pop
     except Exception as e:
@@ -196,20 +348,18 @@ def calcular_taxa_internacao_por_100k(df_filtered, df_pop):
     # Verificar quais colunas precisam ser preservadas
     colunas_extras = ['Grupo_CIR'] if 'Grupo_CIR' in df_filtered.columns else []
     
-    # Garantir que MUNIC_RES seja tratado como string para evitar problemas de tipo no merge
-    df_filtered = df_filtered.copy()
-    df_filtered['MUNIC_RES'] = df_filtered['MUNIC_RES'].astype(str)
-    
     # Construir o dicionário de agregação para colunas extras
     extra_aggs = {}
     for col in colunas_extras:
         extra_aggs[col] = (col, 'first')
     
-    # Contar internações por município
+    # Contar internações por município direto no recorte (sem copiá-lo); só a chave
+    # agregada vira texto, para o merge com a população
     internacoes_por_municipio = df_filtered.groupby('MUNIC_RES').agg(
         total_internacoes=('MUNIC_RES', 'count'),
         **extra_aggs
     ).reset_index()
+    internacoes_por_municipio['MUNIC_RES'] = internacoes_por_municipio['MUNIC_RES'].astype(str)
     
     # Garantir que cod_municipio também seja string
     df_pop = df_pop.copy()
@@ -0,0 +1,68 @@
+from itertools import takewhile
+
+# Colunas da hierarquia diagnóstica do SIH (grupo → categoria → subcategoria). A subcategoria
+# aparece como def_diag_princ_subcat ou def_diag_princ_subcategoria, conforme o recorte carregado.
+NIVEIS_DIAGNOSTICO_SIH = ['def_diag_princ_grupo', 'def_diag_princ_cat', 'def_diag_princ_subcat']
+NIVEIS_CAUSA_BASICA_SIM = ['causabas_grupo', 'causabas_categoria', 'causabas_subcategoria']
+
+# Opções dos selectbox que significam "sem filtro"
+OPCOES_TODOS = ("Todos", "Todas")
+
+
+# Função para montar a árvore diagnóstica de um DataFrame, uma vez por DataFrame carregado:
+# cada nó guarda a contagem de linhas e os filhos em ordem alfabética. Linhas com o nível nulo
+# contam só para os nós acima dele. Um nível ausente encerra a hierarquia.
+def montar_arvore_diagnosticos(df, niveis=None):
+    if niveis is None:
+        niveis = list(NIVEIS_DIAGNOSTICO_SIH)
+        if niveis[-1] not in df.columns and 'def_diag_princ_subcategoria' in df.columns:
+            niveis[-1] = 'def_diag_princ_subcategoria'
+    niveis = list(takewhile(lambda coluna: coluna in df.columns, niveis))
+
+    arvore = {'contagem': len(df), 'filhos': {}}
+    for profundidade in range(1, len(niveis) + 1):
+        contagens = df.groupby(niveis[:profundidade], observed=True, sort=False).size()
+        for chave, contagem in sorted(contagens.items(), key=lambda item: item[0]):
+            caminho = chave if isinstance(chave, tuple) else (chave,)
+            no = arvore
+            for rotulo in caminho[:-1]:
+                no = no['filhos'][rotulo]
+            no['filhos'][caminho[-1]] = {'contagem': int(contagem), 'filhos': {}}
+    return arvore
+
+
+# Função para obter o nó da árvore no caminho escolhido (grupo, categoria, ...); opções
+# "Todos"/"Todas" ou None encerram o caminho. Retorna None se o caminho não existir.
+def no_diagnostico(arvore, *caminho):
+    no = arvore
+    for rotulo in caminho:
+        if rotulo is None or rotulo in OPCOES_TODOS:
+            break
+        no = no['filhos'].get(rotulo)
+        if no is None:
+            return None
+    return no
+
+
+# Função para listar as opções de um selectbox: os filhos do nó no caminho escolhido
+def opcoes_diagnostico(arvore, *caminho):
+    no = no_diagnostico(arvore, *caminho)
+    return list(no['filhos']) if no is not None else []
+
+
+# Função para criar o format_func de um selectbox de diagnóstico: cada opção aparece com a
+# contagem de linhas do seu nó; "Todos"/"Todas" mostram o total do nó pai
+def formatar_opcao_diagnostico(arvore, *caminho):
+    no = no_diagnostico(arvore, *caminho)
+
+    def formatar(opcao):
+        if no is None:
+            return str(opcao)
+        if opcao in OPCOES_TODOS:
+            contagem = no['contagem']
+        elif opcao in no['filhos']:
+            contagem = no['filhos'][opcao]['contagem']
+        else:
+            return str(opcao)
+        return f"{opcao} ({contagem:,})".replace(",", ".")
+    return formatar
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.data_cache import impressao_digital
+
+logger = logging.getLogger(__name__)
+
+# Planilhas já convertidas para Parquet tipado ("sidecars"), uma por (arquivo, aba, linhas
+# puladas). Cada sidecar guarda a impressão digital da planilha de origem; quando a planilha
+# muda, ele é regravado na próxima leitura.
+DIRETORIO_PLANILHAS = 'data/cache_planilhas'
+
+# Chave dos metadados do sidecar no schema Parquet
+CHAVE_METADADOS = b'planilha_origem'
+
+
+# Função para obter o caminho do sidecar de uma aba de uma planilha
+def caminho_sidecar(caminho, sheet_name=0, skiprows=None):
+    nome = os.path.basename(caminho)
+    return os.path.join(DIRETORIO_PLANILHAS, f"{nome}__{sheet_name}__{skiprows or 0}.parquet")
+
+
+# Função para ler uma aba com o pandas. Arquivos com "Bad CRC-32" (zip corrompido) são relidos
+# com openpyxl e, se ainda falharem, com xlrd a partir da primeira aba.
+def _ler_excel(caminho, sheet_name=0, skiprows=None):
+    try:
+        return pd.read_excel(caminho, sheet_name=sheet_name, skiprows=skiprows)
+    except Exception as e:
+        if "Bad CRC-32" not in str(e):
+            raise
+        logger.warning("%s corrompido (%s); tentando método alternativo de leitura", caminho, e)
+        try:
+            return pd.read_excel(caminho, sheet_name=sheet_name, skiprows=skiprows, engine='openpyxl')
+        except Exception:
+            return pd.read_excel(caminho, sheet_name=0, skiprows=skiprows, engine='xlrd')
+
+
+# Função para tipar as colunas de texto antes da gravação: colunas que misturam números e texto
+# (por exemplo, códigos com e sem zeros à esquerda) viram texto, que o Parquet consegue guardar
+def _tipar_colunas(df):
+    novas_colunas = {}
+    for posicao, coluna in enumerate(df.columns):
+        serie = df.iloc[:, posicao]
+        if pd.api.types.is_object_dtype(serie) and pd.api.types.infer_dtype(serie, skipna=True).startswith('mixed'):
+            novas_colunas[posicao] = serie.where(serie.isna(), serie.astype(str))
+    if not novas_colunas:
+        return df
+    df = df.copy()
+    for posicao, serie in novas_colunas.items():
+        df.isetitem(posicao, serie)
+    return df
+
+
+# Função para ler um sidecar válido (None se ausente, de outra versão da planilha ou inconsistente)
+def _ler_sidecar(caminho, sheet_name=0, skiprows=None):
+    sidecar = caminho_sidecar(caminho, sheet_name, skiprows)
+    if not os.path.exists(sidecar):
+        return None
+    try:
+        metadados = json.loads(pq.read_schema(sidecar).metadata[CHAVE_METADADOS])
+        if metadados['impressao_digital'] != impressao_digital(caminho):
+            return None
+        tabela = pq.read_table(sidecar)
+        if tabela.num_rows != metadados['linhas'] or tabela.num_columns != len(metadados['colunas']):
+            logger.warning("Ignorando %s: tamanho diferente do registrado", sidecar)
+            return None
+        df = tabela.to_pandas()
+        # O Parquet guarda os nomes das colunas como texto; os nomes originais ficam nos metadados
+        df.columns = metadados['colunas']
+        return df
+    except Exception as e:
+        logger.warning("Ignorando %s: %s", sidecar, e)
+        return None
+
+
+# Função para converter uma aba de planilha em sidecar Parquet tipado. O arquivo é gravado num
+# temporário, relido e validado (linhas, colunas e nulos por coluna) antes de substituir o sidecar
+# anterior. Retorna o DataFrame relido do sidecar.
+def converter_planilha(caminho, sheet_name=0, skiprows=None):
+    versao = impressao_digital(caminho)
+    df = _tipar_colunas(_ler_excel(caminho, sheet_name, skiprows))
+
+    tabela = pa.Table.from_pandas(df.set_axis([str(coluna) for coluna in df.columns], axis=1),
+                                  preserve_index=False)
+    metadados = {
+        'fonte': caminho,
+        'aba': sheet_name,
+        'linhas_puladas': skiprows or 0,
+        'impressao_digital': versao,
+        'linhas': len(df),
+        'colunas': [coluna if isinstance(coluna, (int, float)) else str(coluna) for coluna in df.columns],
+    }
+    metadados_schema = dict(tabela.schema.metadata or {})
+    metadados_schema[CHAVE_METADADOS] = json.dumps(metadados, ensure_ascii=False)
+    tabela = tabela.replace_schema_metadata(metadados_schema)
+
+    sidecar = caminho_sidecar(caminho, sheet_name, skiprows)
+    os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    temporario = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(tabela, temporario)
+
+    relido = pq.read_table(temporario).to_pandas()
+    if relido.shape != df.shape or relido.isna().sum().tolist() != df.isna().sum().tolist():
+        os.remove(temporario)
+        raise ValueError(f"Conversão de {caminho} ({sheet_name}) não confere com a planilha")
+    os.replace(temporario, sidecar)
+    # Devolver o que foi gravado, para que a primeira leitura e as seguintes tenham os mesmos tipos
+    relido.columns = metadados['colunas']
+    return relido
+
+
+# Função para ler uma aba de planilha a partir do sidecar, convertendo-a na primeira leitura ou
+# quando a planilha muda. Se o sidecar não puder ser gravado, a planilha lida é usada assim mesmo.
+def ler_planilha(caminho, sheet_name=0, skiprows=None):
+    df = _ler_sidecar(caminho, sheet_name, skiprows)
+    if df is not None:
+        return df
+    try:
+        return converter_planilha(caminho, sheet_name, skiprows)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        logger.warning("Não foi possível gravar o sidecar de %s: %s", caminho, e)
+        return _tipar_colunas(_ler_excel(caminho, sheet_name, skiprows))
@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+
+# Faixas etárias de 5 anos usadas como base do índice (idade mínima, idade máxima).
+# Faixas mais largas dos filtros (ex.: "90+") são a união das faixas de base que cobrem.
+FAIXAS_ETARIAS_BASE = {
+    '0-4': (0, 4),
+    '5-9': (5, 9),
+    '10-14': (10, 14),
+    '15-19': (15, 19),
+    '20-24': (20, 24),
+    '25-29': (25, 29),
+    '30-34': (30, 34),
+    '35-39': (35, 39),
+    '40-44': (40, 44),
+    '45-49': (45, 49),
+    '50-54': (50, 54),
+    '55-59': (55, 59),
+    '60-64': (60, 64),
+    '65-69': (65, 69),
+    '70-74': (70, 74),
+    '75-79': (75, 79),
+    '80-84': (80, 84),
+    '85-89': (85, 89),
+    '90-94': (90, 94),
+    '95-99': (95, 99),
+    '100+': (100, float('inf'))
+}
+
+# Faixas etárias aceitas nos filtros dos painéis
+FAIXAS_ETARIAS = dict(FAIXAS_ETARIAS_BASE, **{'90+': (90, float('inf'))})
+
+# Códigos de sexo do SIH
+CODIGOS_SEXO = {'Masculino': 1, 'Feminino': 3}
+
+# Valores dos selectbox que significam "sem filtro"
+SEM_FILTRO = (None, "Todos", "Todas")
+
+# Quantidade de bits ligados em cada valor de byte, para contar linhas sem desempacotar
+_BITS_POR_BYTE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+# Função para compactar o conjunto de linhas de um valor: valores raros ficam como lista
+# ordenada de posições (int32), os demais como bitset empacotado (1 bit por linha, uint8)
+def _compactar(posicoes, n_linhas):
+    if len(posicoes) * 32 < n_linhas:
+        return posicoes.astype(np.int32)
+    bits = np.zeros(n_linhas, dtype=bool)
+    bits[posicoes] = True
+    return np.packbits(bits)
+
+
+# Função para indexar uma dimensão: um conjunto de linhas por valor distinto (nulos ficam fora)
+def _indexar_dimensao(valores, n_linhas):
+    codigos, rotulos = pd.factorize(valores, sort=True)
+    ordem = np.argsort(codigos, kind='stable')
+    ordem = ordem[np.count_nonzero(codigos < 0):]
+    contagens = np.bincount(codigos[codigos >= 0], minlength=len(rotulos))
+    grupos = np.split(ordem, np.cumsum(contagens)[:-1])
+    return {rotulo: _compactar(posicoes, n_linhas) for rotulo, posicoes in zip(rotulos.tolist(), grupos)}
+
+
+# Função para classificar as idades nas faixas etárias de base (categórica ordenada)
+def classificar_faixa_etaria(idades):
+    limites = [minimo for minimo, _ in FAIXAS_ETARIAS_BASE.values()]
+    idades = pd.to_numeric(idades, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    codigos = np.searchsorted(limites, idades, side='right') - 1
+    codigos[np.isnan(idades)] = -1
+    return pd.Categorical.from_codes(codigos, categories=list(FAIXAS_ETARIAS_BASE), ordered=True)
+
+
+# Função para converter códigos (UF, município) em inteiros, comparáveis sem passar por texto
+def _codigos_inteiros(serie):
+    if pd.api.types.is_integer_dtype(serie):
+        return serie
+    return pd.to_numeric(serie, errors='coerce').astype('Int64')
+
+
+# Função para montar o índice de bitmaps do DataFrame do SIH, uma vez por DataFrame carregado.
+# Usa as dimensões derivadas do carregamento (FAIXA_ETARIA, grupo_cir) quando presentes;
+# cir_dict (código do município em texto -> grupo CIR) é a alternativa para o grupo CIR.
+def montar_indice_filtros(df, cir_dict=None):
+    n_linhas = len(df)
+    municipios = _codigos_inteiros(df['MUNIC_RES'])
+    colunas = {
+        'ano': df['ANO_CMPT'],
+        'uf': _codigos_inteiros(df['res_CODIGO_UF']),
+        'municipio': municipios,
+        'sexo': df['SEXO'],
+        'faixa_etaria': df['FAIXA_ETARIA'] if 'FAIXA_ETARIA' in df.columns else classificar_faixa_etaria(df['IDADE']),
+        'raca': df['RACA_COR_DESC'] if 'RACA_COR_DESC' in df.columns else df.get('def_raca_cor'),
+        'diag_grupo': df.get('def_diag_princ_grupo'),
+        'diag_categoria': df.get('def_diag_princ_cat'),
+        'diag_subcategoria': df.get('def_diag_princ_subcat', df.get('def_diag_princ_subcategoria')),
+        'cir': df.get('grupo_cir'),
+    }
+    if colunas['cir'] is None and cir_dict:
+        cir_por_codigo = {int(codigo): grupo for codigo, grupo in cir_dict.items() if str(codigo).isdigit()}
+        colunas['cir'] = municipios.map(cir_por_codigo)
+
+    dimensoes = {}
+    for dimensao, valores in colunas.items():
+        if valores is not None:
+            dimensoes[dimensao] = _indexar_dimensao(valores, n_linhas)
+    return {'n_linhas': n_linhas, 'dimensoes': dimensoes}
+
+
+# Função para converter os valores dos filtros da barra lateral no dicionário
+# dimensão -> valores aceito por selecionar_linhas e contar_linhas
+def filtros_painel(year_range=None, estado=None, codigo_municipio=None, sexo="Todos", faixa_etaria="Todas",
+                   raca="Todas", usar_raca_cor2=False, grupo_cir="Todos", diag_grupo=None,
+                   diag_categoria=None, diag_subcategoria=None):
+    filtros = {}
+    if year_range is not None:
+        filtros['ano'] = list(range(int(year_range[0]), int(year_range[1]) + 1))
+    if estado not in SEM_FILTRO:
+        filtros['uf'] = [int(estado)]
+    if codigo_municipio not in SEM_FILTRO:
+        filtros['municipio'] = [int(codigo_municipio)]
+    if sexo not in SEM_FILTRO:
+        filtros['sexo'] = [CODIGOS_SEXO[sexo]]
+    if faixa_etaria not in SEM_FILTRO:
+        idade_min, idade_max = FAIXAS_ETARIAS[faixa_etaria]
+        filtros['faixa_etaria'] = [faixa for faixa, (minimo, maximo) in FAIXAS_ETARIAS_BASE.items()
+                                   if minimo >= idade_min and maximo <= idade_max]
+    if raca not in SEM_FILTRO:
+        filtros['raca'] = ["Preta", "Parda"] if usar_raca_cor2 and raca == "Negra" else [raca]
+    if grupo_cir not in SEM_FILTRO:
+        filtros['cir'] = [grupo_cir]
+    if diag_grupo not in SEM_FILTRO:
+        filtros['diag_grupo'] = [diag_grupo]
+    if diag_categoria not in SEM_FILTRO:
+        filtros['diag_categoria'] = [diag_categoria]
+    if diag_subcategoria not in SEM_FILTRO:
+        filtros['diag_subcategoria'] = [diag_subcategoria]
+    return filtros
+
+
+# Função para converter uma lista de posições em bitset empacotado
+def _como_bitset(conjunto, n_linhas):
+    if conjunto.dtype == np.uint8:
+        return conjunto
+    bits = np.zeros(n_linhas, dtype=bool)
+    bits[conjunto] = True
+    return np.packbits(bits)
+
+
+# Função para unir os conjuntos dos valores escolhidos em uma dimensão
+def _unir(conjuntos, n_linhas):
+    if not conjuntos:
+        return np.array([], dtype=np.int32)
+    if len(conjuntos) == 1:
+        return conjuntos[0]
+    # Valores distintos de uma dimensão nunca compartilham linhas
+    if all(conjunto.dtype == np.int32 for conjunto in conjuntos):
+        return np.sort(np.concatenate(conjuntos))
+    return np.bitwise_or.reduce([_como_bitset(conjunto, n_linhas) for conjunto in conjuntos])
+
+
+# Função para testar, para cada posição, se o bit correspondente está ligado no bitset
+def _bits_ligados(bitset, posicoes):
+    return ((bitset[posicoes >> 3] >> (7 - (posicoes & 7)).astype(np.uint8)) & 1) == 1
+
+
+# Função para cruzar os filtros. Retorna uma lista ordenada de posições (int32)
+# ou um bitset empacotado (uint8); None quando nenhum filtro está ativo.
+def _intersectar(indice, filtros):
+    dimensoes = indice['dimensoes']
+    selecoes = []
+    for dimensao, valores in filtros.items():
+        if dimensao not in dimensoes:
+            continue
+        conjuntos = [dimensoes[dimensao][valor] for valor in valores if valor in dimensoes[dimensao]]
+        selecoes.append(_unir(conjuntos, indice['n_linhas']))
+
+    if not selecoes:
+        return None
+
+    listas = sorted((s for s in selecoes if s.dtype == np.int32), key=len)
+    bitsets = [s for s in selecoes if s.dtype == np.uint8]
+
+    # Com alguma lista esparsa, parte-se da menor e testa-se só as suas posições nos demais conjuntos
+    if listas:
+        posicoes = listas[0]
+        for lista in listas[1:]:
+            posicoes = np.intersect1d(posicoes, lista, assume_unique=True)
+        for bitset in bitsets:
+            posicoes = posicoes[_bits_ligados(bitset, posicoes)]
+        return posicoes
+
+    return np.bitwise_and.reduce(bitsets)
+
+
+# Função para converter o resultado do cruzamento em posições (iloc); None quando todas as linhas passam
+def _posicoes(indice, resultado):
+    n_linhas = indice['n_linhas']
+    if resultado is None:
+        return None
+    if resultado.dtype == np.uint8:
+        if int(_BITS_POR_BYTE[resultado].sum()) == n_linhas:
+            return None
+        return np.flatnonzero(np.unpackbits(resultado, count=n_linhas))
+    return None if len(resultado) == n_linhas else resultado
+
+
+# Função para obter as posições (iloc) das linhas que atendem a todos os filtros
+def selecionar_linhas(indice, filtros):
+    posicoes = _posicoes(indice, _intersectar(indice, filtros))
+    return np.arange(indice['n_linhas']) if posicoes is None else posicoes
+
+
+# Função para contar as linhas que atendem aos filtros sem materializar o DataFrame filtrado
+def contar_linhas(indice, filtros):
+    resultado = _intersectar(indice, filtros)
+    if resultado is None:
+        return indice['n_linhas']
+    if resultado.dtype == np.uint8:
+        return int(_BITS_POR_BYTE[resultado].sum())
+    return len(resultado)
+
+
+# Função para aplicar os filtros ao DataFrame indexado sem copiar o DataFrame inteiro.
+# Quando todas as linhas passam (ex.: "Todos" no recorte já carregado), devolve o próprio
+# DataFrame compartilhado, que os painéis só leem; senão materializa apenas as linhas
+# selecionadas e, se informadas, apenas as colunas que o gráfico usa.
+def filtrar_dataframe(df, indice, filtros, colunas=None):
+    posicoes = _posicoes(indice, _intersectar(indice, filtros))
+    if colunas is None:
+        return df if posicoes is None else df.iloc[posicoes]
+    posicoes_colunas = df.columns.get_indexer(colunas)
+    if posicoes is None:
+        return df.iloc[:, posicoes_colunas]
+    return df.iloc[posicoes, posicoes_colunas]
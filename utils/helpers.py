@@ -2,6 +2,9 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
+from utils.data_cache import cache_versionado, versao_arquivos
+from utils.excel_store import ler_planilha
+
 # Função para exibir resumo dos filtros aplicados
 def mostrar_filtros_aplicados(year_range, estado_nome, codigo_municipio, sexo, faixa_etaria, raca, municipios_dict, 
                               ano_idsc=None, usar_raca_cor2=False, diag_grupo=None, diag_categoria=None, diag_subcategoria=None, 
@@ -67,6 +70,24 @@ def mostrar_filtros_aplicados(year_range, estado_nome, codigo_municipio, sexo, f
     # Adicionar linha divisória para melhor visualização
     st.markdown("---")
 
+# Função para juntar Preta e Parda em Negra (aceita colunas categóricas)
+def agrupar_raca_negra(serie):
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype(serie.cat.categories.dtype)
+    return serie.where(~serie.isin(['Preta', 'Parda']), 'Negra')
+
+# Função para converter códigos de município do IBGE no código canônico de 6 dígitos
+# (sem o dígito verificador), como inteiros int32 (Int32 quando houver nulos)
+def canonizar_codigo_municipio(serie):
+    # Códigos já canônicos (como os do recorte IPC do SIH) são devolvidos sem cópia
+    if serie.dtype == 'int32' and (serie < 1_000_000).all():
+        return serie
+    codigos = pd.to_numeric(serie, errors='coerce')
+    codigos = codigos.where(codigos < 1_000_000, codigos // 10)
+    if codigos.isna().any():
+        return codigos.astype('Int32')
+    return codigos.astype('int32')
+
 # Função para ajustar dados de raça/cor para visualizações
 def ajustar_dados_raca(df, coluna_raca, usar_raca_cor2=False):
     if not usar_raca_cor2:
@@ -111,11 +132,11 @@ def ajustar_dados_raca(df, coluna_raca, usar_raca_cor2=False):
     return df_ajustado
 
 # Carregar dados dos municípios
-@st.cache_data
+@cache_versionado(versao_arquivos('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls'))
 def load_municipalities():
     try:
         # Lê o arquivo Excel pulando as 6 primeiras linhas
-        municipios_df = pd.read_excel('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls', skiprows=6)
+        municipios_df = ler_planilha('data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls', skiprows=6)
         
         # Extrair os 6 primeiros caracteres do código do município
         municipios_df['cod_6digitos'] = municipios_df['Código Município Completo'].astype(str).str[:6]
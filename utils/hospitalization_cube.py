@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from utils.filter_index import montar_indice_filtros, filtrar_dataframe
+
+# Grão do cubo: ano × município × sexo × faixa etária × raça × regime × subcategoria diagnóstica
+DIMENSOES_CUBO = ['ANO_CMPT', 'MUNIC_RES', 'SEXO', 'FAIXA_ETARIA', 'RACA_COR_DESC', 'def_regime',
+                  'def_diag_princ_subcat']
+
+# Colunas que dependem só das dimensões do grão (UF, região e coordenadas vêm do município;
+# grupo e categoria vêm da subcategoria). Entram como chaves sem aumentar o número de células.
+COLUNAS_DEPENDENTES = ['res_CODIGO_UF', 'REGIAO', 'res_LATITUDE', 'res_LONGITUDE',
+                       'def_diag_princ_grupo', 'def_diag_princ_cat']
+
+# Medidas somáveis de cada célula. Os registros de MORTE e DIAS_PERM contam só valores
+# não nulos, para que as médias do cubo sejam iguais às médias das linhas (que ignoram nulos).
+MEDIDAS_CUBO = ['internacoes', 'obitos', 'registros_morte', 'dias_perm', 'registros_dias',
+                'dias_perm_quadrado']
+
+
+# Função para montar o cubo de internações a partir do DataFrame do SIH já carregado.
+# Retorna as células (fatos) e o índice de bitmaps dos filtros sobre as células.
+def montar_cubo_internacoes(df):
+    dimensoes = list(DIMENSOES_CUBO)
+    if 'RACA_COR_DESC' not in df.columns:
+        dimensoes[dimensoes.index('RACA_COR_DESC')] = 'def_raca_cor'
+    chaves = [coluna for coluna in dimensoes + COLUNAS_DEPENDENTES if coluna in df.columns]
+
+    morte = df['MORTE']
+    dias = df['DIAS_PERM'].astype('float64')
+    medidas = pd.DataFrame({
+        'internacoes': np.ones(len(df), dtype=np.int64),
+        'obitos': (morte == 1).astype(np.int64),
+        'registros_morte': morte.notna().astype(np.int64),
+        'dias_perm': dias,
+        'registros_dias': dias.notna().astype(np.int64),
+        'dias_perm_quadrado': dias ** 2,
+    }, index=df.index)
+
+    # dropna=False mantém as linhas com dimensões nulas, para os totais baterem com as linhas
+    fatos = (medidas.groupby([df[coluna] for coluna in chaves], observed=True, dropna=False, sort=False)
+             .sum()
+             .reset_index())
+    return {'fatos': fatos, 'indice': montar_indice_filtros(fatos)}
+
+
+# Função para obter as células do cubo que atendem aos filtros (mesmo dicionário de filtros_painel)
+def filtrar_cubo(cubo, filtros):
+    return filtrar_dataframe(cubo['fatos'], cubo['indice'], filtros)
+
+
+# Função para acrescentar as medidas derivadas (taxa de mortalidade, média e desvio-padrão da
+# permanência) às medidas somadas
+def _medidas_derivadas(somas):
+    registros_dias = somas['registros_dias']
+    media = somas['dias_perm'] / registros_dias
+    variancia = (somas['dias_perm_quadrado'] - registros_dias * media ** 2) / (registros_dias - 1)
+    return somas.assign(
+        taxa_mortalidade=somas['obitos'] / somas['registros_morte'],
+        media_permanencia=media,
+        desvio_permanencia=np.sqrt(variancia.clip(lower=0)),
+    )
+
+
+# Função para agregar as células filtradas do cubo pelas chaves pedidas (nomes de colunas ou
+# séries alinhadas às células, como a raça regrupada). Sem chaves, devolve os totais (Series).
+def agregar_cubo(fatos, por=None):
+    if not por:
+        return _medidas_derivadas(fatos[MEDIDAS_CUBO].sum().to_frame().T).iloc[0]
+    return _medidas_derivadas(fatos.groupby(por, observed=True)[MEDIDAS_CUBO].sum()).reset_index()
+
+
+# Função para contar as internações por uma chave, em ordem decrescente (como value_counts)
+def contar_por(fatos, por):
+    return (fatos.groupby(por, observed=True)['internacoes'].sum()
+            .sort_values(ascending=False)
+            .reset_index())
+
+
+# Função para montar a tabela cruzada de internações (como pd.crosstab) a partir das células do
+# cubo; com normalizar_colunas, cada coluna vira proporções que somam 1
+def tabular_cubo(fatos, linhas, colunas, normalizar_colunas=False):
+    tabela = fatos.groupby([linhas, colunas], observed=True)['internacoes'].sum().unstack(fill_value=0)
+    if normalizar_colunas:
+        return tabela / tabela.sum()
+    return tabela
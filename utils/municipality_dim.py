@@ -0,0 +1,240 @@
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.data_cache import cache_versionado, impressao_digital
+from utils.data_loaders import CIR_MUNICIPIOS_PATH, BASE_MAGDA_PATH, caminho_idsc
+from utils.excel_store import ler_planilha
+from utils.helpers import canonizar_codigo_municipio
+from utils.sih_store import SIH_PARQUET_PATH, read_sih, sih_ipc_disponivel, versao_recorte_sih
+
+# Fontes da dimensão de municípios: nomes (DTB do IBGE, com municipios.xlsx como reserva),
+# grupos CIR, índices iCAPS/iRAPS, IDSC por ano e coordenadas de residência do SIH
+DTB_MUNICIPIOS_PATH = 'data/RELATORIO_DTB_BRASIL_MUNICIPIO.xls'
+MUNICIPIOS_PATH = 'data/municipios.xlsx'
+ANOS_IDSC = (2022, 2023, 2024)
+
+# Scores do IDSC guardados na matriz município × ano × score, com a coluna de cada um na planilha
+COLUNAS_IDSC = {
+    'IDSC': 'IDSC-BR {ano}',
+    'Goal_1': 'Goal 1 Score',
+    'Goal_3': 'Goal 3 Score',
+    'Goal_5': 'Goal 5 Score',
+    'Goal_10': 'Goal 10 Score',
+}
+
+# Códigos de município têm 6 dígitos: a posição de cada código na tabela fica num vetor denso
+LIMITE_CODIGO = 1_000_000
+
+
+# Função para obter a versão dos arquivos lidos pela dimensão e do SIH (coordenadas)
+def versao_dimensao_municipios():
+    caminhos = [DTB_MUNICIPIOS_PATH, MUNICIPIOS_PATH, CIR_MUNICIPIOS_PATH, BASE_MAGDA_PATH]
+    caminhos += [caminho_idsc(ano) for ano in ANOS_IDSC]
+    return impressao_digital(*caminhos), versao_recorte_sih()
+
+
+# Função para indexar uma fonte pelo código canônico (int de 6 dígitos), descartando linhas
+# sem código e mantendo a primeira ocorrência de cada município
+def _por_codigo(codigos, colunas):
+    fonte = pd.DataFrame(colunas)
+    fonte['codigo'] = canonizar_codigo_municipio(codigos).to_numpy()
+    fonte = fonte.dropna(subset=['codigo'])
+    fonte['codigo'] = fonte['codigo'].astype('int32')
+    return fonte.drop_duplicates('codigo').set_index('codigo')
+
+
+# Função para ler os nomes dos municípios da DTB do IBGE
+def _ler_dtb():
+    dtb = ler_planilha(DTB_MUNICIPIOS_PATH, skiprows=6)
+    return _por_codigo(dtb['Código Município Completo'], {'nome': dtb['Nome_Município'].to_numpy()})
+
+
+# Função para ler os nomes de municipios.xlsx (colunas Código e Nome)
+def _ler_municipios():
+    municipios = ler_planilha(MUNICIPIOS_PATH)
+    return _por_codigo(municipios['Código'], {'nome_reserva': municipios['Nome'].to_numpy()})
+
+
+# Função para ler os grupos CIR (rótulos) de cir_municipios.csv
+def _ler_cir():
+    cir = pd.read_csv(CIR_MUNICIPIOS_PATH)
+    return _por_codigo(cir['cod_municipio'], {'grupo_cir': cir['grupo_cir'].to_numpy()})
+
+
+# Função para ler o grupo CIR numérico, os índices iCAPS/iRAPS e o nome da base magda
+def _ler_base_magda():
+    magda = ler_planilha(BASE_MAGDA_PATH)
+    colunas = {coluna: magda[coluna].to_numpy() for coluna in ['Grupo_CIR', 'iCAPS', 'iRAPS'] if coluna in magda.columns}
+    if 'MUNICIPIO.x' in magda.columns:
+        colunas['nome_magda'] = magda['MUNICIPIO.x'].to_numpy()
+    return _por_codigo(magda['IBGE'], colunas)
+
+
+# Função para ler os scores do IDSC de um ano, de uma vez, como colunas "<score>_<ano>" (o código
+# do arquivo tem o dígito verificador, removido por canonizar_codigo_municipio)
+def _ler_idsc(ano):
+    idsc = ler_planilha(caminho_idsc(ano), sheet_name=f"IDSC-BR {ano}")
+    if 'COD_MUN' not in idsc.columns:
+        raise ValueError(f"Coluna 'COD_MUN' não encontrada no arquivo IDSC {ano}")
+    colunas = {}
+    for score, coluna_planilha in COLUNAS_IDSC.items():
+        coluna_planilha = coluna_planilha.format(ano=ano)
+        valores = idsc[coluna_planilha] if coluna_planilha in idsc.columns else pd.Series(np.nan, index=idsc.index)
+        colunas[f'{score}_{ano}'] = pd.to_numeric(valores, errors='coerce').to_numpy(dtype='float64')
+    return _por_codigo(idsc['COD_MUN'], colunas)
+
+
+# Função para ler as coordenadas de residência de cada município no recorte de saúde mental do SIH
+# (só a partir do IPC ou do Parquet; ler o CSV completo apenas para isso não compensa)
+def _ler_coordenadas():
+    if not (sih_ipc_disponivel() or os.path.isdir(SIH_PARQUET_PATH)):
+        return None
+    coordenadas = read_sih(columns=['MUNIC_RES', 'res_LATITUDE', 'res_LONGITUDE'], somente_saude_mental=True)
+    if not {'res_LATITUDE', 'res_LONGITUDE'} <= set(coordenadas.columns):
+        return None
+    coordenadas = coordenadas.dropna().groupby('MUNIC_RES', sort=False).first()
+    return _por_codigo(pd.Series(coordenadas.index), {
+        'latitude': coordenadas['res_LATITUDE'].to_numpy(dtype='float32'),
+        'longitude': coordenadas['res_LONGITUDE'].to_numpy(dtype='float32'),
+    })
+
+
+# Função para montar a dimensão de municípios: uma linha por código (int de 6 dígitos, em ordem
+# crescente) com UF, nome, rótulo de exibição, grupo CIR, iCAPS/iRAPS e coordenadas. Junto vão a
+# matriz do IDSC (município × ano de ANOS_IDSC × score de COLUNAS_IDSC, alinhada às linhas da
+# tabela), o vetor denso código -> posição na tabela e as posições de cada UF em ordem
+# alfabética, para que os painéis façam junções e listas de opções por indexação de arrays.
+def montar_dimensao_municipios():
+    leitores = [('DTB', DTB_MUNICIPIOS_PATH, _ler_dtb), ('municípios', MUNICIPIOS_PATH, _ler_municipios),
+                ('CIR', CIR_MUNICIPIOS_PATH, _ler_cir), ('base magda', BASE_MAGDA_PATH, _ler_base_magda)]
+    leitores += [(f'IDSC {ano}', caminho_idsc(ano), lambda ano=ano: _ler_idsc(ano)) for ano in ANOS_IDSC]
+    leitores.append(('coordenadas', None, _ler_coordenadas))
+
+    fontes = []
+    for nome_fonte, caminho, ler in leitores:
+        if caminho is not None and not os.path.exists(caminho):
+            continue
+        try:
+            fonte = ler()
+        except Exception as e:
+            st.warning(f"Erro ao carregar a fonte {nome_fonte} da dimensão de municípios: {e}")
+            continue
+        if fonte is not None and not fonte.empty:
+            fontes.append(fonte)
+
+    codigos = pd.Index(np.unique(np.concatenate([fonte.index.to_numpy() for fonte in fontes]))
+                       if fontes else np.array([], dtype='int32'), name='codigo').astype('int32')
+    tabela = pd.DataFrame(index=codigos)
+    for fonte in fontes:
+        tabela = tabela.join(fonte[[coluna for coluna in fonte.columns if coluna not in tabela.columns]])
+
+    # Nome pela DTB; na falta dela, municipios.xlsx e depois a base magda
+    nome = pd.Series("", index=codigos, dtype=object)
+    for coluna in ['nome_magda', 'nome_reserva', 'nome']:
+        if coluna in tabela.columns:
+            nome = tabela[coluna].where(tabela[coluna].notna(), nome)
+    tabela = tabela.drop(columns=[coluna for coluna in ['nome_magda', 'nome_reserva'] if coluna in tabela.columns])
+    tabela['nome'] = nome.astype(str)
+    tabela['uf'] = (codigos.to_numpy() // 10000).astype('int8')
+    tabela['rotulo'] = np.where(tabela['nome'] != "", tabela['nome'] + " (" + codigos.astype(str) + ")",
+                                codigos.astype(str))
+
+    # Scores do IDSC de todos os anos numa única matriz; anos sem planilha ficam com NaN
+    idsc = np.full((len(codigos), len(ANOS_IDSC), len(COLUNAS_IDSC)), np.nan)
+    for i, ano in enumerate(ANOS_IDSC):
+        for j, score in enumerate(COLUNAS_IDSC):
+            if f'{score}_{ano}' in tabela.columns:
+                idsc[:, i, j] = tabela.pop(f'{score}_{ano}').to_numpy(dtype='float64')
+
+    posicao_por_codigo = np.full(LIMITE_CODIGO, -1, dtype=np.int32)
+    posicao_por_codigo[codigos.to_numpy()] = np.arange(len(codigos), dtype=np.int32)
+
+    ordem_alfabetica = np.lexsort((codigos.to_numpy(), tabela['nome'].str.lower().to_numpy()))
+    por_uf = {int(uf): ordem_alfabetica[tabela['uf'].to_numpy()[ordem_alfabetica] == uf]
+              for uf in np.unique(tabela['uf'].to_numpy())}
+    return {'tabela': tabela, 'idsc': idsc, 'posicao_por_codigo': posicao_por_codigo, 'por_uf': por_uf}
+
+
+# Função para carregar a dimensão de municípios, montada uma vez e compartilhada entre as
+# sessões (não alterá-la in-place)
+@cache_versionado(versao_dimensao_municipios, recurso=True)
+def load_municipality_dim():
+    return montar_dimensao_municipios()
+
+
+# Função para obter a posição na dimensão de cada código (-1 para códigos ausentes). Aceita
+# códigos inteiros ou texto, com 6 ou 7 dígitos.
+def posicoes_municipios(dimensao, codigos):
+    codigos = canonizar_codigo_municipio(pd.Series(np.asarray(codigos, dtype=object)))
+    codigos = codigos.fillna(-1).to_numpy(dtype=np.int64)
+    validos = (codigos >= 0) & (codigos < LIMITE_CODIGO)
+    return np.where(validos, dimensao['posicao_por_codigo'][np.where(validos, codigos, 0)], -1)
+
+
+# Função para juntar uma coluna da dimensão a uma sequência de códigos; códigos ausentes da
+# dimensão ou sem valor na coluna (nulo ou nome vazio) recebem padrao
+def atributo_municipios(dimensao, codigos, coluna, padrao=None):
+    posicoes = posicoes_municipios(dimensao, codigos)
+    valores = dimensao['tabela'][coluna].to_numpy(dtype=object)[np.maximum(posicoes, 0)] \
+        if len(dimensao['tabela']) else np.full(len(posicoes), None, dtype=object)
+    ausentes = (posicoes < 0) | pd.isna(valores) | (valores == "")
+    valores[ausentes] = np.nan if padrao is None else padrao
+    return valores
+
+
+# Função para juntar os scores do IDSC de um ano a uma sequência de códigos, numa única indexação
+# da matriz. Retorna um array (códigos × colunas); códigos ausentes ou anos sem dados ficam com NaN.
+def scores_idsc(dimensao, codigos, ano, colunas=None):
+    colunas = list(COLUNAS_IDSC) if colunas is None else list(colunas)
+    posicoes = posicoes_municipios(dimensao, codigos)
+    if int(ano) not in ANOS_IDSC or not len(dimensao['idsc']):
+        return np.full((len(posicoes), len(colunas)), np.nan)
+    indices = [list(COLUNAS_IDSC).index(coluna) for coluna in colunas]
+    valores = dimensao['idsc'][np.maximum(posicoes, 0), ANOS_IDSC.index(int(ano))][:, indices]
+    valores[posicoes < 0] = np.nan
+    return valores
+
+
+# Função para listar os scores do IDSC com algum valor no ano
+def colunas_idsc_disponiveis(dimensao, ano):
+    if int(ano) not in ANOS_IDSC:
+        return []
+    preenchidas = ~np.isnan(dimensao['idsc'][:, ANOS_IDSC.index(int(ano))]).all(axis=0)
+    return [coluna for coluna, preenchida in zip(COLUNAS_IDSC, preenchidas) if preenchida]
+
+
+# Função para listar os códigos dos municípios de uma UF para um selectbox. Sem presentes,
+# são todos os municípios da dimensão, em ordem alfabética; com presentes (por exemplo, os
+# municípios de um recorte, com 6 ou 7 dígitos), só esses, na ordem dada. Sem UF, nenhum filtro
+# é aplicado.
+def municipios_da_uf(dimensao, estado=None, presentes=None):
+    if presentes is not None:
+        presentes = np.asarray(list(presentes), dtype=np.int64)
+        if estado:
+            ufs = np.where(presentes >= LIMITE_CODIGO, presentes // 100000, presentes // 10000)
+            presentes = presentes[ufs == int(estado)]
+        return presentes.tolist()
+    if estado:
+        posicoes = dimensao['por_uf'].get(int(estado), np.array([], dtype=np.int64))
+    else:
+        posicoes = np.arange(len(dimensao['tabela']))
+    return dimensao['tabela'].index.to_numpy()[posicoes].tolist()
+
+
+# Função para criar o format_func de um selectbox de municípios. formato recebe codigo e nome;
+# códigos sem nome na dimensão aparecem só com o código, e "Todos" aparece como está.
+def formatar_municipio(dimensao, formato="{nome} ({codigo})"):
+    tabela = dimensao['tabela']
+    posicao_por_codigo = dimensao['posicao_por_codigo']
+
+    def formatar(opcao):
+        if not str(opcao).isdigit():
+            return str(opcao)
+        codigo = int(opcao) if int(opcao) < LIMITE_CODIGO else int(opcao) // 10
+        posicao = posicao_por_codigo[codigo] if codigo < LIMITE_CODIGO else -1
+        nome = tabela['nome'].iat[posicao] if posicao >= 0 else ""
+        return formato.format(codigo=opcao, nome=nome) if nome else str(opcao)
+    return formatar
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.population_db import consultar, fonte_populacao_paineis
+
+# As consultas de população sempre consideram apenas anos anteriores a este
+ANO_LIMITE_POPULACAO = 2024
+
+# Regiões do Brasil pelos códigos de UF (dois primeiros dígitos do código do município)
+REGIOES_UFS = {
+    'Norte': ['11', '12', '13', '14', '15', '16', '17'],
+    'Nordeste': ['21', '22', '23', '24', '25', '26', '27', '28', '29'],
+    'Sudeste': ['31', '32', '33', '35'],
+    'Sul': ['41', '42', '43'],
+    'Centro-Oeste': ['50', '51', '52', '53']
+}
+
+# Eixos do cubo, na ordem das dimensões do array
+EIXO_ANO, EIXO_LOCAL, EIXO_SEXO, EIXO_RACA, EIXO_FAIXA = range(5)
+
+
+# Função para remover acentos do nome da raça, como gravado no banco
+def normalizar_raca(raca):
+    return raca.replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
+
+
+# Função para somar o cubo de municípios em grupos (UF ou região) ao longo do eixo de local
+def _agregar_locais(valores, grupos):
+    rotulos, posicoes = np.unique(grupos, return_inverse=True)
+    agregado = np.zeros((valores.shape[0], len(rotulos)) + valores.shape[2:], dtype=np.int64)
+    np.add.at(agregado, (slice(None), posicoes), valores)
+    return rotulos, agregado
+
+
+# Função para montar o cubo denso de população (ano × município × sexo × raça × faixa etária),
+# com os totais por UF e por região já calculados
+def montar_cubo_populacao(db_path, tabela='populacao'):
+    df_pop = consultar(
+        db_path,
+        "SELECT ano, codigo_municipio, sexo, raca, faixa_etaria, SUM(populacao) as populacao "
+        f"FROM {tabela} WHERE ano < ? "
+        "GROUP BY ano, codigo_municipio, sexo, raca, faixa_etaria",
+        [ANO_LIMITE_POPULACAO]
+    )
+
+    # Linhas sem estratos (layout por município) entram no cubo como "não informado"
+    for coluna in ['sexo', 'raca', 'faixa_etaria']:
+        df_pop[coluna] = df_pop[coluna].fillna('')
+
+    df_pop['codigo_municipio'] = df_pop['codigo_municipio'].astype(str)
+
+    # Cada dimensão vira um índice inteiro (posição no eixo do cubo)
+    dimensoes = ['ano', 'codigo_municipio', 'sexo', 'raca', 'faixa_etaria']
+    posicoes = []
+    rotulos = []
+    for dimensao in dimensoes:
+        codigos, valores = pd.factorize(df_pop[dimensao], sort=True)
+        posicoes.append(codigos)
+        rotulos.append(np.asarray(valores))
+
+    # int32 basta para a população de uma célula e reduz o cubo municipal à metade
+    valores = np.zeros([len(r) for r in rotulos], dtype=np.int32)
+    np.add.at(valores, tuple(posicoes), df_pop['populacao'].fillna(0).to_numpy(dtype=np.int32))
+
+    municipios = rotulos[EIXO_LOCAL].astype(str)
+    ufs_municipios = np.array([codigo[:2] for codigo in municipios])
+    ufs, valores_uf = _agregar_locais(valores, ufs_municipios)
+
+    uf_para_regiao = {uf: regiao for regiao, lista in REGIOES_UFS.items() for uf in lista}
+    regioes_ufs = np.array([uf_para_regiao.get(uf, '') for uf in ufs])
+    regioes, valores_regiao = _agregar_locais(valores_uf, regioes_ufs)
+
+    return {
+        'anos': rotulos[EIXO_ANO].astype(int),
+        'sexos': list(rotulos[EIXO_SEXO]),
+        'racas': list(rotulos[EIXO_RACA]),
+        'faixas': list(rotulos[EIXO_FAIXA]),
+        'municipios': pd.Index(municipios),
+        'ufs': pd.Index(ufs),
+        'regioes': pd.Index(regioes),
+        'valores': valores,
+        'valores_uf': valores_uf,
+        'valores_regiao': valores_regiao,
+    }
+
+
+# Cubos já montados neste processo, por (caminho, data de modificação do banco)
+_cubos = {}
+
+
+# Função para obter o cubo de população, remontando-o se o banco for alterado
+def obter_cubo_populacao():
+    db_path, tabela = fonte_populacao_paineis()
+    chave = (db_path, os.path.getmtime(db_path))
+    if chave not in _cubos:
+        _cubos.clear()
+        _cubos[chave] = montar_cubo_populacao(db_path, tabela)
+    return _cubos[chave]
+
+
+# Função para obter as posições de um filtro em um eixo (None = todas)
+def _posicoes_eixo(rotulos, valores):
+    if valores is None:
+        return None
+    return [i for i, rotulo in enumerate(rotulos) if rotulo in valores]
+
+
+# Função para somar as dimensões de sexo, raça e faixa etária de acordo com os filtros.
+# Retorna uma matriz ano × local.
+def _somar_estratos(valores, cubo, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False):
+    racas = None
+    if raca:
+        raca = normalizar_raca(raca)
+        racas = ['Preta', 'Parda'] if usar_raca_cor2 and raca == "Negra" else [raca]
+
+    filtros = [
+        (EIXO_SEXO, _posicoes_eixo(cubo['sexos'], [sexo] if sexo else None)),
+        (EIXO_RACA, _posicoes_eixo(cubo['racas'], racas)),
+        (EIXO_FAIXA, _posicoes_eixo(cubo['faixas'], [faixa_etaria] if faixa_etaria else None)),
+    ]
+    for eixo, posicoes in filtros:
+        if posicoes is not None:
+            valores = np.take(valores, posicoes, axis=eixo)
+    return valores.sum(axis=(EIXO_SEXO, EIXO_RACA, EIXO_FAIXA))
+
+
+# Função para montar a série anual de população (colunas ano, tam_pop), no mesmo formato
+# da antiga consulta "SELECT ano, SUM(populacao) ... GROUP BY ano"
+def _serie_anual(cubo, populacao_por_ano):
+    df_populacao = pd.DataFrame({'ano': cubo['anos'], 'tam_pop': populacao_por_ano})
+    return df_populacao[df_populacao['tam_pop'] > 0].reset_index(drop=True)
+
+
+# Função para obter a população por ano para um município, uma UF, uma região ou o Brasil
+def populacao_por_ano(cubo, codigo_municipio=None, estado=None, regiao=None, raca=None, sexo=None,
+                      faixa_etaria=None, usar_raca_cor2=False):
+    if codigo_municipio:
+        valores, locais, chave = cubo['valores'], cubo['municipios'], str(codigo_municipio)
+        # O filtro de estado só exclui municípios de outra UF
+        if estado and not chave.startswith(str(estado)):
+            return pd.DataFrame(columns=['ano', 'tam_pop'])
+    elif estado:
+        valores, locais, chave = cubo['valores_uf'], cubo['ufs'], str(estado)
+    elif regiao:
+        valores, locais, chave = cubo['valores_regiao'], cubo['regioes'], regiao
+    else:
+        valores, locais, chave = cubo['valores_regiao'], None, None
+
+    if locais is not None:
+        if chave not in locais:
+            return pd.DataFrame(columns=['ano', 'tam_pop'])
+        posicao = locais.get_loc(chave)
+        valores = valores[:, posicao:posicao + 1]
+
+    matriz = _somar_estratos(valores, cubo, raca, sexo, faixa_etaria, usar_raca_cor2)
+    return _serie_anual(cubo, matriz.sum(axis=1))
+
+
+# Função para obter a matriz de população ano × local (municípios, UFs ou regiões)
+# para uma lista de códigos, com zeros para locais ausentes do banco
+def populacao_locais(cubo, codigos, nivel='municipio', raca=None, sexo=None, faixa_etaria=None,
+                     usar_raca_cor2=False):
+    valores, locais = {
+        'municipio': (cubo['valores'], cubo['municipios']),
+        'uf': (cubo['valores_uf'], cubo['ufs']),
+        'regiao': (cubo['valores_regiao'], cubo['regioes']),
+    }[nivel]
+
+    codigos = pd.Index([str(codigo) for codigo in codigos])
+    posicoes = locais.get_indexer(codigos)
+    encontrados = posicoes >= 0
+
+    # Fatiar os locais antes de somar os estratos, para não percorrer o cubo inteiro
+    fatia = np.take(valores, posicoes[encontrados], axis=EIXO_LOCAL)
+    resultado = np.zeros((len(cubo['anos']), len(codigos)), dtype=np.int64)
+    resultado[:, encontrados] = _somar_estratos(fatia, cubo, raca, sexo, faixa_etaria, usar_raca_cor2)
+    return pd.DataFrame(resultado, index=pd.Index(cubo['anos'], name='ano'), columns=codigos)
+
+
+# Função para obter, para cada local, a população do ano mais recente com dados
+def populacao_mais_recente(cubo, codigos, nivel='municipio', raca=None, sexo=None, faixa_etaria=None,
+                           usar_raca_cor2=False):
+    matriz = populacao_locais(cubo, codigos, nivel, raca, sexo, faixa_etaria, usar_raca_cor2)
+    valores = matriz.to_numpy()
+    tem_dados = valores > 0
+
+    # Índice da última linha (ano) com população positiva em cada coluna
+    ultimo_ano = len(valores) - 1 - np.argmax(tem_dados[::-1], axis=0)
+    populacao = valores[ultimo_ano, np.arange(valores.shape[1])].astype('float64')
+    populacao[~tem_dados.any(axis=0)] = np.nan
+    return pd.Series(populacao, index=matriz.columns)
@@ -0,0 +1,147 @@
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+# Bancos de população: layout dos painéis, layout por município e o banco
+# normalizado gerado por scripts/migrate_population_db.py
+POPULACAO_PAINEIS_PATH = 'populacao.db'
+POPULACAO_MUNICIPIOS_PATH = 'data/populacao.db'
+POPULACAO_NORMALIZADA_PATH = 'data/populacao_normalizada.db'
+
+# Tamanho máximo do mapeamento em memória e do cache de páginas de cada conexão
+MMAP_SIZE_BYTES = 256 * 1024 ** 2
+CACHE_SIZE_KIB = 64 * 1024
+
+# Quantidade de comandos preparados mantidos por conexão pelo módulo sqlite3
+STATEMENTS_EM_CACHE = 256
+
+# Quantidade máxima de conexões ociosas mantidas por banco; as excedentes são fechadas ao serem devolvidas
+CONEXOES_OCIOSAS_POR_BANCO = 8
+
+# Conexões ociosas de cada banco, compartilhadas por todas as threads do processo, por caminho
+# absoluto: data de modificação do arquivo e fila de conexões. O Streamlit roda cada execução do
+# script (cada interação) em uma thread nova, por isso as conexões não podem ficar presas à thread.
+_trava_conexoes = threading.Lock()
+_conexoes = {}
+
+# Contadores de uso das conexões e das consultas
+_trava_estatisticas = threading.Lock()
+_estatisticas = {
+    'conexoes_abertas': 0,
+    'conexoes_reutilizadas': 0,
+    'consultas': 0,
+    'tempo_total_ms': 0.0,
+    'tempo_maximo_ms': 0.0,
+}
+
+
+# Função para somar valores aos contadores de forma segura entre threads
+def _registrar(**valores):
+    with _trava_estatisticas:
+        for chave, valor in valores.items():
+            _estatisticas[chave] += valor
+
+
+# Função para abrir uma conexão somente leitura com os pragmas de desempenho. A conexão pode
+# passar de uma thread a outra, mas é usada por uma thread de cada vez (ver obter_conexao).
+def _abrir_conexao(db_path):
+    uri = f"file:{os.path.abspath(db_path)}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, cached_statements=STATEMENTS_EM_CACHE, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+# Função para emprestar uma conexão somente leitura com o banco, retirada das conexões ociosas
+# do processo (ou aberta, se não houver) e devolvida a elas ao final do bloco with.
+# Quando o arquivo do banco é substituído, as conexões antigas são fechadas e a fila recomeça.
+@contextlib.contextmanager
+def obter_conexao(db_path):
+    caminho = os.path.abspath(db_path)
+    modificado_em = os.path.getmtime(db_path)
+    with _trava_conexoes:
+        atual = _conexoes.get(caminho)
+        if atual is None or atual[0] != modificado_em:
+            if atual is not None:
+                _fechar_ociosas(atual[1])
+            atual = _conexoes[caminho] = (modificado_em, queue.Queue(maxsize=CONEXOES_OCIOSAS_POR_BANCO))
+        ociosas = atual[1]
+
+    try:
+        conn = ociosas.get_nowait()
+        _registrar(conexoes_reutilizadas=1)
+    except queue.Empty:
+        conn = _abrir_conexao(caminho)
+        _registrar(conexoes_abertas=1)
+
+    try:
+        yield conn
+    finally:
+        # Devolver a conexão, a menos que o banco tenha sido substituído durante o uso
+        with _trava_conexoes:
+            vigente = _conexoes.get(caminho)
+            devolvida = vigente is not None and vigente[1] is ociosas
+            if devolvida:
+                try:
+                    ociosas.put_nowait(conn)
+                except queue.Full:
+                    devolvida = False
+        if not devolvida:
+            conn.close()
+
+
+# Função para fechar as conexões ociosas de uma fila
+def _fechar_ociosas(ociosas):
+    while True:
+        try:
+            ociosas.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+# Função para executar uma consulta parametrizada e retornar um DataFrame.
+# O texto da consulta deve ser fixo (valores sempre em params) para reaproveitar o comando preparado.
+def consultar(db_path, query, params=()):
+    with obter_conexao(db_path) as conn:
+        inicio = time.perf_counter()
+        df = pd.read_sql_query(query, conn, params=list(params))
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+
+    with _trava_estatisticas:
+        _estatisticas['consultas'] += 1
+        _estatisticas['tempo_total_ms'] += duracao_ms
+        _estatisticas['tempo_maximo_ms'] = max(_estatisticas['tempo_maximo_ms'], duracao_ms)
+    return df
+
+
+# Função para obter uma cópia dos contadores, com a taxa de reuso e a latência média
+def estatisticas_conexoes():
+    with _trava_estatisticas:
+        estatisticas = dict(_estatisticas)
+    pedidos = estatisticas['conexoes_abertas'] + estatisticas['conexoes_reutilizadas']
+    estatisticas['taxa_reuso'] = estatisticas['conexoes_reutilizadas'] / pedidos if pedidos else 0.0
+    estatisticas['tempo_medio_ms'] = (estatisticas['tempo_total_ms'] / estatisticas['consultas']
+                                      if estatisticas['consultas'] else 0.0)
+    return estatisticas
+
+
+# Função para obter o banco e a tabela (ou visão) com o layout dos painéis
+# (ano, codigo_municipio, sexo, raca, faixa_etaria, populacao), preferindo o banco normalizado
+def fonte_populacao_paineis():
+    if os.path.exists(POPULACAO_NORMALIZADA_PATH):
+        return POPULACAO_NORMALIZADA_PATH, 'populacao'
+    return POPULACAO_PAINEIS_PATH, 'populacao'
+
+
+# Função para obter o banco e a tabela (ou visão) com o layout por município
+# (ano, uf, cod_municipio, populacao), preferindo o banco normalizado
+def fonte_populacao_municipios():
+    if os.path.exists(POPULACAO_NORMALIZADA_PATH):
+        return POPULACAO_NORMALIZADA_PATH, 'populacao_municipio'
+    return POPULACAO_MUNICIPIOS_PATH, 'populacao'
@@ -0,0 +1,96 @@
+import pandas as pd
+
+from utils.population_cube import REGIOES_UFS, obter_cubo_populacao, populacao_locais
+
+# Região de cada UF (código numérico), para mapear res_CODIGO_UF sem converter para texto
+REGIAO_POR_UF = {int(uf): regiao for regiao, ufs in REGIOES_UFS.items() for uf in ufs}
+
+
+# Função para dividir contagens por local × ano (colunas local, ano, casos) pela população
+# do cubo no mesmo nível (municipio, uf ou regiao). Combinações sem população são descartadas.
+def _dividir_pela_populacao(casos, nivel, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False):
+    if casos.empty:
+        return casos.assign(populacao=pd.Series(dtype='float64'), taxa_por_100k=pd.Series(dtype='float64'))
+
+    casos['local'] = casos['local'].astype(str)
+    casos['ano'] = casos['ano'].astype(int)
+
+    # Denominadores: matriz ano × local tirada do cubo de uma só vez
+    populacao = populacao_locais(obter_cubo_populacao(), casos['local'].unique(), nivel,
+                                 raca=raca, sexo=sexo, faixa_etaria=faixa_etaria,
+                                 usar_raca_cor2=usar_raca_cor2)
+    populacao = populacao.stack()
+    chaves = pd.MultiIndex.from_arrays([casos['ano'], casos['local']])
+    casos['populacao'] = populacao.reindex(chaves).to_numpy()
+
+    casos = casos[casos['populacao'] > 0].reset_index(drop=True)
+    casos['taxa_por_100k'] = casos['casos'] / casos['populacao'] * 100000
+    return casos
+
+
+# Função para contar casos por local × ano em um único groupby e calcular a taxa por 100.000
+# habitantes. Sem pesos cada linha é um caso; com pesos (ex.: internações das células de um
+# cubo) somam-se os pesos. Retorna as colunas local, ano, casos, populacao e taxa_por_100k.
+def calcular_taxas_local_ano(locais, anos, nivel, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False,
+                             pesos=None):
+    casos = (pd.DataFrame({'local': locais, 'ano': anos, 'casos': 1 if pesos is None else pesos})
+             .dropna()
+             .groupby(['local', 'ano'], observed=True)['casos']
+             .sum()
+             .reset_index())
+    return _dividir_pela_populacao(casos, nivel, raca, sexo, faixa_etaria, usar_raca_cor2)
+
+
+# Função para converter códigos numéricos (UF, município) em inteiros anuláveis,
+# que viram texto sem o sufixo ".0" dos floats
+def _codigos_inteiros(serie):
+    return pd.to_numeric(serie, errors='coerce').astype('Int64')
+
+
+# Função para resumir as taxas anuais de cada local: total de casos e taxa média do período
+def _media_periodo(taxas):
+    return (taxas.groupby('local')
+            .agg(casos=('casos', 'sum'), taxa_por_100k=('taxa_por_100k', 'mean'))
+            .reset_index())
+
+
+# Função para calcular, em uma única passada pelo DataFrame, as taxas médias do período
+# por 100.000 habitantes de cada UF e de cada município. coluna_casos, quando informada,
+# é somada em vez de contar linhas (células do cubo de internações).
+# Retorna (taxas_uf, taxas_municipio), ambos com as colunas local, casos e taxa_por_100k.
+def calcular_taxas_uf_municipio(df, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False,
+                                coluna_casos=None):
+    contagens = (pd.DataFrame({
+                    'municipio': _codigos_inteiros(df['MUNIC_RES']),
+                    'uf': _codigos_inteiros(df['res_CODIGO_UF']),
+                    'ano': df['ANO_CMPT'],
+                    'casos': 1 if coluna_casos is None else df[coluna_casos],
+                 })
+                 .dropna()
+                 .groupby(['municipio', 'uf', 'ano'], observed=True)['casos']
+                 .sum()
+                 .reset_index())
+
+    # As contagens por UF saem das contagens por município, sem reler o DataFrame
+    taxas = {}
+    for nivel in ['uf', 'municipio']:
+        casos = (contagens.groupby([nivel, 'ano'])['casos'].sum()
+                 .reset_index()
+                 .rename(columns={nivel: 'local'}))
+        taxas[nivel] = _media_periodo(
+            _dividir_pela_populacao(casos, nivel, raca, sexo, faixa_etaria, usar_raca_cor2)
+        )
+    return taxas['uf'], taxas['municipio']
+
+
+# Função para calcular a taxa de internações por 100.000 habitantes por região e ano
+def calcular_taxas_regiao_ano(df, raca=None, sexo=None, faixa_etaria=None, usar_raca_cor2=False,
+                              coluna_casos=None):
+    if 'REGIAO' in df.columns:
+        regioes = df['REGIAO']
+    else:
+        regioes = pd.to_numeric(df['res_CODIGO_UF'], errors='coerce').map(REGIAO_POR_UF)
+    pesos = None if coluna_casos is None else df[coluna_casos]
+    taxas = calcular_taxas_local_ano(regioes, df['ANO_CMPT'], 'regiao', raca, sexo, faixa_etaria, usar_raca_cor2,
+                                     pesos=pesos)
+    return taxas.rename(columns={'local': 'Região'})
@@ -0,0 +1,119 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Colunas de cada par (indicador, score) no resultado de regressoes_em_lote; as cinco primeiras
+# seguem a ordem do retorno de stats.linregress
+COLUNAS_REGRESSAO = ['inclinacao', 'intercepto', 'r', 'p', 'erro_padrao', 'n']
+
+# Métodos de correlação: "pearson" usa os valores e "spearman", os postos dentro de cada par
+METODOS_CORRELACAO = ('pearson', 'spearman')
+
+# Evita a divisão por zero no teste t quando |r| = 1 (mesma constante do stats.linregress)
+TINY = 1.0e-20
+
+
+# Função para extrair colunas de um DataFrame como matriz float (valores não numéricos viram NaN)
+def _matriz(df, colunas):
+    return np.column_stack([
+        pd.to_numeric(df[coluna], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        for coluna in colunas
+    ]).reshape(len(df), len(colunas))
+
+
+# Função para marcar, por indicador, as linhas entre os quantis de aparar (calculados sobre a coluna
+# inteira, como nos painéis que removem os outliers extremos antes da regressão)
+def _dentro_dos_quantis(y, aparar):
+    if aparar is None:
+        return np.ones(y.shape, dtype=bool)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        limite_inferior, limite_superior = np.nanquantile(y, aparar, axis=0)
+    return (y >= limite_inferior) & (y <= limite_superior)
+
+
+# Função para calcular, numa única passada vetorizada, a regressão linear de cada indicador (y) sobre
+# cada score (x): inclinação, intercepto, r, p-valor (teste t bicaudal com n - 2 graus de liberdade),
+# erro padrão da inclinação e número de municípios usados. Cada par usa só as linhas com x e y
+# válidos (e, com aparar=(0.01, 0.99), com y entre esses quantis; linhas restringe ainda mais os
+# municípios, depois do cálculo dos quantis). peso (nome de coluna, por exemplo 'populacao') dá a
+# versão ponderada; metodo='spearman' usa os postos de x e y no par.
+# Pares sem variação em x ficam com NaN, onde o stats.linregress levantaria ValueError.
+def regressoes_em_lote(df, indicadores, scores, peso=None, metodo='pearson', aparar=None, linhas=None):
+    if metodo not in METODOS_CORRELACAO:
+        raise ValueError(f"Método de correlação desconhecido: {metodo}")
+
+    indicadores = list(indicadores)
+    scores = list(scores)
+    y = _matriz(df, indicadores)
+    x = _matriz(df, scores)
+    pesos = _matriz(df, [peso])[:, 0] if peso is not None else np.ones(len(df))
+
+    # Máscara (município, indicador, score) das linhas válidas em cada par
+    validos = (np.isfinite(y) & _dentro_dos_quantis(y, aparar))[:, :, None] & np.isfinite(x)[:, None, :]
+    validos &= (np.isfinite(pesos) & (pesos > 0))[:, None, None]
+    if linhas is not None:
+        validos &= np.asarray(linhas, dtype=bool)[:, None, None]
+    x_pares = np.where(validos, x[:, None, :], np.nan)
+    y_pares = np.where(validos, y[:, :, None], np.nan)
+    if metodo == 'spearman':
+        x_pares = stats.rankdata(x_pares, axis=0, nan_policy='omit')
+        y_pares = stats.rankdata(y_pares, axis=0, nan_policy='omit')
+
+    n = validos.sum(axis=0)
+    w = np.where(validos, pesos[:, None, None], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        soma_pesos = w.sum(axis=0)
+        media_x = np.where(validos, w * x_pares, 0.0).sum(axis=0) / soma_pesos
+        media_y = np.where(validos, w * y_pares, 0.0).sum(axis=0) / soma_pesos
+        desvio_x = np.where(validos, x_pares - media_x, 0.0)
+        desvio_y = np.where(validos, y_pares - media_y, 0.0)
+        # Médias (ponderadas) dos quadrados e produtos dos desvios, como o np.cov(bias=1) do linregress
+        ssxm = (w * desvio_x * desvio_x).sum(axis=0) / soma_pesos
+        ssym = (w * desvio_y * desvio_y).sum(axis=0) / soma_pesos
+        ssxym = (w * desvio_x * desvio_y).sum(axis=0) / soma_pesos
+
+        r = np.clip(ssxym / np.sqrt(ssxm * ssym), -1.0, 1.0)
+        r = np.where((ssxm > 0) & (ssym > 0), r, np.nan)
+        inclinacao = np.where(ssxm > 0, ssxym / ssxm, np.nan)
+        intercepto = media_y - inclinacao * media_x
+
+        graus = n - 2
+        t = r * np.sqrt(graus / ((1.0 - r + TINY) * (1.0 + r + TINY)))
+        p = np.where(graus > 0, 2 * stats.t.sf(np.abs(t), np.maximum(graus, 1)), np.nan)
+        erro_padrao = np.where(graus > 0, np.sqrt((1 - r ** 2) * ssym / ssxm / graus), np.nan)
+
+    indice = pd.MultiIndex.from_product([indicadores, scores], names=['indicador', 'score'])
+    return pd.DataFrame({
+        'inclinacao': inclinacao.ravel(),
+        'intercepto': intercepto.ravel(),
+        'r': r.ravel(),
+        'p': p.ravel(),
+        'erro_padrao': erro_padrao.ravel(),
+        'n': n.ravel(),
+    }, index=indice)[COLUNAS_REGRESSAO]
+
+
+# Função para obter a regressão de um par a partir do resultado de regressoes_em_lote, como a tupla
+# (inclinacao, intercepto, r, p, erro_padrao) do stats.linregress. Levanta ValueError se o par não
+# tem pontos suficientes ou variação no score.
+def regressao(tabela, indicador, score):
+    linha = tabela.loc[(indicador, score)]
+    if linha['n'] < 3 or pd.isna(linha['inclinacao']):
+        raise ValueError(f"sem pontos suficientes ou sem variação em {score} para a regressão")
+    return tuple(float(linha[coluna]) for coluna in COLUNAS_REGRESSAO[:5])
+
+
+# Função para montar a matriz de correlação (r) entre colunas, no formato do DataFrame.corr()
+def matriz_correlacao(df, colunas, metodo='pearson', peso=None):
+    tabela = regressoes_em_lote(df, colunas, colunas, peso=peso, metodo=metodo)
+    matriz = tabela['r'].unstack('score').reindex(index=colunas, columns=colunas)
+    matriz.index.name = None
+    matriz.columns.name = None
+    # A diagonal é 1 por definição (exceto em colunas constantes, que ficam com NaN)
+    for coluna in colunas:
+        if pd.notna(matriz.loc[coluna, coluna]):
+            matriz.loc[coluna, coluna] = 1.0
+    return matriz
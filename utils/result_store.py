@@ -0,0 +1,258 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.data_cache import estimar_bytes
+
+logger = logging.getLogger(__name__)
+
+# Resultados calculados pelos painéis (agregações, taxas, tabelas) guardados por visão, isto é,
+# pela assinatura canônica dos filtros. Ficam em memória até ORCAMENTO_RESULTADOS_BYTES (despejo
+# LRU) e, com RESULTADOS_EM_DISCO, também em DIRETORIO_RESULTADOS, para sobreviver a reinícios.
+ORCAMENTO_RESULTADOS_BYTES = 512 * 1024 ** 2
+RESULTADOS_EM_DISCO = True
+DIRETORIO_RESULTADOS = 'data/cache_resultados'
+
+# Limite de espaço dos resultados no disco: ao passar dele, os arquivos usados há mais tempo são
+# apagados (inclusive os de versões antigas dos dados, que não são mais lidos). Temporários
+# deixados por gravações interrompidas são apagados depois de IDADE_TEMPORARIOS_S.
+ORCAMENTO_DISCO_RESULTADOS_BYTES = 2 * 1024 ** 3
+IDADE_TEMPORARIOS_S = 3600
+
+# Entradas por (assinatura, nome do resultado), da menos para a mais recentemente usada
+_trava = threading.Lock()
+_resultados = OrderedDict()
+_metricas = {'acertos_memoria': 0, 'acertos_disco': 0, 'falhas': 0, 'despejos': 0, 'tempo_calculo_s': 0.0}
+
+
+# Função para normalizar um valor de filtro: "Todos"/"Todas"/None viram None, números viram
+# inteiros e listas viram listas ordenadas, para que filtros equivalentes tenham a mesma assinatura
+def _normalizar(valor):
+    if isinstance(valor, (list, tuple, set)):
+        return sorted((_normalizar(item) for item in valor), key=repr)
+    if valor is None or (isinstance(valor, str) and valor in ("Todos", "Todas", "")):
+        return None
+    if hasattr(valor, 'item'):
+        valor = valor.item()
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if isinstance(valor, str) and valor.isdigit():
+        return int(valor)
+    return valor
+
+
+# Função para calcular a assinatura canônica de uma visão de um painel. filtros é o dicionário de
+# filtros_painel (período, UF, município, sexo, faixa etária, raça, diagnóstico e grupo CIR);
+# usar_raca_cor2 entra à parte porque também muda o agrupamento dos gráficos, e versao_dados
+# (por exemplo, a versão do recorte do SIH) faz resultados de dados antigos deixarem de ser usados.
+def assinatura_filtros(painel, filtros, usar_raca_cor2=False, versao_dados=None, **extras):
+    canonico = {
+        'painel': painel,
+        'filtros': {chave: _normalizar(valor) for chave, valor in filtros.items()},
+        'usar_raca_cor2': bool(usar_raca_cor2),
+        'versao_dados': repr(versao_dados),
+        'extras': {chave: _normalizar(valor) for chave, valor in extras.items()},
+    }
+    texto = json.dumps(canonico, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(texto.encode()).hexdigest()[:20]
+
+
+# Função para obter o caminho do arquivo de um resultado no disco
+def _caminho_disco(assinatura, nome):
+    return os.path.join(DIRETORIO_RESULTADOS, assinatura[:2], f"{assinatura}_{nome}.pkl")
+
+
+# Função para ler um resultado gravado no disco (None se ausente ou ilegível). A data de
+# modificação é atualizada, para que a poda do disco apague primeiro os menos usados.
+def _ler_disco(assinatura, nome):
+    caminho = _caminho_disco(assinatura, nome)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        with open(caminho, 'rb') as arquivo:
+            gravado = pickle.load(arquivo)
+        os.utime(caminho)
+        return gravado
+    except Exception as e:
+        logger.warning("Ignorando %s: %s", caminho, e)
+        return None
+
+
+# Função para gravar um resultado no disco (arquivo temporário + rename, atômico). O temporário
+# leva o processo e a thread, pois sessões diferentes podem gravar a mesma visão ao mesmo tempo.
+def _gravar_disco(assinatura, nome, valor):
+    caminho = _caminho_disco(assinatura, nome)
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'wb') as arquivo:
+            pickle.dump({'valor': valor}, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporario, caminho)
+    except Exception as e:
+        logger.warning("Não foi possível gravar %s: %s", caminho, e)
+        return
+    _podar_disco()
+
+
+# Função para manter os resultados do disco dentro de ORCAMENTO_DISCO_RESULTADOS_BYTES, apagando
+# os arquivos usados há mais tempo, e para apagar os temporários abandonados
+def _podar_disco():
+    arquivos = []
+    agora = time.time()
+    for raiz, _, nomes in os.walk(DIRETORIO_RESULTADOS):
+        for nome in nomes:
+            caminho = os.path.join(raiz, nome)
+            try:
+                estado = os.stat(caminho)
+                if nome.endswith('.tmp'):
+                    if agora - estado.st_mtime > IDADE_TEMPORARIOS_S:
+                        os.remove(caminho)
+                    continue
+            except OSError:
+                # Arquivo apagado ou substituído por outra sessão durante a varredura
+                continue
+            arquivos.append((estado.st_mtime, estado.st_size, caminho))
+
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= ORCAMENTO_DISCO_RESULTADOS_BYTES:
+            break
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+        total -= tamanho
+
+
+# Função para guardar um resultado em memória, despejando os menos recentemente usados
+# (com a trava adquirida)
+def _guardar(chave, valor):
+    _resultados[chave] = {'valor': valor, 'bytes': estimar_bytes(valor)}
+    _resultados.move_to_end(chave)
+    total = sum(entrada['bytes'] for entrada in _resultados.values())
+    while total > ORCAMENTO_RESULTADOS_BYTES and len(_resultados) > 1:
+        _, entrada = _resultados.popitem(last=False)
+        total -= entrada['bytes']
+        _metricas['despejos'] += 1
+
+
+# Função para verificar se o copy-on-write do pandas está em vigor: sempre a partir do 3.0 e,
+# antes dele, só quando ativado em pd.options.mode.copy_on_write
+def _copia_na_escrita():
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    try:
+        return pd.get_option('mode.copy_on_write') is True
+    except KeyError:  # OptionError (versões sem a opção) é subclasse de KeyError
+        return False
+
+
+# Função para entregar um resultado guardado. Com o copy-on-write do pandas, DataFrames e Series
+# (também dentro de tuplas, listas e dicionários) vão como cópias rasas, que podem ser alteradas
+# (colunas, índice, valores) sem afetar o resultado guardado. Sem ele, uma escrita em uma cópia
+# rasa alcançaria o resultado guardado, então o valor vai como cópia profunda.
+def _entregar(valor):
+    if not _copia_na_escrita():
+        return copy.deepcopy(valor)
+    return _entregar_copia_rasa(valor)
+
+
+# Função para copiar um resultado sem copiar os dados dos DataFrames e Series (ver _entregar)
+def _entregar_copia_rasa(valor):
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return valor.copy(deep=False)
+    if isinstance(valor, np.ndarray):
+        return valor.copy()
+    if isinstance(valor, (tuple, list)):
+        return type(valor)(_entregar_copia_rasa(item) for item in valor)
+    if isinstance(valor, dict):
+        return {chave: _entregar_copia_rasa(item) for chave, item in valor.items()}
+    return valor
+
+
+# Função para obter um resultado de uma visão: da memória, do disco ou calculando-o com
+# calcular(*args, **kwargs). Cada chamada recebe uma cópia (ver _entregar), que pode ser
+# alterada livremente.
+def obter_resultado(assinatura, nome, calcular, *args, **kwargs):
+    chave = (assinatura, nome)
+    with _trava:
+        entrada = _resultados.get(chave)
+        if entrada is not None:
+            _resultados.move_to_end(chave)
+            _metricas['acertos_memoria'] += 1
+            return _entregar(entrada['valor'])
+
+    if RESULTADOS_EM_DISCO:
+        gravado = _ler_disco(assinatura, nome)
+        if gravado is not None:
+            with _trava:
+                _guardar(chave, gravado['valor'])
+                _metricas['acertos_disco'] += 1
+            return _entregar(gravado['valor'])
+
+    inicio = time.perf_counter()
+    valor = calcular(*args, **kwargs)
+    duracao = time.perf_counter() - inicio
+    with _trava:
+        _guardar(chave, valor)
+        _metricas['falhas'] += 1
+        _metricas['tempo_calculo_s'] += duracao
+    if RESULTADOS_EM_DISCO:
+        _gravar_disco(assinatura, nome, valor)
+    return _entregar(valor)
+
+
+# Função para esvaziar os resultados em memória e, com disco=True, também os gravados no disco
+def limpar_resultados(disco=False):
+    with _trava:
+        _resultados.clear()
+    if disco and os.path.isdir(DIRETORIO_RESULTADOS):
+        shutil.rmtree(DIRETORIO_RESULTADOS, ignore_errors=True)
+
+
+# Função para obter as métricas do armazenamento de resultados
+def estatisticas_resultados():
+    with _trava:
+        metricas = dict(_metricas)
+        metricas['entradas'] = len(_resultados)
+        metricas['visoes'] = len({assinatura for assinatura, _ in _resultados})
+        metricas['bytes'] = sum(entrada['bytes'] for entrada in _resultados.values())
+
+    bytes_disco = 0
+    arquivos_disco = 0
+    if os.path.isdir(DIRETORIO_RESULTADOS):
+        for raiz, _, arquivos in os.walk(DIRETORIO_RESULTADOS):
+            for nome in arquivos:
+                bytes_disco += os.path.getsize(os.path.join(raiz, nome))
+                arquivos_disco += 1
+
+    pedidos = metricas['acertos_memoria'] + metricas['acertos_disco'] + metricas['falhas']
+    metricas['taxa_acerto'] = (metricas['acertos_memoria'] + metricas['acertos_disco']) / pedidos if pedidos else 0.0
+    metricas['tempo_medio_calculo_s'] = metricas['tempo_calculo_s'] / metricas['falhas'] if metricas['falhas'] else 0.0
+    metricas['orcamento_bytes'] = ORCAMENTO_RESULTADOS_BYTES
+    metricas['em_disco'] = RESULTADOS_EM_DISCO
+    metricas['arquivos_disco'] = arquivos_disco
+    metricas['bytes_disco'] = bytes_disco
+    return metricas
+
+
+# Função para adiar um cálculo até o primeiro uso e reaproveitá-lo nos usos seguintes (por
+# exemplo, as células filtradas, que só são necessárias quando algum resultado da visão falta)
+def sob_demanda(calcular, *args, **kwargs):
+    valor = []
+
+    def obter():
+        if not valor:
+            valor.append(calcular(*args, **kwargs))
+        return valor[0]
+    return obter
@@ -0,0 +1,570 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Caminhos padrão do extrato do SIH
+SIH_CSV_PATH = 'data/sih_2000_2024.csv'
+SIH_PARQUET_PATH = 'data/sih_parquet'
+
+# Recorte de saúde mental em Arrow IPC sem compressão, já no formato dos painéis (ver
+# _preparar_recorte_ipc). O arquivo é mapeado em memória: lido sem filtros, as colunas numéricas
+# do DataFrame apontam para as páginas do arquivo, que o sistema operacional compartilha entre os
+# processos. Os códigos das categóricas e as colunas derivadas são copiados uma vez por processo.
+SIH_IPC_PATH = 'data/sih_saude_mental.arrow'
+
+# Manifesto de versões dos dados do SIH: versão atual, versão da última conversão completa
+# (base) e a versão em que cada partição "ano/UF" foi alterada por ingestão incremental
+SIH_VERSAO_PATH = 'data/sih_versao.json'
+
+# Capítulo da CID-10 que define o recorte de saúde mental
+CAPITULO_SAUDE_MENTAL = 'Transtornos mentais e comportamentais'
+
+# Linhas lidas por bloco na leitura do CSV
+SIH_CHUNKSIZE = 500_000
+
+# Colunas usadas para particionar o dataset (ano de competência e UF de residência)
+SIH_PARTITION_COLUMNS = ['ANO_CMPT', 'res_CODIGO_UF']
+
+# Colunas do SIH lidas por cada painel. A leitura projeta apenas essas
+# colunas, evitando carregar campos financeiros e de UTI que nenhum painel usa.
+SIH_COLUNAS_COMUNS = [
+    'ANO_CMPT', 'MUNIC_RES', 'res_CODIGO_UF', 'SEXO', 'IDADE', 'RACA_COR',
+    'def_diag_princ_cap', 'def_diag_princ_grupo', 'def_diag_princ_cat',
+]
+SIH_COLUNAS_PAINEIS = {
+    'morbidade_internacoes': SIH_COLUNAS_COMUNS + [
+        'MORTE', 'DIAS_PERM', 'def_diag_princ_subcat', 'def_regime', 'def_raca_cor',
+        'res_LATITUDE', 'res_LONGITUDE',
+    ],
+    'relacao_idsc': SIH_COLUNAS_COMUNS + ['MORTE', 'DIAS_PERM', 'def_diag_princ_subcat', 'def_raca_cor'],
+    'indicadores_saude_mental': SIH_COLUNAS_COMUNS + ['MORTE', 'DIAS_PERM', 'def_diag_princ_subcategoria'],
+    'grupo_cir': SIH_COLUNAS_COMUNS + ['MORTE', 'DIAS_PERM', 'def_diag_princ_subcategoria'],
+    'grupo_cir_with_taxa': SIH_COLUNAS_COMUNS + ['MORTE', 'DIAS_PERM', 'def_diag_princ_subcategoria'],
+    'icaps_analysis': SIH_COLUNAS_COMUNS + ['def_diag_princ_subcategoria'],
+    'iraps_analysis': SIH_COLUNAS_COMUNS + ['def_diag_princ_subcategoria'],
+}
+
+# Tipo usado para as colunas de texto repetitivo (categóricas no pandas)
+TIPO_CATEGORIA = pa.dictionary(pa.int32(), pa.string())
+
+# Schema declarado do SIH. Colunas "def_*" que não estiverem listadas aqui
+# também são gravadas como categóricas; as demais colunas desconhecidas
+# são gravadas como texto.
+SIH_SCHEMA = {
+    # Competência
+    'ANO_CMPT': pa.int16(),
+    'MES_CMPT': pa.int8(),
+    # Códigos geográficos
+    'MUNIC_RES': pa.int32(),
+    'MUNIC_MOV': pa.int32(),
+    'res_CODIGO_UF': pa.int8(),
+    'res_LATITUDE': pa.float32(),
+    'res_LONGITUDE': pa.float32(),
+    # Dados demográficos
+    'SEXO': pa.int8(),
+    'IDADE': pa.int16(),
+    'RACA_COR': pa.int8(),
+    'NACIONAL': pa.int16(),
+    # Desfecho e permanência
+    'MORTE': pa.int8(),
+    'DIAS_PERM': pa.int32(),
+    'dt_inter': pa.timestamp('ms'),
+    # Dados financeiros
+    'VAL_SH': pa.float32(),
+    'VAL_SP': pa.float32(),
+    'VAL_TOT': pa.float32(),
+    'VAL_UTI': pa.float32(),
+    # UTI
+    'UTI_MES_TO': pa.int16(),
+    'MARCA_UTI': pa.int16(),
+    # Diagnóstico e regime (texto repetitivo)
+    'def_diag_princ_cap': TIPO_CATEGORIA,
+    'def_diag_princ_grupo': TIPO_CATEGORIA,
+    'def_diag_princ_cat': TIPO_CATEGORIA,
+    'def_diag_princ_subcat': TIPO_CATEGORIA,
+    'def_diag_princ_subcategoria': TIPO_CATEGORIA,
+    'def_regime': TIPO_CATEGORIA,
+    'def_raca_cor': TIPO_CATEGORIA,
+    'def_sexo': TIPO_CATEGORIA,
+}
+
+
+# Função para obter o tipo Arrow de uma coluna do SIH
+def tipo_coluna_sih(coluna):
+    if coluna in SIH_SCHEMA:
+        return SIH_SCHEMA[coluna]
+    if coluna.startswith('def_'):
+        return TIPO_CATEGORIA
+    return pa.string()
+
+
+# Função para montar o schema Arrow a partir das colunas presentes no CSV
+def montar_schema_sih(colunas):
+    return pa.schema([pa.field(coluna, tipo_coluna_sih(coluna)) for coluna in colunas])
+
+
+# Função para converter uma coluna do pandas para o tipo Arrow declarado
+def _converter_coluna(serie, tipo):
+    if pa.types.is_dictionary(tipo) or pa.types.is_string(tipo):
+        valores = serie.astype('string')
+        return pa.array(valores, type=tipo, from_pandas=True)
+    if pa.types.is_timestamp(tipo):
+        valores = pd.to_datetime(serie, errors='coerce')
+        return pa.array(valores, from_pandas=True).cast(tipo)
+    # Colunas numéricas: valores inválidos viram nulos. Valores fora da faixa do tipo (por exemplo,
+    # sentinelas corrompidas) e, em colunas inteiras, valores fracionários também viram nulos, em vez
+    # de serem truncados ou estourarem para outro número
+    valores = pd.to_numeric(serie, errors='coerce').astype('float64')
+    if pa.types.is_integer(tipo):
+        limites = np.iinfo(tipo.to_pandas_dtype())
+        valores = valores.where((valores >= limites.min) & (valores < float(limites.max) + 1) & (valores % 1 == 0))
+    elif pa.types.is_floating(tipo):
+        valores = valores.where(valores.abs() <= np.finfo(tipo.to_pandas_dtype()).max)
+    return pa.array(valores.to_numpy(), from_pandas=True).cast(tipo, safe=True)
+
+
+# Função para converter um bloco do CSV em tabela Arrow com o schema declarado
+def converter_bloco_sih(bloco, schema):
+    arrays = [_converter_coluna(bloco[campo.name], campo.type) for campo in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+# Função para obter o particionamento (hive) do dataset do SIH
+def particionamento_sih():
+    return ds.partitioning(
+        pa.schema([pa.field(coluna, SIH_SCHEMA[coluna]) for coluna in SIH_PARTITION_COLUMNS]),
+        flavor='hive'
+    )
+
+
+# Função para converter o CSV do SIH em Parquet tipado, particionado por ano e UF
+def converter_sih_para_parquet(csv_path=SIH_CSV_PATH, parquet_path=SIH_PARQUET_PATH, chunksize=500_000):
+    colunas = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    schema = montar_schema_sih(colunas)
+
+    # Ler tudo como texto evita que o pandas infira tipos diferentes em cada bloco
+    leitor = pd.read_csv(csv_path, dtype=str, chunksize=chunksize)
+
+    total_linhas = 0
+
+    def blocos_convertidos():
+        nonlocal total_linhas
+        for bloco in leitor:
+            total_linhas += len(bloco)
+            yield from converter_bloco_sih(bloco, schema).to_batches()
+
+    # Cada partição (ANO_CMPT=.../res_CODIGO_UF=...) recebe um arquivo com vários row groups
+    tmp_path = parquet_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    ds.write_dataset(
+        blocos_convertidos(),
+        tmp_path,
+        schema=schema,
+        format='parquet',
+        partitioning=particionamento_sih(),
+        file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+        max_partitions=4096,
+    )
+
+    # Substituir o dataset final apenas quando a conversão terminar
+    shutil.rmtree(parquet_path, ignore_errors=True)
+    os.replace(tmp_path, parquet_path)
+
+    # Uma conversão completa invalida todos os recortes
+    versoes = ler_versoes_sih()
+    versao = versoes['versao'] + 1
+    _gravar_versoes_sih({'versao': versao, 'base': versao, 'particoes': {}, 'atualizado_em': time.time()})
+    return total_linhas
+
+
+# Manifestos de versão já lidos neste processo, por (caminho, data de modificação)
+_versoes_lidas = {}
+
+
+# Função para ler o manifesto de versões do SIH (versão 0 quando ainda não há manifesto)
+def ler_versoes_sih(versao_path=SIH_VERSAO_PATH):
+    if not os.path.isfile(versao_path):
+        return {'versao': 0, 'base': 0, 'particoes': {}}
+    chave = (versao_path, os.path.getmtime(versao_path))
+    if chave not in _versoes_lidas:
+        _versoes_lidas.clear()
+        with open(versao_path, encoding='utf-8') as arquivo:
+            _versoes_lidas[chave] = json.load(arquivo)
+    return _versoes_lidas[chave]
+
+
+# Função para gravar o manifesto de versões sem deixar um arquivo pela metade
+def _gravar_versoes_sih(versoes, versao_path=SIH_VERSAO_PATH):
+    tmp_path = versao_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as arquivo:
+        json.dump(versoes, arquivo, indent=2, sort_keys=True)
+    os.replace(tmp_path, versao_path)
+
+
+# Função para obter a versão de um recorte (período e UF): a maior versão entre as partições
+# do recorte. Só muda quando uma ingestão altera alguma partição coberta pelo recorte, então
+# serve de chave de cache para os dados, índices e cubos montados a partir dele.
+def versao_recorte_sih(year_range=None, estado=None, versao_path=SIH_VERSAO_PATH):
+    versoes = ler_versoes_sih(versao_path)
+    versao = versoes['base']
+    for particao, versao_particao in versoes['particoes'].items():
+        ano, uf = (int(parte) for parte in particao.split('/'))
+        if year_range and not int(year_range[0]) <= ano <= int(year_range[1]):
+            continue
+        if estado and uf != int(estado):
+            continue
+        versao = max(versao, versao_particao)
+    return versao
+
+
+# Função para montar a máscara das linhas de uma tabela Arrow que pertencem às competências
+# substituídas por um lote (ano/UF da partição e, quando houver, mês de competência)
+def _mascara_competencias(tabela, competencias):
+    mascara = None
+    for (ano, uf), meses in competencias.items():
+        condicao = pc.and_(pc.equal(tabela['ANO_CMPT'], ano), pc.equal(tabela['res_CODIGO_UF'], uf))
+        if meses is not None:
+            condicao = pc.and_(condicao, pc.is_in(tabela['MES_CMPT'], value_set=pa.array(meses, pa.int8())))
+        mascara = condicao if mascara is None else pc.or_(mascara, condicao)
+    return pc.fill_null(mascara, False)
+
+
+# Função para ler um lote de competências em CSV com o schema declarado
+def _ler_lote_sih(csv_path, chunksize=SIH_CHUNKSIZE):
+    colunas = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    schema = montar_schema_sih(colunas)
+    blocos = [converter_bloco_sih(bloco, schema)
+              for bloco in pd.read_csv(csv_path, dtype=str, chunksize=chunksize)]
+    return pa.concat_tables(blocos) if blocos else schema.empty_table()
+
+
+# Função para anexar um lote de competências (CSV no layout do extrato) ao dataset Parquet.
+# Só as partições ano/UF presentes no lote são regravadas: nelas, as linhas das competências do
+# lote (ano e, se houver MES_CMPT, mês) são substituídas pelas do lote, de modo que reenviar um
+# lote não duplica internações. O recorte IPC de saúde mental é atualizado a partir do próprio
+# arquivo, sem reler o dataset, e o manifesto registra a nova versão das partições alteradas.
+def anexar_competencias_sih(csv_path, parquet_path=SIH_PARQUET_PATH, ipc_path=SIH_IPC_PATH,
+                            versao_path=SIH_VERSAO_PATH, chunksize=SIH_CHUNKSIZE):
+    lote = _ler_lote_sih(csv_path, chunksize)
+    lote = lote.filter(pc.and_(pc.is_valid(lote['ANO_CMPT']), pc.is_valid(lote['res_CODIGO_UF'])))
+
+    # Competências do lote por partição: {(ano, uf): meses ou None para o ano inteiro}
+    chaves = ['ANO_CMPT', 'res_CODIGO_UF'] + (['MES_CMPT'] if 'MES_CMPT' in lote.column_names else [])
+    combinacoes = lote.select(chaves).group_by(chaves).aggregate([]).to_pylist()
+    competencias = {}
+    for linha in combinacoes:
+        particao = (linha['ANO_CMPT'], linha['res_CODIGO_UF'])
+        if 'MES_CMPT' in linha and linha['MES_CMPT'] is not None:
+            competencias.setdefault(particao, [])
+            if competencias[particao] is not None:
+                competencias[particao].append(linha['MES_CMPT'])
+        else:
+            competencias[particao] = None
+
+    # Regravar cada partição afetada (as colunas de partição ficam só no caminho, como no hive)
+    for (ano, uf), meses in competencias.items():
+        diretorio = os.path.join(parquet_path, f'ANO_CMPT={ano}', f'res_CODIGO_UF={uf}')
+        novas = lote.filter(_mascara_competencias(lote, {(ano, uf): None}))
+        novas = novas.drop_columns(SIH_PARTITION_COLUMNS)
+        partes = [novas]
+        if os.path.isdir(diretorio):
+            existentes = ds.dataset(diretorio, format='parquet').to_table()
+            if meses is None:
+                existentes = existentes.slice(0, 0)
+            elif 'MES_CMPT' in existentes.column_names:
+                manter = pc.invert(pc.fill_null(
+                    pc.is_in(existentes['MES_CMPT'], value_set=pa.array(meses, pa.int8())), False))
+                existentes = existentes.filter(manter)
+            partes.insert(0, existentes)
+        tabela = pa.concat_tables(partes, promote_options='permissive')
+
+        tmp_path = diretorio + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        pq.write_table(tabela, os.path.join(tmp_path, 'part-0.parquet'), compression='zstd')
+        shutil.rmtree(diretorio, ignore_errors=True)
+        os.replace(tmp_path, diretorio)
+
+    # Atualizar o recorte de saúde mental: remover as competências substituídas e anexar as novas
+    if os.path.isfile(ipc_path):
+        atual = abrir_sih_compartilhado(ipc_path)
+        atual = atual.filter(pc.invert(_mascara_competencias(atual, competencias)))
+        novas = lote.filter(_expressao_filtros_sih(None, somente_saude_mental=True))
+        novas = novas.select([coluna for coluna in atual.column_names if coluna in novas.column_names])
+        novas = _preparar_recorte_ipc(novas)
+        tabela = _preparar_recorte_ipc(pa.concat_tables([atual, novas], promote_options='permissive'))
+        tmp_path = ipc_path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as destino:
+            with pa.ipc.new_file(destino, tabela.schema) as escritor:
+                escritor.write_table(tabela)
+        os.replace(tmp_path, ipc_path)
+
+    # Nova versão apenas para as partições alteradas
+    versoes = ler_versoes_sih(versao_path)
+    versao = versoes['versao'] + 1
+    particoes = dict(versoes['particoes'])
+    for ano, uf in competencias:
+        particoes[f'{ano}/{uf}'] = versao
+    _gravar_versoes_sih({'versao': versao, 'base': versoes['base'], 'particoes': particoes,
+                         'atualizado_em': time.time()}, versao_path)
+    return {'linhas': lote.num_rows, 'particoes': sorted(competencias), 'versao': versao}
+
+
+# Função para reduzir uma coluna numérica ao menor tipo que guarda os valores sem perda. Uma coluna
+# que já está no menor tipo é devolvida como está, sem cópia.
+def reduzir_coluna_numerica(serie):
+    if pd.api.types.is_bool_dtype(serie) or not pd.api.types.is_numeric_dtype(serie):
+        return serie
+    if pd.api.types.is_integer_dtype(serie):
+        nova = pd.to_numeric(serie, downcast='integer')
+        return serie if nova.dtype == serie.dtype else nova
+
+    # Colunas float com valores inteiros (ex.: IDADE com nulos)
+    valores = serie.dropna()
+    if not (valores == valores.round()).all():
+        return serie
+    if len(valores) == len(serie):
+        return pd.to_numeric(serie.astype('int64'), downcast='integer')
+    # float32 representa inteiros exatamente até 2**24
+    if serie.dtype != 'float32' and (valores.empty or valores.abs().max() < 2 ** 24):
+        return serie.astype('float32')
+    return serie
+
+
+# Função para reduzir uma coluna categórica do recorte IPC aos valores presentes, com os índices
+# no menor tipo inteiro (a ordem do dicionário é mantida)
+def _compactar_dicionario(coluna):
+    usados = pc.unique(coluna.indices).drop_null()
+    usados = usados.take(pc.sort_indices(usados))
+    indices = pc.index_in(coluna.indices, value_set=usados)
+    tipo = pa.int8() if len(usados) < 2 ** 7 else pa.int16() if len(usados) < 2 ** 15 else pa.int32()
+    return pa.DictionaryArray.from_arrays(indices.cast(tipo), coluna.dictionary.take(usados))
+
+
+# Função para deixar o recorte IPC no formato em que os painéis o usam, de modo que a conversão
+# para o pandas não precise copiar as colunas numéricas: linhas em ordem de ano e UF, código de
+# município canônico (6 dígitos), descrição de raça/cor (RACA_COR_DESC), números no menor tipo e
+# sem máscara de nulos (nulos viram NaN, em float32 quando os valores são inteiros) e dicionários
+# só com os valores presentes
+def _preparar_recorte_ipc(tabela):
+    # O formato de arquivo IPC exige um único dicionário por coluna categórica
+    tabela = tabela.unify_dictionaries()
+    ordem = [(coluna, 'ascending') for coluna in SIH_PARTITION_COLUMNS if coluna in tabela.column_names]
+    if ordem:
+        tabela = tabela.take(pc.sort_indices(tabela, sort_keys=ordem))
+
+    colunas = {}
+    for nome in tabela.column_names:
+        coluna = tabela[nome].combine_chunks()
+        if nome == 'MUNIC_RES':
+            sem_digito = pc.divide(coluna, 10)
+            if pa.types.is_floating(coluna.type):
+                sem_digito = pc.floor(sem_digito)
+            coluna = pc.if_else(pc.greater_equal(coluna, 1_000_000), sem_digito, coluna)
+        if pa.types.is_integer(coluna.type) or pa.types.is_floating(coluna.type):
+            coluna = pa.array(reduzir_coluna_numerica(coluna.to_pandas()).to_numpy(), from_pandas=False)
+        elif pa.types.is_dictionary(coluna.type):
+            coluna = _compactar_dicionario(coluna)
+        colunas[nome] = coluna
+
+    if 'RACA_COR' in colunas:
+        racas = pd.Series(colunas['RACA_COR'].to_numpy(zero_copy_only=False)).map(RACE_MAPPING)
+        colunas['RACA_COR_DESC'] = pa.array(racas.astype('category')).cast(pa.dictionary(pa.int8(), pa.string()))
+    return pa.table(colunas)
+
+
+# Função para exportar o recorte de saúde mental do dataset Parquet para Arrow IPC
+def exportar_sih_ipc(parquet_path=SIH_PARQUET_PATH, ipc_path=SIH_IPC_PATH):
+    dataset = ds.dataset(parquet_path, format='parquet', partitioning=particionamento_sih())
+    tabela = dataset.to_table(filter=_expressao_filtros_sih(None, somente_saude_mental=True))
+    tabela = _preparar_recorte_ipc(tabela)
+
+    tmp_path = ipc_path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as destino:
+        with pa.ipc.new_file(destino, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+    os.replace(tmp_path, ipc_path)
+    return tabela.num_rows
+
+
+# Tabelas IPC já mapeadas neste processo, por (caminho, data de modificação)
+_tabelas_mapeadas = {}
+
+
+# Função para abrir o recorte de saúde mental mapeado em memória (sem cópia).
+# Um novo arquivo gravado por exportar_sih_ipc é detectado pela data de modificação.
+def abrir_sih_compartilhado(ipc_path=SIH_IPC_PATH):
+    chave = (ipc_path, os.path.getmtime(ipc_path))
+    if chave not in _tabelas_mapeadas:
+        _tabelas_mapeadas.clear()
+        fonte = pa.memory_map(ipc_path, 'r')
+        _tabelas_mapeadas[chave] = pa.ipc.open_file(fonte).read_all()
+    return _tabelas_mapeadas[chave]
+
+
+# Função para verificar se o arquivo IPC existe e não é mais antigo que o dataset Parquet
+def sih_ipc_disponivel(ipc_path=SIH_IPC_PATH, parquet_path=SIH_PARQUET_PATH):
+    if not os.path.isfile(ipc_path):
+        return False
+    if os.path.isdir(parquet_path):
+        return os.path.getmtime(ipc_path) >= os.path.getmtime(parquet_path)
+    return True
+
+
+# Função para montar os filtros de leitura a partir dos filtros da barra lateral
+def montar_filtros_sih(year_range=None, estado=None, codigo_municipio=None):
+    filtros = []
+    if year_range:
+        filtros.append(('ANO_CMPT', '>=', int(year_range[0])))
+        filtros.append(('ANO_CMPT', '<=', int(year_range[1])))
+    if estado:
+        filtros.append(('res_CODIGO_UF', '=', int(estado)))
+    if codigo_municipio:
+        filtros.append(('MUNIC_RES', '=', int(codigo_municipio)))
+    return filtros or None
+
+
+# Função para aplicar em memória os mesmos filtros (leitura a partir do CSV)
+def _aplicar_filtros_sih(df, filtros):
+    for coluna, operador, valor in filtros or []:
+        if operador == '>=':
+            df = df[df[coluna] >= valor]
+        elif operador == '<=':
+            df = df[df[coluna] <= valor]
+        else:
+            df = df[df[coluna] == valor]
+    return df
+
+
+# Função para obter as colunas do SIH declaradas para um painel (None = todas)
+def colunas_sih_painel(painel=None):
+    if painel is None:
+        return None
+    return list(SIH_COLUNAS_PAINEIS[painel])
+
+
+# Função para obter a união das colunas declaradas para os painéis, na ordem em que aparecem
+def colunas_sih_paineis():
+    return list(dict.fromkeys(coluna for colunas in SIH_COLUNAS_PAINEIS.values() for coluna in colunas))
+
+
+# Função para montar a expressão de filtro do dataset Parquet
+def _expressao_filtros_sih(filtros, somente_saude_mental=False):
+    expressao = pq.filters_to_expression(filtros) if filtros else None
+    if somente_saude_mental:
+        capitulo = pc.match_substring(ds.field('def_diag_princ_cap').cast(pa.string()),
+                                      CAPITULO_SAUDE_MENTAL)
+        expressao = capitulo if expressao is None else expressao & capitulo
+    return expressao
+
+
+# Função para ler o SIH, preferindo o recorte IPC compartilhado (para saúde mental),
+# depois o dataset Parquet particionado e por fim o CSV.
+# Os filtros de ano e UF selecionam apenas as partições correspondentes; o filtro
+# de município usa as estatísticas dos row groups. Colunas pedidas que não
+# existem no extrato são ignoradas.
+# Com somente_saude_mental=True o recorte do capítulo é aplicado durante a leitura,
+# bloco a bloco, de modo que apenas as internações psiquiátricas ficam em memória.
+def read_sih(columns=None, year_range=None, estado=None, codigo_municipio=None,
+             somente_saude_mental=False, chunksize=SIH_CHUNKSIZE):
+    filtros = montar_filtros_sih(year_range, estado, codigo_municipio)
+    dataset = None
+    if somente_saude_mental and sih_ipc_disponivel():
+        # O arquivo IPC já contém apenas o recorte de saúde mental. Sem filtros, a projeção das
+        # colunas não copia nada e o pandas usa as colunas numéricas direto do arquivo mapeado
+        tabela = abrir_sih_compartilhado()
+        if not filtros:
+            if columns is not None:
+                tabela = tabela.select([coluna for coluna in columns if coluna in tabela.column_names])
+            return tabela.to_pandas(split_blocks=True)
+        dataset = ds.dataset(tabela)
+        expressao = _expressao_filtros_sih(filtros)
+    elif os.path.isdir(SIH_PARQUET_PATH):
+        dataset = ds.dataset(SIH_PARQUET_PATH, format='parquet', partitioning=particionamento_sih())
+        expressao = _expressao_filtros_sih(filtros, somente_saude_mental)
+
+    if dataset is not None:
+        if columns is not None:
+            columns = [coluna for coluna in columns if coluna in dataset.schema.names]
+        # O scanner lê e filtra um lote por vez; só os lotes filtrados são acumulados
+        tabela = dataset.to_table(columns=columns, filter=expressao, batch_size=chunksize)
+        return tabela.to_pandas()
+
+    # No CSV as colunas dos filtros também precisam ser lidas
+    usecols = None
+    if columns is not None:
+        necessarias = set(columns) | {coluna for coluna, _, _ in filtros or []}
+        if somente_saude_mental:
+            necessarias.add('def_diag_princ_cap')
+        usecols = lambda coluna: coluna in necessarias
+
+    blocos = []
+    for bloco in pd.read_csv(SIH_CSV_PATH, low_memory=False, usecols=usecols, chunksize=chunksize):
+        bloco = _aplicar_filtros_sih(bloco, filtros)
+        if somente_saude_mental:
+            bloco = filtrar_saude_mental(bloco)
+        blocos.append(bloco)
+    return pd.concat(blocos, ignore_index=True)
+
+
+# Função para listar os anos de competência disponíveis sem ler os dados
+def listar_anos_sih():
+    if os.path.isdir(SIH_PARQUET_PATH):
+        prefixo = 'ANO_CMPT='
+        return sorted(
+            int(nome[len(prefixo):]) for nome in os.listdir(SIH_PARQUET_PATH)
+            if nome.startswith(prefixo) and nome[len(prefixo):].isdigit()
+        )
+    anos = pd.read_csv(SIH_CSV_PATH, usecols=['ANO_CMPT'])['ANO_CMPT'].dropna().unique()
+    return sorted(int(ano) for ano in anos)
+
+
+# Função para manter apenas as internações por transtornos mentais
+def filtrar_saude_mental(df):
+    return df[df['def_diag_princ_cap'].str.contains(CAPITULO_SAUDE_MENTAL, na=False)]
+
+
+# Mapeamento dos códigos de raça/cor para descrições
+RACE_MAPPING = {
+    1: 'Branca',
+    2: 'Preta',
+    3: 'Parda',
+    4: 'Amarela',
+    5: 'Indígena',
+    9: 'Sem informação'
+}
+
+
+# Função para carregar as internações psiquiátricas do SIH
+def load_mental_health_data(columns=None, year_range=None, estado=None):
+    # O capítulo do diagnóstico é sempre lido, pois define o recorte de saúde mental
+    if columns is not None and 'def_diag_princ_cap' not in columns:
+        columns = list(columns) + ['def_diag_princ_cap']
+    # A descrição de raça/cor já vem pronta no recorte IPC
+    if columns is not None and 'RACA_COR' in columns and 'RACA_COR_DESC' not in columns:
+        columns = list(columns) + ['RACA_COR_DESC']
+    # Filter for psychiatric conditions (Transtornos mentais e comportamentais) durante a leitura
+    mental_health_df = read_sih(columns=columns, year_range=year_range, estado=estado,
+                                somente_saude_mental=True)
+
+    # Convert date columns if needed (o Parquet já guarda a data tipada)
+    if 'dt_inter' in mental_health_df.columns and not pd.api.types.is_datetime64_any_dtype(mental_health_df['dt_inter']):
+        mental_health_df['dt_inter'] = pd.to_datetime(mental_health_df['dt_inter'])
+
+    # Descartar categorias que só existem fora do capítulo de saúde mental
+    for coluna in mental_health_df.select_dtypes('category').columns:
+        mental_health_df[coluna] = mental_health_df[coluna].cat.remove_unused_categories()
+
+    # Check if race column exists
+    if 'RACA_COR' in mental_health_df.columns and 'RACA_COR_DESC' not in mental_health_df.columns:
+        mental_health_df['RACA_COR_DESC'] = mental_health_df['RACA_COR'].map(RACE_MAPPING)
+
+    return mental_health_df